@@ -0,0 +1,177 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from heapq import nlargest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api.cache import get_versions, versions_cache
+from recipes.models import Ingredient, RecipeIngredient
+
+RANKING_NAME = 'name'
+RANKING_POPULAR = 'popular'
+RANKING_PERSONAL = 'personal'
+RANKINGS = (RANKING_NAME, RANKING_POPULAR, RANKING_PERSONAL)
+HISTORY_KEY = 'api:ingredient_history:{user}:{version}'
+USAGE_SEQUENCE_KEY = 'api:ingredient_usage:sequence'
+USAGE_CHANGE_KEY = 'api:ingredient_usage:change:{sequence}'
+
+
+def get_usage_sequence():
+    versions_cache.add(USAGE_SEQUENCE_KEY, time.time_ns(), timeout=None)
+    return versions_cache.get(USAGE_SEQUENCE_KEY)
+
+
+def publish_usage(deltas):
+    try:
+        sequence = versions_cache.incr(USAGE_SEQUENCE_KEY)
+    except ValueError:
+        reset_usage_journal()
+        return
+    if not versions_cache.add(USAGE_CHANGE_KEY.format(sequence=sequence),
+                              deltas, settings.COOKABLE_JOURNAL_TIMEOUT):
+        reset_usage_journal()
+
+
+def reset_usage_journal():
+    """Для записей в обход журнала: процессы перестроят индекс."""
+    versions_cache.set(USAGE_SEQUENCE_KEY, time.time_ns(), timeout=None)
+
+
+def record_usage(deltas):
+    """Записывает в журнал приращения usage_count {ingredient_id: delta}."""
+    deltas = {ingredient_id: delta
+              for ingredient_id, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: publish_usage(deltas))
+
+
+def get_user_history(user):
+    """Сколько раз автор использовал каждый ингредиент в своих рецептах."""
+    key = HISTORY_KEY.format(user=user.id,
+                             version=get_versions(('recipes',))[0])
+    history = cache.get(key)
+    if history is None:
+        history = Counter(RecipeIngredient.objects.filter(
+            recipe__author=user).values_list('ingredient_id', flat=True))
+        cache.set(key, history, settings.RECIPES_CACHE_TIMEOUT)
+    return history
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строится лениво из таблицы Ingredient и перестраивается, когда
+    меняется версия области кэша ingredients. Изменения usage_count
+    применяются на месте из журнала приращений; если журнал прерван,
+    индекс строится заново.
+    """
+    scopes = ('ingredients',)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._sequence = None
+        self._positions = {}
+        self._entries = ([], [], [])
+
+    def build(self):
+        rows = Ingredient.objects.values(
+            'id', 'name', 'measurement_unit', 'usage_count').order_by()
+        entries = sorted(
+            ((row['name'].casefold(), row['id']), row) for row in rows)
+        self._positions = {row['id']: position
+                           for position, (_, row) in enumerate(entries)}
+        self._entries = (
+            [key for key, _ in entries],
+            [{'id': row['id'], 'name': row['name'],
+              'measurement_unit': row['measurement_unit']}
+             for _, row in entries],
+            [row['usage_count'] for _, row in entries],
+        )
+
+    def get_changes(self, sequence):
+        """Суммарные приращения после self._sequence или None."""
+        if (self._sequence is None or sequence < self._sequence
+                or sequence - self._sequence
+                > settings.COOKABLE_JOURNAL_LIMIT):
+            return None
+        keys = [USAGE_CHANGE_KEY.format(sequence=number)
+                for number in range(self._sequence + 1, sequence + 1)]
+        changes = versions_cache.get_many(keys)
+        if len(changes) != len(keys):
+            return None
+        total = Counter()
+        for deltas in changes.values():
+            total.update(deltas)
+        return total
+
+    def apply(self, deltas):
+        usage = self._entries[2]
+        for ingredient_id, delta in deltas.items():
+            position = self._positions.get(ingredient_id)
+            if position is not None:
+                usage[position] += delta
+
+    def ensure_fresh(self):
+        # Номер журнала читается до построения: изменения, записанные
+        # после него, применятся при следующем запросе.
+        version = get_versions(self.scopes)
+        sequence = get_usage_sequence()
+        if version == self._version and sequence == self._sequence:
+            return
+        with self._lock:
+            if version != self._version:
+                self.build()
+            elif self._sequence is not None and sequence <= self._sequence:
+                # Другой поток уже применил этот или более новый журнал.
+                return
+            else:
+                changes = self.get_changes(sequence)
+                if changes is None:
+                    self.build()
+                else:
+                    self.apply(changes)
+            self._version = version
+            self._sequence = sequence
+
+    def search(self, query, limit, ranking=RANKING_NAME, history=None):
+        self.ensure_fresh()
+        keys, items, usage = self._entries
+        query = query.casefold()
+        position = bisect_left(keys, (query,))
+        prefix = []
+        while (position < len(keys)
+               and keys[position][0].startswith(query)):
+            prefix.append(position)
+            position += 1
+        if ranking == RANKING_NAME:
+            positions = prefix[:limit]
+            if len(positions) < limit:
+                positions += [
+                    position for position, (name, _) in enumerate(keys)
+                    if query in name and not name.startswith(query)
+                ][:limit - len(positions)]
+            return [items[position] for position in positions]
+
+        history = history or {}
+
+        def score(position):
+            return (usage[position]
+                    + settings.INGREDIENT_HISTORY_BOOST
+                    * history.get(keys[position][1], 0))
+
+        positions = nlargest(limit, prefix, key=score)
+        if len(positions) < limit:
+            positions += nlargest(
+                limit - len(positions),
+                (position for position, (name, _) in enumerate(keys)
+                 if query in name and not name.startswith(query)),
+                key=score)
+        return [items[position] for position in positions]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,163 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.connection import ConnectionProxy
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = 'api:version:{scope}'
+MODIFIED_KEY = 'api:modified:{scope}'
+RESPONSE_KEY = 'api:response:{digest}'
+LOCK_KEY = '{key}:lock'
+USER_SCOPE = 'user:{user}'
+# Версии и журналы хранятся отдельно от ответов, без вытеснения.
+versions_cache = ConnectionProxy(caches, 'versions')
+
+
+def get_or_init_many(keys, initial):
+    values = versions_cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            versions_cache.add(key, initial(), timeout=None)
+            values[key] = versions_cache.get(key)
+    return [values[key] for key in keys]
+
+
+def get_versions(scopes):
+    return get_or_init_many(
+        [VERSION_KEY.format(scope=scope) for scope in scopes], time.time_ns)
+
+
+def get_last_modified(scopes):
+    return int(max(get_or_init_many(
+        [MODIFIED_KEY.format(scope=scope) for scope in scopes], time.time)))
+
+
+def bump_versions(*scopes):
+    now = time.time()
+    for scope in scopes:
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            versions_cache.incr(key)
+        except ValueError:
+            versions_cache.set(key, time.time_ns(), timeout=None)
+        versions_cache.set(MODIFIED_KEY.format(scope=scope), now,
+                           timeout=None)
+
+
+def invalidate(*scopes):
+    transaction.on_commit(lambda: bump_versions(*scopes))
+
+
+def get_request_digest(request, *extra):
+    params = sorted(
+        (key, sorted(values))
+        for key, values in request.query_params.lists())
+    raw = repr((request.path.rstrip('/'), params, *extra))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get_response_key(scopes, request):
+    return RESPONSE_KEY.format(
+        digest=get_request_digest(request, get_versions(scopes)))
+
+
+def get_or_compute(key, compute, timeout):
+    """Single-flight: пересчитывает значение только один запрос."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock_key = LOCK_KEY.format(key=key)
+    deadline = time.monotonic() + settings.API_CACHE_LOCK_TIMEOUT
+    locked = cache.add(lock_key, 1, settings.API_CACHE_LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(settings.API_CACHE_LOCK_POLL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        locked = cache.add(lock_key, 1, settings.API_CACHE_LOCK_TIMEOUT)
+    try:
+        value, cacheable = compute()
+        if cacheable:
+            cache.set(key, value, timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+class AnonymousCacheMixin:
+    cache_scopes = ()
+    cache_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_scopes(self, request):
+        return self.cache_scopes
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        def compute():
+            response = handler(request, *args, **kwargs)
+            return ((response.status_code, response.data),
+                    response.status_code == status.HTTP_200_OK)
+
+        status_code, data = get_or_compute(
+            get_response_key(self.get_cache_scopes(request), request),
+            compute, self.cache_timeout)
+        return Response(data, status=status_code)
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified по версиям таблиц, без рендеринга ответа."""
+    cache_scopes = ()
+    conditional_scopes = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_scopes(self, request):
+        return self.cache_scopes
+
+    def get_conditional_scopes(self, request):
+        scopes = list(self.conditional_scopes
+                      or self.get_cache_scopes(request))
+        if request.user.is_authenticated:
+            scopes.append(USER_SCOPE.format(user=request.user.id))
+        return scopes
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        scopes = self.get_conditional_scopes(request)
+        # Формат ответа выбирается по Accept: он входит в ETag и Vary.
+        etag = quote_etag(get_request_digest(
+            request, request.user.id, request.accepted_renderer.format,
+            request.accepted_media_type, get_versions(scopes)))
+        last_modified = get_last_modified(scopes)
+        response = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
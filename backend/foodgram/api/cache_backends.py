@@ -0,0 +1,21 @@
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class VersionFileCache(FileBasedCache):
+    """Файловый кэш для версий областей и журналов индексов.
+
+    Обычный FileBasedCache при переполнении удаляет случайные записи,
+    а потеря версии или журнала означает ложную инвалидацию и полную
+    перестройку индексов. Здесь удаляются только истекшие записи.
+    """
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        for fname in filelist:
+            try:
+                with open(fname, 'rb') as f:
+                    self._is_expired(f)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,298 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+
+from api.cache import versions_cache
+from recipes.models import RecipeIngredient
+
+SEQUENCE_KEY = 'api:cookable:sequence'
+CHANGE_KEY = 'api:cookable:change:{sequence}'
+NONZERO_BYTES = re.compile(rb'[^\x00]+')
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1)
+             for byte in range(256)]
+
+
+def get_sequence():
+    versions_cache.add(SEQUENCE_KEY, time.time_ns(), timeout=None)
+    return versions_cache.get(SEQUENCE_KEY)
+
+
+def publish_changes(recipe_ids):
+    try:
+        sequence = versions_cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        # Журнал потерян: новое начало заставит процессы перестроиться.
+        reset_journal()
+        return
+    # incr файлового кэша не атомарен: если номер уже занят другим
+    # процессом, его запись не должна потеряться.
+    if not versions_cache.add(CHANGE_KEY.format(sequence=sequence),
+                              recipe_ids,
+                              settings.COOKABLE_JOURNAL_TIMEOUT):
+        reset_journal()
+
+
+def reset_journal():
+    """Для записей в обход сигналов: процессы перестроят индекс."""
+    versions_cache.set(SEQUENCE_KEY, time.time_ns(), timeout=None)
+
+
+def record_changes(recipe_ids):
+    """Записывает в журнал рецепты с измененным составом."""
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: publish_changes(recipe_ids))
+
+
+def to_bitset(recipe_ids):
+    """Битовое множество: бит номер recipe_id у каждого рецепта."""
+    if not recipe_ids:
+        return 0
+    data = bytearray(max(recipe_ids) // 8 + 1)
+    for recipe_id in recipe_ids:
+        data[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_bits(bits):
+    """Номера установленных битов по возрастанию."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for match in NONZERO_BYTES.finditer(data):
+        for index, byte in enumerate(match.group(), match.start()):
+            for bit in BYTE_BITS[byte]:
+                yield index * 8 + bit
+
+
+def count_matches(bitsets):
+    """Разряды числа совпадений у каждого рецепта (bit-sliced counting).
+
+    Бит рецепта в slices[i] - i-й разряд числа множеств, где он есть.
+    """
+    slices = []
+    for bits in bitsets:
+        for index, current in enumerate(slices):
+            slices[index], bits = current ^ bits, current & bits
+            if not bits:
+                break
+        else:
+            if bits:
+                slices.append(bits)
+    return slices
+
+
+def equal_to(slices, count):
+    """Рецепты, у которых ровно count > 0 совпадений."""
+    if count >> len(slices):
+        return 0
+    bits = -1
+    for index, current in enumerate(slices):
+        bits &= current if count >> index & 1 else ~current
+    return bits
+
+
+class RankedRecipes:
+    """Пары (recipe_id, недостающих) в компактных массивах.
+
+    Поддерживает len и срезы, этого достаточно пагинатору.
+    """
+
+    def __init__(self, recipe_ids, missing):
+        self.recipe_ids = recipe_ids
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.recipe_ids[index], self.missing[index]))
+        return self.recipe_ids[index], self.missing[index]
+
+
+def rank(bitsets, sizes, max_missing):
+    """Сначала готовые целиком, затем по числу совпадений и id."""
+    slices = count_matches(bitsets)
+    counts = {}
+    recipe_ids = array('I')
+    missing_counts = bytearray()
+    for missing in range(max_missing + 1):
+        for size in sorted(sizes, reverse=True):
+            count = size - missing
+            if count < 1:
+                break
+            if count not in counts:
+                counts[count] = equal_to(slices, count)
+            bits = sizes[size] & counts[count]
+            if bits:
+                found = array('I', iter_bits(bits))
+                recipe_ids.extend(found)
+                missing_counts.extend(bytes([missing]) * len(found))
+    return RankedRecipes(recipe_ids, bytes(missing_counts))
+
+
+class CookableIndex:
+    """Обратный индекс ингредиент -> рецепты в памяти процесса.
+
+    Частые ингредиенты хранятся битовыми множествами по id рецептов,
+    редкие - отсортированными массивами array('I'); рецепты также
+    разложены в битовые множества по числу ингредиентов. Изменения
+    состава подтягиваются из журнала в кэше только для затронутых
+    рецептов; если журнал прерван, индекс строится заново.
+
+    Словари индекса при изменении заменяются новыми, поэтому поиск
+    берет их под блокировкой, а считает уже без нее.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequence = None
+        self._postings = {}
+        self._bitsets = {}
+        self._sizes = {}
+        self._recipes = {}
+        self._ranked_lock = threading.Lock()
+        self._ranked = OrderedDict()
+
+    def build(self):
+        postings = {}
+        recipes = defaultdict(list)
+        rows = RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id').values_list(
+            'ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator(
+                chunk_size=settings.COOKABLE_BATCH_SIZE):
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('I')
+            posting.append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        last_id = max(recipes, default=0)
+        bitsets = {}
+        for ingredient_id, posting in list(postings.items()):
+            if len(posting) * settings.COOKABLE_BITSET_DENSITY >= last_id:
+                bitsets[ingredient_id] = to_bitset(posting)
+                del postings[ingredient_id]
+        by_size = defaultdict(list)
+        for recipe_id, ingredients in recipes.items():
+            by_size[len(ingredients)].append(recipe_id)
+        self._postings = postings
+        self._bitsets = bitsets
+        self._sizes = {size: to_bitset(recipe_ids)
+                       for size, recipe_ids in by_size.items()}
+        self._recipes = {recipe_id: array('I', ingredients)
+                         for recipe_id, ingredients in recipes.items()}
+
+    def apply(self, recipe_ids):
+        postings = dict(self._postings)
+        bitsets = dict(self._bitsets)
+        sizes = dict(self._sizes)
+        copied = set()
+
+        def get_posting(ingredient_id):
+            # Массивы старого словаря могут читать поиски без блокировки.
+            if ingredient_id not in copied:
+                postings[ingredient_id] = array(
+                    'I', postings.get(ingredient_id, ()))
+                copied.add(ingredient_id)
+            return postings[ingredient_id]
+
+        for recipe_id in recipe_ids:
+            ingredients = self._recipes.pop(recipe_id, ())
+            for ingredient_id in ingredients:
+                if ingredient_id in bitsets:
+                    bitsets[ingredient_id] &= ~(1 << recipe_id)
+                else:
+                    posting = get_posting(ingredient_id)
+                    del posting[bisect_left(posting, recipe_id)]
+            if ingredients:
+                sizes[len(ingredients)] &= ~(1 << recipe_id)
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).order_by().values_list(
+                'recipe_id', 'ingredient_id'):
+            if ingredient_id in bitsets:
+                bitsets[ingredient_id] |= 1 << recipe_id
+            else:
+                insort(get_posting(ingredient_id), recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        for recipe_id, ingredients in recipes.items():
+            self._recipes[recipe_id] = array('I', ingredients)
+            sizes[len(ingredients)] = (sizes.get(len(ingredients), 0)
+                                       | 1 << recipe_id)
+        for ingredient_id in copied:
+            if not postings[ingredient_id]:
+                del postings[ingredient_id]
+        self._postings = postings
+        self._bitsets = bitsets
+        self._sizes = {size: bits for size, bits in sizes.items() if bits}
+
+    def get_changes(self, sequence):
+        """Измененные рецепты после self._sequence или None."""
+        if (self._sequence is None or sequence < self._sequence
+                or sequence - self._sequence
+                > settings.COOKABLE_JOURNAL_LIMIT):
+            return None
+        keys = [CHANGE_KEY.format(sequence=number)
+                for number in range(self._sequence + 1, sequence + 1)]
+        changes = versions_cache.get_many(keys)
+        if len(changes) != len(keys):
+            return None
+        return set(chain.from_iterable(changes.values()))
+
+    def ensure_fresh(self):
+        sequence = get_sequence()
+        if sequence == self._sequence:
+            return
+        changes = self.get_changes(sequence)
+        if changes is None:
+            self.build()
+        else:
+            self.apply(changes)
+        self._sequence = sequence
+
+    def get_ranked(self, key):
+        with self._ranked_lock:
+            ranked = self._ranked.get(key)
+            if ranked is not None:
+                self._ranked.move_to_end(key)
+            return ranked
+
+    def set_ranked(self, key, ranked):
+        with self._ranked_lock:
+            self._ranked[key] = ranked
+            while len(self._ranked) > settings.COOKABLE_RANKED_CACHE:
+                self._ranked.popitem(last=False)
+
+    def search(self, ingredient_ids, max_missing):
+        """Пары (recipe_id, недостающих) от полностью готовых рецептов.
+
+        Под блокировкой только обновляется индекс и берется снимок его
+        словарей. Ранжированный список кэшируется по набору
+        ингредиентов и номеру журнала: следующие страницы - срезы.
+        """
+        with self._lock:
+            self.ensure_fresh()
+            sequence = self._sequence
+            postings, bitsets = self._postings, self._bitsets
+            sizes = self._sizes
+        key = (sequence, frozenset(ingredient_ids), max_missing)
+        ranked = self.get_ranked(key)
+        if ranked is None:
+            ranked = rank(
+                [bitsets[ingredient_id] if ingredient_id in bitsets
+                 else to_bitset(postings[ingredient_id])
+                 for ingredient_id in key[1]
+                 if ingredient_id in bitsets or ingredient_id in postings],
+                sizes, max_missing)
+            self.set_ranked(key, ranked)
+        return ranked
+
+
+cookable_index = CookableIndex()
@@ -1,12 +1,18 @@
-from django_filters import AllValuesMultipleFilter, CharFilter, FilterSet
+from django_filters import CharFilter, FilterSet, ModelMultipleChoiceFilter
 
-from recipes.models import Recipe
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+    )
     is_favorited = CharFilter(method='filter_is_favorited__in')
     is_in_shopping_cart = CharFilter(method='filter_is_in_shopping_cart__in')
+    search = CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -21,3 +27,6 @@ class RecipeFilter(FilterSet):
         if value:
             return queryset.filter(carts__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
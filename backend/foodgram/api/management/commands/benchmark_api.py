@@ -0,0 +1,400 @@
+import json
+import os
+import re
+from fnmatch import fnmatch
+from itertools import combinations
+from statistics import mean
+from time import perf_counter
+from uuid import uuid4
+
+import requests
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Subscription, Tag
+from users.models import User
+
+RECIPES_URL = '/api/recipes/'
+SMALL_GIF = ('data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALA'
+             'AAAAABAAEAAAIBRAA7')
+CART_SIZE = 10
+# Рост p95 меньше этого порога в миллисекундах считается шумом.
+MIN_DELTA_MS = 1
+# Число SQL запросов из заголовка RequestTimingMiddleware.
+SERVER_TIMING_QUERIES = re.compile(r'(?:^|,\s*)db;desc="(\d+) queries"')
+# Базы с такими именами считаются одноразовыми: замеры пишут в базу.
+THROWAWAY_PREFIXES = ('test', 'bench')
+
+
+def percentile(ordered, percent):
+    """Перцентиль отсортированного списка с линейной интерполяцией."""
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower)
+
+
+def is_throwaway_database():
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return True
+    name = os.path.basename(str(connection.settings_dict['NAME']))
+    return name.startswith(THROWAWAY_PREFIXES)
+
+
+def get_local_host():
+    """Хост из ALLOWED_HOSTS: с чужим хостом запросы получат 400."""
+    hosts = settings.ALLOWED_HOSTS
+    if not hosts and settings.DEBUG:
+        hosts = ['localhost']
+    for host in hosts:
+        return 'localhost' if host == '*' else host.lstrip('.')
+    raise CommandError('ALLOWED_HOSTS пуст, запросам не задать хост.')
+
+
+class LocalRunner:
+    """Запросы через весь стек Django в этом процессе с подсчетом SQL."""
+
+    def __init__(self, token):
+        # Ошибки view считаются ответами 500, а не прерывают замеры.
+        options = {'HTTP_HOST': get_local_host(),
+                   'raise_request_exception': False}
+        self.client = APIClient(**options)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.anonymous = APIClient(**options)
+
+    def request(self, method, path, data=None, auth=True):
+        client = self.client if auth else self.anonymous
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            if method == 'get':
+                response = client.get(path, data)
+            else:
+                response = getattr(client, method)(path, data, format='json')
+            elapsed = perf_counter() - start
+        return response.status_code, self.get_json(response), elapsed, len(
+            queries)
+
+    def get_json(self, response):
+        if response.get('Content-Type', '').startswith('application/json'):
+            return response.json()
+        return None
+
+
+class HTTPRunner:
+    """Запросы к запущенному серверу.
+
+    Число SQL запросов известно, только если на сервере включен
+    REQUEST_TIMING и он отдает заголовок Server-Timing.
+    """
+
+    def __init__(self, url, token):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.headers = {'Authorization': f'Token {token}'}
+
+    def request(self, method, path, data=None, auth=True):
+        kwargs = {'params': data} if method == 'get' else {'json': data}
+        start = perf_counter()
+        response = self.session.request(
+            method, f'{self.url}{path}',
+            headers=self.headers if auth else None, **kwargs)
+        elapsed = perf_counter() - start
+        body = None
+        if response.headers.get('Content-Type', '').startswith(
+                'application/json'):
+            body = response.json()
+        queries = SERVER_TIMING_QUERIES.search(
+            response.headers.get('Server-Timing', ''))
+        return response.status_code, body, elapsed, (
+            int(queries.group(1)) if queries else None)
+
+
+class Context:
+    """Пользователь и данные для запросов, выбранные из базы."""
+
+    def __init__(self, user):
+        self.user = user
+        recipes = Recipe.custom_objects.exclude(author=user).exclude(
+            favorites__user=user).exclude(carts__user=user).order_by(
+            '-popularity', 'pk')
+        self.recipe = recipes.first()
+        if self.recipe is None:
+            raise CommandError(
+                'Нет рецептов для замеров, создайте их, например, '
+                'командой generate_dataset.')
+        self.cart = list(recipes.values_list('pk', flat=True)[
+            1:CART_SIZE + 1])
+        self.author = User.objects.order_by('-recipes_count', 'pk').first()
+        self.tags = list(Tag.objects.order_by('pk').values_list(
+            'slug', flat=True)[:2])
+        self.search = self.recipe.name.split()[0]
+        self.ingredients = list(Ingredient.objects.order_by(
+            '-usage_count', 'pk').values('pk', 'name')[:5])
+
+    def recipe_payload(self, name):
+        return {
+            'name': name,
+            'text': 'Рецепт для замера производительности.',
+            'cooking_time': 10,
+            'image': SMALL_GIF,
+            'tags': list(Tag.objects.filter(slug__in=self.tags).values_list(
+                'pk', flat=True)),
+            'ingredients': [{'id': ingredient['pk'], 'amount': 10}
+                            for ingredient in self.ingredients],
+        }
+
+
+def get_list_scenarios(context):
+    filters = {
+        'tags': {'tags': context.tags},
+        'author': {'author': context.author.pk},
+        'favorited': {'is_favorited': 1},
+        'cart': {'is_in_shopping_cart': 1},
+        'search': {'search': context.search},
+    }
+    scenarios = {'recipes_list_anonymous': (RECIPES_URL, {}, False)}
+    for size in range(len(filters) + 1):
+        for names in combinations(filters, size):
+            params = {}
+            for name in names:
+                params.update(filters[name])
+            scenarios[f'recipes_list:{"+".join(names) or "none"}'] = (
+                RECIPES_URL, params, True)
+    for ordering in ('', 'popular', 'trending'):
+        scenarios[f'recipes_cursor:{ordering or "pub_date"}'] = (
+            RECIPES_URL, {'cursor': '', 'ordering': ordering}, True)
+        if ordering:
+            scenarios[f'recipes_ordering:{ordering}'] = (
+                RECIPES_URL, {'ordering': ordering}, True)
+    name = context.ingredients[0]['name'] if context.ingredients else 'с'
+    for length in (1, 3):
+        scenarios[f'ingredients_autocomplete:{length}'] = (
+            '/api/ingredients/', {'name': name[:length]}, True)
+    scenarios.update({
+        'recipe_detail': (f'{RECIPES_URL}{context.recipe.pk}/', {}, True),
+        'subscriptions': ('/api/users/subscriptions/',
+                          {'recipes_limit': 3}, True),
+        'download_shopping_cart': (
+            f'{RECIPES_URL}download_shopping_cart/', {}, True),
+    })
+    return scenarios
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержки API: p50/p95/p99, пропускную способность '
+            'одного последовательного клиента (RPS по времени сценария) и '
+            'число SQL запросов на запрос. Без --url запросы идут через '
+            'Django в этом процессе, к базе из настроек. Замеры создают '
+            'и удаляют рецепты, избранное и корзину отдельного '
+            'пользователя, поэтому без --allow-live-db команда работает '
+            'только с базой, имя которой начинается с test или bench. '
+            'Замеры можно сохранить в JSON и сравнить с сохраненной '
+            'базовой линией.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', help='Адрес запущенного сервера, например '
+                          'http://127.0.0.1:8000.')
+        parser.add_argument(
+            '--user', help='Email пользователя, чьи подписки получит '
+                           'пользователь замеров; по умолчанию самый '
+                           'подписанный.')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--scenarios', nargs='*', default=['*'],
+            help='Шаблоны имен сценариев, например "recipes_list*".')
+        parser.add_argument('-o', '--output', help='Сохранить замеры в JSON.')
+        parser.add_argument('--baseline', help='JSON с базовой линией.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый относительный рост p95.')
+        parser.add_argument(
+            '--allow-live-db', action='store_true',
+            help='Разрешить замеры на базе с любым именем.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Нужно хотя бы две итерации.')
+        if not options['allow_live_db'] and not is_throwaway_database():
+            raise CommandError(
+                f'База {connection.settings_dict["NAME"]} не похожа на '
+                f'одноразовую, а замеры пишут в нее. Запустите команду с '
+                f'базой, имя которой начинается с test или bench, или '
+                f'укажите --allow-live-db.')
+        template = self.get_template_user(options['user'])
+        self.options = options
+        self.results = {}
+        user = self.create_user(template)
+        try:
+            token = Token.objects.create(user=user)
+            if options['url']:
+                self.runner = HTTPRunner(options['url'], token.key)
+            else:
+                self.runner = LocalRunner(token.key)
+            self.run_scenarios(Context(user))
+        finally:
+            # Токен, корзина, избранное и рецепты удаляются каскадом.
+            user.delete()
+        self.report()
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(self.get_report_data(), output,
+                          ensure_ascii=False, indent=2)
+        failed = [name for name, result in self.results.items()
+                  if result['errors']]
+        if failed:
+            raise CommandError(
+                f'Ответы с ошибками в сценариях: {", ".join(failed)}')
+        if options['baseline']:
+            self.compare(options['baseline'])
+
+    def get_template_user(self, email):
+        users = User.objects.all()
+        if email:
+            users = users.filter(email=email)
+        user = users.order_by('-following_count', 'pk').first()
+        if user is None:
+            raise CommandError('Пользователь для замеров не найден.')
+        return user
+
+    def create_user(self, template):
+        """Отдельный пользователь с подписками template."""
+        name = f'benchmark_{uuid4().hex[:12]}'
+        user = User(username=name, email=f'{name}@example.com',
+                    first_name='Замер', last_name='API')
+        user.set_unusable_password()
+        user.save()
+        # Через сигналы: счетчики и ленты остаются согласованными.
+        for author_id in Subscription.objects.filter(
+                subscriber=template).values_list('author_id', flat=True):
+            Subscription.objects.create(subscriber=user, author_id=author_id)
+        return user
+
+    def run_scenarios(self, context):
+        runner = self.runner
+        self.prepare_cart(context)
+        for name, (path, params, auth) in get_list_scenarios(
+                context).items():
+            self.measure(name, lambda: [
+                runner.request('get', path, params, auth)])
+        self.measure('favorite_toggle', lambda: self.toggle(
+            f'{RECIPES_URL}{context.recipe.pk}/favorite/'))
+        self.measure('shopping_cart_toggle', lambda: self.toggle(
+            f'{RECIPES_URL}{context.recipe.pk}/shopping_cart/'))
+        self.measure('recipe_create_update',
+                     lambda: self.create_update(context))
+
+    def prepare_cart(self, context):
+        """Корзина для выгрузки списка покупок."""
+        status, *_ = self.runner.request(
+            'post', f'{RECIPES_URL}shopping_cart/bulk/',
+            {'recipes': context.cart})
+        if status != 200:
+            raise CommandError(f'Не удалось заполнить корзину: {status}')
+
+    def toggle(self, path):
+        return [self.runner.request('post', path),
+                self.runner.request('delete', path)]
+
+    def create_update(self, context):
+        payload = context.recipe_payload(
+            f'Замер {timezone.now().isoformat()}')
+        created = self.runner.request('post', RECIPES_URL, payload)
+        status, body, *_ = created
+        if status != 201:
+            return [created]
+        path = f'{RECIPES_URL}{body["id"]}/'
+        payload['ingredients'] = payload['ingredients'][1:]
+        payload['name'] = f'{payload["name"]} изменен'
+        updated = self.runner.request('patch', path, payload)
+        self.runner.request('delete', path)
+        return [created, updated]
+
+    def measure(self, name, scenario):
+        if not any(fnmatch(name, pattern)
+                   for pattern in self.options['scenarios']):
+            return
+        for _ in range(self.options['warmup']):
+            scenario()
+        timings, queries, errors = [], [], 0
+        start = perf_counter()
+        for _ in range(self.options['iterations']):
+            for status, _, elapsed, count in scenario():
+                timings.append(elapsed * 1000)
+                if count is not None:
+                    queries.append(count)
+                errors += status >= 400
+        # Последовательные запросы в одном потоке, включая служебные.
+        wall = perf_counter() - start
+        timings.sort()
+        self.results[name] = {
+            'requests': len(timings),
+            'p50': percentile(timings, 50),
+            'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+            'rps': len(timings) / wall,
+            'queries': mean(queries) if queries else None,
+            'errors': errors,
+        }
+
+    def report(self):
+        self.stdout.write(
+            f'{"сценарий":<48}{"p50, мс":>9}{"p95, мс":>9}{"p99, мс":>9}'
+            f'{"RPS":>8}{"SQL":>7}{"ошибки":>8}')
+        for name, result in self.results.items():
+            queries = result['queries']
+            queries = '-' if queries is None else f'{queries:.1f}'
+            self.stdout.write(
+                f'{name:<48}{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["rps"]:>8.0f}{queries:>7}'
+                f'{result["errors"]:>8}')
+
+    def get_report_data(self):
+        return {
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'url': self.options['url'],
+            'iterations': self.options['iterations'],
+            'results': self.results,
+        }
+
+    def compare(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        regressions = []
+        for name, result in self.results.items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            limit = old['p95'] * (1 + self.options['threshold'])
+            if (result['p95'] > limit
+                    and result['p95'] - old['p95'] > MIN_DELTA_MS):
+                regressions.append(
+                    f'{name}: p95 {old["p95"]:.2f} -> '
+                    f'{result["p95"]:.2f} мс')
+            if (result['queries'] is not None
+                    and old.get('queries') is not None
+                    and result['queries'] > old['queries']):
+                regressions.append(
+                    f'{name}: SQL {old["queries"]:.1f} -> '
+                    f'{result["queries"]:.1f}')
+            if result['errors'] > old.get('errors', 0):
+                regressions.append(
+                    f'{name}: ошибок {old.get("errors", 0)} -> '
+                    f'{result["errors"]}')
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно базовой линии:\n'
+                + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(
+            'Регрессий относительно базовой линии нет.'))
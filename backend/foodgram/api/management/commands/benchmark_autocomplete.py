@@ -0,0 +1,49 @@
+from statistics import mean
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db.models import Q
+
+from api.autocomplete import ingredient_index
+from recipes.models import Ingredient
+
+DEFAULT_QUERIES = ('с', 'со', 'сол', 'мук', 'молоко', 'яй', 'сыр', 'ов', 'z')
+
+
+def orm_search(query, limit):
+    return list(Ingredient.objects.filter(
+        Q(name__istartswith=query) | Q(name__icontains=query)
+    ).values('id', 'name', 'measurement_unit')[:limit])
+
+
+def index_search(query, limit):
+    return ingredient_index.search(query, limit)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает автодополнение ингредиентов по индексу и через ORM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--limit', type=int,
+                            default=settings.AUTOCOMPLETE_LIMIT)
+
+    def measure(self, search, query, options):
+        timings = []
+        for _ in range(options['repeat']):
+            start = perf_counter()
+            search(query, options['limit'])
+            timings.append(perf_counter() - start)
+        return mean(timings) * 10 ** 6
+
+    def handle(self, *args, **options):
+        ingredient_index.ensure_fresh()
+        self.stdout.write(
+            f'{"запрос":<12}{"ORM, мкс":>12}{"индекс, мкс":>14}{"x":>8}')
+        for query in options['queries']:
+            orm = self.measure(orm_search, query, options)
+            index = self.measure(index_search, query, options)
+            self.stdout.write(
+                f'{query:<12}{orm:>12.1f}{index:>14.1f}{orm / index:>8.1f}')
@@ -0,0 +1,129 @@
+import json
+import logging
+from collections import Counter
+from contextlib import ExitStack
+from heapq import heappush, heappushpop
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Обертка выполнения SQL: число, время и повторы запросов."""
+
+    def __init__(self, keep_slowest):
+        self.keep_slowest = keep_slowest
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.count += 1
+            self.total += duration
+            # Текст без параметров: одинаковый у запросов N+1.
+            self.statements[sql] += 1
+            item = (duration, self.count, sql)
+            if len(self.slowest) < self.keep_slowest:
+                heappush(self.slowest, item)
+            else:
+                heappushpop(self.slowest, item)
+
+    def get_duplicates(self, threshold):
+        return {sql: count for sql, count in self.statements.items()
+                if count >= threshold}
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestTimingMiddleware:
+    """Время запроса, SQL и рендеринга в Server-Timing и в журнале.
+
+    Включается настройкой REQUEST_TIMING. SQL считается через
+    execute_wrapper, без DEBUG и без хранения всех запросов.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow = settings.REQUEST_TIMING_SLOW
+        self.duplicates = settings.REQUEST_TIMING_DUPLICATES
+        self.keep_slowest = settings.REQUEST_TIMING_SLOW_QUERIES
+
+    def __call__(self, request):
+        stats = QueryStats(self.keep_slowest)
+        request.timing = {'start': perf_counter()}
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        timing = request.timing
+        timing['end'] = perf_counter()
+        record = self.get_record(request, response, stats, timing)
+        response['Server-Timing'] = self.get_header(record)
+        self.log(record, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing['view_start'] = perf_counter()
+
+    def process_template_response(self, request, response):
+        request.timing['view_end'] = perf_counter()
+
+        def rendered(response):
+            request.timing['render_end'] = perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def get_record(self, request, response, stats, timing):
+        view_start = timing.get('view_start', timing['start'])
+        view_end = timing.get('view_end', timing['end'])
+        duplicates = stats.get_duplicates(self.duplicates)
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': to_ms(timing['end'] - timing['start']),
+            'view_ms': to_ms(view_end - view_start),
+            'render_ms': to_ms(timing.get('render_end', view_end) - view_end),
+            'queries': stats.count,
+            'db_ms': to_ms(stats.total),
+            'slowest_query_ms': to_ms(max(stats.slowest)[0]
+                                      if stats.slowest else 0),
+            'duplicate_queries': sum(duplicates.values()),
+        }
+
+    def get_header(self, record):
+        return ', '.join((
+            f'db;desc="{record["queries"]} queries";dur={record["db_ms"]}',
+            f'db-slowest;dur={record["slowest_query_ms"]}',
+            f'db-duplicates;desc="{record["duplicate_queries"]} '
+            f'duplicates"',
+            f'view;dur={record["view_ms"]}',
+            f'render;dur={record["render_ms"]}',
+            f'total;dur={record["total_ms"]}',
+        ))
+
+    def log(self, record, stats):
+        if record['total_ms'] < self.slow:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        # Для медленных запросов пишем сами запросы.
+        record['slowest_sql'] = [
+            {'ms': to_ms(duration), 'sql': sql}
+            for duration, _, sql in sorted(stats.slowest, reverse=True)]
+        record['duplicate_sql'] = stats.get_duplicates(self.duplicates)
+        logger.warning(json.dumps(record, ensure_ascii=False))
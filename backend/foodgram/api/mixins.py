@@ -31,3 +31,24 @@ def validate_slug(slug):
             NOT_ALLOWED_CHAR_MSG_SLUG.format(
                 chars=invalid_symbols, username=slug))
     return slug
+
+
+class CounterFieldsMixin:
+    """Модель, чьи счетчики меняются только через UPDATE с F().
+
+    Полный save() существующей строки не записывает поля из
+    counter_fields: иначе значения, прочитанные до запроса, затрут
+    параллельные приращения. Явный update_fields пишет их как обычно.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
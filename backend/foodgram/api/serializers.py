@@ -1,13 +1,23 @@
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db import transaction
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from api.utils import get_author
+from api.autocomplete import record_usage
+from api.cache import invalidate
+from api.utils import get_author, get_recipes_limit
+from recipes.counters import change_counter
+from recipes.images import process_recipe_image
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipeIngredient, Subscription, Tag)
+                            RecipeIngredient, ShoppingListItem, Subscription,
+                            Tag)
+from recipes.search import build_document, sync_fts
+from recipes.shopping_list import change_recipe_amounts
+from recipes.similarity import update_similar_recipes
+from recipes.tasks import enqueue
 from users.models import User
 
 
@@ -21,6 +31,8 @@ class CustomUserSerializer(UserSerializer):
         read_only_fields = ('is_subscribed',)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request', False)
         return (request and request.user.is_authenticated
                 and Subscription.objects.filter(
@@ -53,6 +65,43 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    id = serializers.ReadOnlyField(source='ingredient_id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+    amount = serializers.ReadOnlyField(source='total')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount',)
+
+
+class RecipeImageField(serializers.Field):
+    """Ссылка на копию картинки рецепта подходящей ширины."""
+
+    def __init__(self, width, detail_width=None, **kwargs):
+        self.width = width
+        self.detail_width = detail_width or width
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        view = self.context.get('view')
+        width = self.width
+        if view is not None and getattr(view, 'action', None) == 'retrieve':
+            width = self.detail_width
+        name = recipe.get_image_variant(width)
+        if name is None:
+            return None
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class RecipeSerializerRead(serializers.ModelSerializer):
     is_favorited = serializers.BooleanField(default=False)
     is_in_shopping_cart = serializers.BooleanField(default=False)
@@ -60,6 +109,8 @@ class RecipeSerializerRead(serializers.ModelSerializer):
     author = CustomUserSerializer()
     ingredients = RecipeIngredientSerializer(many=True, read_only=True,
                                              source='recipeingredients')
+    image = RecipeImageField(settings.CARD_IMAGE_WIDTH,
+                             settings.DETAIL_IMAGE_WIDTH)
 
     class Meta:
         model = Recipe
@@ -68,10 +119,23 @@ class RecipeSerializerRead(serializers.ModelSerializer):
                   'cooking_time')
         read_only_fields = ('id', 'author',)
 
+    def to_representation(self, instance):
+        instance.author.is_subscribed = getattr(
+            instance, 'is_subscribed', False)
+        return super().to_representation(instance)
+
+
+class CookableRecipeSerializer(RecipeSerializerRead):
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializerRead.Meta):
+        fields = RecipeSerializerRead.Meta.fields + ('missing',)
+
 
 class RecipeSerializerWrite(serializers.ModelSerializer):
     image = Base64ImageField()
     cooking_time = serializers.IntegerField(min_value=settings.MINVALUE)
+    tags = serializers.ListField()
 
     class Meta:
         model = Recipe
@@ -79,24 +143,32 @@ class RecipeSerializerWrite(serializers.ModelSerializer):
                   'image', 'text', 'cooking_time')
 
     def to_representation(self, obj):
-        return RecipeSerializerRead(obj).data
+        return RecipeSerializerRead(
+            Recipe.custom_objects.add_related().get(pk=obj.pk)).data
 
     def validate_tags(self, value):
-        tags = self.initial_data.pop('tags')
         tags_ids = []
-        for tag in tags:
+        seen = set()
+        for tag in value:
             if not (isinstance(tag, int) and tag > 0):
                 raise serializers.ValidationError(
                     {'tags': settings.NOT_POSITIVE_INTEGER_TAG.format(
                         tag=tag)})
-            tags_ids.append(tag)
-            if len(tags_ids) != len(set(tags_ids)):
+            if tag in seen:
                 raise serializers.ValidationError(
                     {'tags': settings.DUPLICATE_TAGS.format(
                         tag=tag)})
-        return value
+            seen.add(tag)
+            tags_ids.append(tag)
+        tags = Tag.objects.in_bulk(tags_ids)
+        for tag in tags_ids:
+            if tag not in tags:
+                raise serializers.ValidationError(
+                    {'tags': settings.NO_TAG.format(tag=tag)})
+        return [tags[tag] for tag in tags_ids]
 
     def validate_ingredients(self):
+        """Проверяет ингредиенты и загружает их одним запросом."""
         if 'ingredients' not in self.initial_data:
             raise serializers.ValidationError(
                 {'ingredients': settings.MUST_HAVE_FIELD})
@@ -106,7 +178,7 @@ class RecipeSerializerWrite(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'ingredients': settings.NOT_LIST_INGREDIENT.format(
                     ingredients=ingredients)})
-        ingredient_ids = []
+        validated = {}
         for ingredient in ingredients:
             if 'amount' not in ingredient:
                 raise serializers.ValidationError(
@@ -117,57 +189,133 @@ class RecipeSerializerWrite(serializers.ModelSerializer):
                     {'id': settings.MUST_HAVE_FIELD_ID.format(
                         ingredient=ingredient)})
             try:
-                int(ingredient['amount'])
-                if not int(ingredient['amount']) > 0:
-                    raise serializers.ValidationError(
-                        {'amount': settings.NOT_POSITIVE_INTEGER.format(
-                            ingredient=ingredient)})
-            except ValueError:
+                amount = int(ingredient['amount'])
+            except (TypeError, ValueError):
+                amount = 0
+            if not amount > 0:
                 raise serializers.ValidationError(
                     {'amount': settings.NOT_POSITIVE_INTEGER.format(
                         ingredient=ingredient)})
-            if not Ingredient.objects.filter(id=ingredient['id']).exists():
+            try:
+                ingredient_id = int(ingredient['id'])
+            except (TypeError, ValueError):
                 raise serializers.ValidationError(
                     {'ingredients': settings.NO_INGREDIENT.format(
                         ingredient=ingredient)})
-            ingredient_ids.append(ingredient['id'])
-            if len(ingredient_ids) != len(set(ingredient_ids)):
+            if ingredient_id in validated:
                 raise serializers.ValidationError(
                     {'ingredients': settings.DUPLICATE_INGREDIENTS.format(
                         ingredient=ingredient)})
-        return ingredients
+            validated[ingredient_id] = (ingredient, amount)
+        found = Ingredient.objects.in_bulk(validated)
+        for ingredient_id, (ingredient, _) in validated.items():
+            if ingredient_id not in found:
+                raise serializers.ValidationError(
+                    {'ingredients': settings.NO_INGREDIENT.format(
+                        ingredient=ingredient)})
+        return [{'id': ingredient_id, 'amount': amount,
+                 'ingredient': found[ingredient_id]}
+                for ingredient_id, (_, amount) in validated.items()]
+
+    def get_search_document(self, data, ingredients):
+        """Поисковый текст из проверенных данных, без чтения из базы."""
+        return build_document(
+            data['name'], data['text'],
+            [ingredient['ingredient'].name for ingredient in ingredients])
 
     def create_ingredients(self, ingredients, recipe):
 
         obj = [RecipeIngredient(recipe=recipe,
-                                ingredient_id=ingredient['id'],
+                                ingredient=ingredient['ingredient'],
                                 amount=ingredient['amount'])
                for ingredient in ingredients]
         obj.sort(key=(lambda item: item.ingredient.name), reverse=True)
         RecipeIngredient.objects.bulk_create(obj)
+        change_counter(Ingredient, 'usage_count',
+                       [ingredient['id'] for ingredient in ingredients], 1)
+        record_usage({ingredient['id']: 1 for ingredient in ingredients})
+        invalidate('ingredient_usage')
+
+    def update_ingredients(self, ingredients, recipe):
+        """Применяет к рецепту только разницу в ингредиентах."""
+        existing = {item.ingredient_id: item
+                    for item in RecipeIngredient.objects.filter(
+                        recipe=recipe)}
+        old_amounts = {ingredient_id: item.amount
+                       for ingredient_id, item in existing.items()}
+        new_amounts = {ingredient['id']: ingredient['amount']
+                       for ingredient in ingredients}
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            item = existing.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        removed = [ingredient_id for ingredient_id in existing
+                   if ingredient_id not in new_amounts]
+        if removed:
+            # Счетчики и журнал обновят сигналы post_delete.
+            RecipeIngredient.objects.filter(
+                pk__in=[existing[ingredient_id].pk
+                        for ingredient_id in removed]).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = [ingredient for ingredient in ingredients
+                 if ingredient['id'] not in existing]
+        if added:
+            self.create_ingredients(added, recipe)
+        change_recipe_amounts(recipe, old_amounts, new_amounts)
+        return bool(added or removed)
 
     @transaction.atomic
     def create(self, validated_data):
         ingredients = self.validate_ingredients()
         tags = validated_data.pop('tags')
+        document = self.get_search_document(validated_data, ingredients)
         recipe = Recipe.custom_objects.create(**validated_data,
+                                              search_document=document,
                                               author_id=self.context.get(
                                                   'request').user.id)
-        recipe.tags.set(tags)
+        recipe.tags.add(*tags)
         self.create_ingredients(ingredients, recipe)
+        sync_fts({recipe.id: document})
+        enqueue(process_recipe_image, recipe.id)
+        enqueue(update_similar_recipes, [recipe.id])
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = self.validate_ingredients()
         tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        RecipeIngredient.objects.filter(recipe=instance, ).delete()
-        self.create_ingredients(ingredients, instance)
-        return super().update(instance, validated_data)
+        tags_changed = ({tag.id for tag in tags}
+                        != set(instance.tags.values_list('id', flat=True)))
+        if tags_changed:
+            instance.tags.set(tags)
+        ingredients_changed = self.update_ingredients(ingredients, instance)
+        if tags_changed or ingredients_changed:
+            enqueue(update_similar_recipes, [instance.id])
+        document = self.get_search_document(
+            {'name': instance.name, 'text': instance.text,
+             **validated_data}, ingredients)
+        search_changed = document != instance.search_document
+        # Документ пишется тем же UPDATE, что и остальные поля.
+        instance.search_document = document
+        image = instance.image.name
+        recipe = super().update(instance, validated_data)
+        if search_changed:
+            sync_fts({recipe.id: document})
+        if recipe.image.name != image:
+            # Та же картинка получает то же имя, копии пересоздавать
+            # не нужно.
+            recipe.image_variants = {}
+            recipe.save(update_fields=('image_variants',))
+            enqueue(process_recipe_image, recipe.id)
+        return recipe
 
 
 class ShortRecipe(serializers.ModelSerializer):
+    image = RecipeImageField(settings.THUMBNAIL_WIDTH)
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -209,6 +357,14 @@ class CartSerializer(FavoriteSerializer):
         return attrs
 
 
+class BulkRecipesSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=settings.MINVALUE),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
+
+
 class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
@@ -216,6 +372,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
         read_only_fields = ('subscriber', 'author',)
 
     def to_representation(self, obj):
+        obj.author.is_subscribed = True
         return SubscriptionSerializer(obj.author, context={
             'request': self.context.get('request')}).data
 
@@ -249,10 +406,11 @@ class SubscriptionSerializer(CustomUserSerializer):
                             'recipes_count',)
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('request').query_params.get(
-            'recipes_limit')
-        user_recipes = obj.recipes.all()
-        if recipes_limit:
-            user_recipes = user_recipes[:int(recipes_limit)]
+        user_recipes = getattr(obj, 'limited_recipes', None)
+        if user_recipes is None:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            user_recipes = obj.recipes.all()
+            if recipes_limit:
+                user_recipes = user_recipes[:recipes_limit]
         return ShortRecipe(user_recipes, many=True, context={
             'request': self.context.get('request')}).data
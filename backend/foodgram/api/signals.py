@@ -0,0 +1,76 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.autocomplete import record_usage
+from api.cache import USER_SCOPE, invalidate
+from api.cookable import record_changes
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, Subscription, Tag)
+from users.models import User
+
+CACHE_SCOPES = {
+    Recipe: ('recipes',),
+    RecipeIngredient: ('recipes', 'ingredient_usage'),
+    Tag: ('tags',),
+    Ingredient: ('ingredients',),
+    User: ('users',),
+    Favorite: ('recipe_scores',),
+    Cart: ('recipe_scores',),
+}
+# Поля, по которым меняется персональная часть ответов пользователя.
+USER_STATE_FIELDS = {
+    Cart: 'user_id',
+    Favorite: 'user_id',
+    Subscription: 'subscriber_id',
+    Recipe: 'author_id',
+}
+# Сохранение только этих полей рецепта не меняет его состав.
+NO_COMPOSITION_FIELDS = frozenset(('image_variants',))
+
+
+def invalidate_model_cache(sender, **kwargs):
+    if sender in USER_STATE_FIELDS:
+        invalidate(USER_SCOPE.format(
+            user=getattr(kwargs['instance'], USER_STATE_FIELDS[sender])))
+    scopes = CACHE_SCOPES.get(sender)
+    if scopes is None:
+        return
+    if kwargs.get('update_fields') == frozenset(('last_login',)):
+        return
+    invalidate(*scopes)
+
+
+for model in {*CACHE_SCOPES, *USER_STATE_FIELDS}:
+    post_save.connect(invalidate_model_cache, sender=model)
+    post_delete.connect(invalidate_model_cache, sender=model)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags_cache(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate('recipes')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def record_recipe_changes(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None or not update_fields <= NO_COMPOSITION_FIELDS:
+        record_changes([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def record_recipe_ingredient_changes(sender, instance, **kwargs):
+    record_changes([instance.recipe_id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def record_added_usage(sender, instance, created, **kwargs):
+    if created:
+        record_usage({instance.ingredient_id: 1})
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def record_removed_usage(sender, instance, **kwargs):
+    record_usage({instance.ingredient_id: -1})
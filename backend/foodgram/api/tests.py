@@ -1,3 +1,1589 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from base64 import b64encode
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.autocomplete import USAGE_SEQUENCE_KEY, ingredient_index
+from api.cache import get_versions, versions_cache
+from api.cache_backends import VersionFileCache
+from api.cookable import cookable_index
+from api.management.commands.benchmark_api import percentile
+from api.middleware import QueryStats
+from api.utils import insert_user_recipes
+from recipes.counters import COUNTERS, find_mismatches
+from recipes.management.commands.export_recipes import serialize_recipe
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingListItem, SimilarRecipe,
+                            StoredFile, Subscription, Tag, TimelineEntry)
+from recipes.search import FTS_TABLE, update_all_search_documents
+from recipes.timeline import get_feed_ids
+from users.models import User
+
+RECIPES_URL = '/api/recipes/'
+TAGS_URL = '/api/tags/'
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+SMALL_GIF = ('data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALA'
+             'AAAAABAAEAAAIBRAA7')
+
+
+def without_fts(queries):
+    """SQL без зеркала FTS5, которое есть только на SQLite."""
+    return [query['sql'] for query in queries.captured_queries
+            if FTS_TABLE not in query['sql']]
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASK_ALWAYS_EAGER=True)
+class FoodgramTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Иван', last_name='Иванов')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {i}',
+                                      measurement_unit='г')
+            for i in range(5)]
+        cls.authors = [
+            User.objects.create(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                first_name='Автор', last_name=f'{i}')
+            for i in range(3)]
+        Subscription.objects.create(subscriber=cls.user,
+                                    author=cls.authors[0])
+        for i in range(8):
+            cls.create_recipe(cls.authors[i % 3], f'Рецепт {i}')
+
+    @classmethod
+    def create_recipe(cls, author, name):
+        recipe = Recipe.custom_objects.create(
+            author=author, name=name, text='Описание', cooking_time=10)
+        recipe.tags.set(cls.tags[:2])
+        for ingredient in cls.ingredients[:3]:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100)
+        return recipe
+
+    def post_recipe(self, name, ingredients, tags=None, image=SMALL_GIF):
+        return self.authorized_client.post(RECIPES_URL, {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image,
+            'tags': tags or [self.tags[0].id],
+            'ingredients': [{'id': ingredient.id, 'amount': 10}
+                            for ingredient in ingredients],
+        }, format='json')
+
+    def setUp(self):
+        cache.clear()
+        versions_cache.clear()
+        self.guest_client = APIClient()
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+
+class RecipeReadQueriesTest(FoodgramTestCase):
+
+    def test_list_query_budget(self):
+        """Список рецептов читается фиксированным числом запросов."""
+        budgets = (
+            (self.guest_client, 4),
+            (self.authorized_client, 4),
+        )
+        for client, budget in budgets:
+            with self.subTest(budget=budget):
+                with self.assertNumQueries(budget):
+                    response = client.get(RECIPES_URL)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(budget):
+                    client.get(RECIPES_URL, {'page': 2})
+                with self.assertNumQueries(budget + 1):
+                    response = client.get(
+                        RECIPES_URL, {'tags': ['tag0', 'tag1']})
+                self.assertEqual(response.data['count'], 8)
+
+    def test_detail_query_budget(self):
+        recipe = Recipe.custom_objects.first()
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(
+                f'{RECIPES_URL}{recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 3)
+        self.assertEqual(len(response.data['tags']), 2)
+
+    def test_is_subscribed_annotation(self):
+        response = self.authorized_client.get(RECIPES_URL,
+                                              {'limit': 100})
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] == self.authors[0].id)
+
+
+class RecipeWriteQueriesTest(FoodgramTestCase):
+
+    def test_create_query_budget(self):
+        """Число запросов не зависит от числа ингредиентов и тегов."""
+        ingredients = self.ingredients + [
+            Ingredient.objects.create(name=f'Специя {i}',
+                                      measurement_unit='г')
+            for i in range(15)]
+        with CaptureQueriesContext(connection) as small:
+            response = self.post_recipe('Маленький', ingredients[:1])
+        self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_recipe(
+                'Большой', ingredients,
+                tags=[tag.id for tag in self.tags])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['ingredients']), 20)
+        self.assertEqual(len(large), len(small))
+        self.assertLessEqual(len(without_fts(large)), 16)
+
+    def test_invalid_ids(self):
+        cases = (
+            ([self.tags[0].id, 10 ** 6], self.ingredients[:1], 'tags'),
+            ([self.tags[0].id, self.tags[0].id], self.ingredients[:1],
+             'tags'),
+            (None, [self.ingredients[0], self.ingredients[0]],
+             'ingredients'),
+            (None, [Ingredient(id=10 ** 6)], 'ingredients'),
+        )
+        for tags, ingredients, field in cases:
+            with self.subTest(field=field):
+                response = self.post_recipe('Ошибка', ingredients, tags)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, str(response.data))
+        self.assertFalse(
+            Recipe.custom_objects.filter(name='Ошибка').exists())
+
+
+class RecipeUpdateTest(FoodgramTestCase):
+
+    def patch_recipe(self, recipe, amounts, text='Описание'):
+        return self.authorized_client.patch(f'{RECIPES_URL}{recipe.id}/', {
+            'name': recipe.name,
+            'text': text,
+            'cooking_time': 5,
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[index].id,
+                             'amount': amount}
+                            for index, amount in amounts.items()],
+        }, format='json')
+
+    def get_rows(self, recipe):
+        return {row.ingredient_id: row for row in
+                RecipeIngredient.objects.filter(recipe=recipe)}
+
+    def test_only_changed_rows_are_written(self):
+        recipe = Recipe.custom_objects.get(pk=self.post_recipe(
+            'Правка', self.ingredients[:3]).data['id'])
+        before = self.get_rows(recipe)
+        response = self.patch_recipe(recipe, {0: 10, 1: 20, 3: 5})
+        self.assertEqual(response.status_code, 200)
+        after = self.get_rows(recipe)
+        ids = [ingredient.id for ingredient in self.ingredients]
+        self.assertEqual(set(after), {ids[0], ids[1], ids[3]})
+        self.assertEqual(after[ids[0]].pk, before[ids[0]].pk)
+        self.assertEqual(after[ids[1]].pk, before[ids[1]].pk)
+        self.assertEqual(after[ids[1]].amount, 20)
+        self.assertEqual(after[ids[3]].amount, 5)
+        self.assertFalse(find_mismatches(
+            Ingredient, 'usage_count', RecipeIngredient,
+            'ingredient').exists())
+
+    def test_text_only_update_skips_relations(self):
+        recipe = Recipe.custom_objects.get(pk=self.post_recipe(
+            'Текст', self.ingredients[:2]).data['id'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch_recipe(recipe, {0: 10, 1: 10},
+                                         text='Новый текст')
+        self.assertEqual(response.data['text'], 'Новый текст')
+        writes = [sql for sql in without_fts(queries)
+                  if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"recipes_recipe"', writes[0])
+
+
+class AnonymousCacheTest(FoodgramTestCase):
+
+    def test_anonymous_reads_are_cached(self):
+        for url in (RECIPES_URL, TAGS_URL, '/api/ingredients/'):
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                with self.assertNumQueries(0):
+                    cached = self.guest_client.get(url)
+                self.assertEqual(cached.data, response.data)
+
+    def test_params_are_normalized(self):
+        self.guest_client.get(RECIPES_URL, {'tags': ['tag0', 'tag1']})
+        with self.assertNumQueries(0):
+            self.guest_client.get(f'{RECIPES_URL}?tags=tag1&tags=tag0')
+        with self.assertNumQueries(5):
+            self.guest_client.get(RECIPES_URL, {'tags': 'tag0'})
+
+    def test_authorized_reads_are_not_cached(self):
+        self.authorized_client.get(RECIPES_URL)
+        with self.assertNumQueries(4):
+            self.authorized_client.get(RECIPES_URL)
+
+    def test_writes_invalidate_cache(self):
+        self.guest_client.get(RECIPES_URL)
+        self.guest_client.get(TAGS_URL)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.filter(slug='tag0').get().delete()
+        response = self.guest_client.get(TAGS_URL)
+        self.assertEqual(len(response.data), 2)
+        response = self.guest_client.get(RECIPES_URL)
+        self.assertEqual(len(response.data['results'][0]['tags']), 1)
+
+    def test_recipe_tags_change_invalidates_cache(self):
+        self.guest_client.get(TAGS_URL)
+        recipe = Recipe.custom_objects.first()
+        self.guest_client.get(f'{RECIPES_URL}{recipe.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.tags.set(self.tags)
+        response = self.guest_client.get(f'{RECIPES_URL}{recipe.id}/')
+        self.assertEqual(len(response.data['tags']), 3)
+        with self.assertNumQueries(0):
+            self.guest_client.get(TAGS_URL)
+
+    def test_versions_survive_response_cache_culling(self):
+        versions = get_versions(('recipes', 'tags'))
+        cache.clear()
+        self.assertEqual(get_versions(('recipes', 'tags')), versions)
+
+    def test_version_cache_culls_only_expired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        versions = VersionFileCache(directory, {'OPTIONS': {
+            'MAX_ENTRIES': 3}})
+        versions.set('expired', 1, timeout=-1)
+        for key in ('first', 'second', 'third', 'fourth'):
+            versions.set(key, key, timeout=None)
+        self.assertEqual(
+            versions.get_many(['first', 'second', 'third', 'fourth']),
+            {key: key for key in ('first', 'second', 'third', 'fourth')})
+        self.assertEqual(len(versions._list_cache_files()), 4)
+
+
+class RecipePaginationTest(FoodgramTestCase):
+
+    def test_limit_is_honored_and_capped(self):
+        response = self.guest_client.get(RECIPES_URL, {'limit': 3})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['count'], 8)
+        response = self.guest_client.get(
+            RECIPES_URL, {'limit': 1000, 'cursor': ''})
+        self.assertEqual(len(response.data['results']), 8)
+
+    def test_cursor_pages_are_stable(self):
+        expected = list(Recipe.custom_objects.order_by(
+            'pub_date', 'id').values_list('id', flat=True))
+        seen = []
+        url = f'{RECIPES_URL}?cursor=&limit=3'
+        while url:
+            with self.assertNumQueries(3):
+                response = self.authorized_client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            if len(seen) == 3:
+                expected.append(
+                    self.create_recipe(self.authors[0], 'Новый').id)
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.guest_client.get(RECIPES_URL, {'cursor': 'мусор'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_subscriptions_cursor(self):
+        for author in self.authors[1:]:
+            Subscription.objects.create(subscriber=self.user, author=author)
+        response = self.authorized_client.get(
+            '/api/users/subscriptions/', {'cursor': '', 'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.authorized_client.get(response.data['next'])
+        self.assertEqual([author['username']
+                          for author in response.data['results']],
+                         ['author2'])
+
+
+class SubscriptionRecipesTest(FoodgramTestCase):
+    URL = '/api/users/subscriptions/'
+
+    def setUp(self):
+        super().setUp()
+        for author in self.authors[1:]:
+            Subscription.objects.create(subscriber=self.user, author=author)
+
+    def test_limited_recipes_in_one_query(self):
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(
+                self.URL, {'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        for item in response.data['results']:
+            author = User.objects.get(pk=item['id'])
+            self.assertTrue(item['is_subscribed'])
+            self.assertEqual(
+                [recipe['id'] for recipe in item['recipes']],
+                [recipe.id for recipe in author.recipes.all()[:2]])
+
+        response = self.authorized_client.get(
+            self.URL, {'recipes_limit': 1000})
+        self.assertEqual(
+            [len(item['recipes']) for item in response.data['results']],
+            [item['recipes_count'] for item in response.data['results']])
+
+    def test_invalid_recipes_limit(self):
+        for value in ('много', '0', '-1'):
+            with self.subTest(value=value):
+                response = self.authorized_client.get(
+                    self.URL, {'recipes_limit': value})
+                self.assertEqual(response.status_code, 400)
+
+
+class CountersTest(FoodgramTestCase):
+
+    def test_counters_follow_writes(self):
+        recipe = Recipe.custom_objects.first()
+        self.authorized_client.post(f'{RECIPES_URL}{recipe.id}/favorite/')
+        self.authorized_client.post(
+            f'{RECIPES_URL}{recipe.id}/shopping_cart/')
+        Favorite.objects.create(user=self.authors[1], recipe=recipe)
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.favorites_count, recipe.carts_count),
+                         (2, 1))
+        self.authorized_client.delete(f'{RECIPES_URL}{recipe.id}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+        author = self.authors[1]
+        self.authorized_client.post(f'/api/users/{author.id}/subscribe/')
+        author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((author.recipes_count, author.followers_count),
+                         (3, 1))
+        self.assertEqual(self.user.following_count, 2)
+        Recipe.custom_objects.filter(author=author).first().delete()
+        response = self.authorized_client.get('/api/users/subscriptions/')
+        self.assertEqual(
+            [item['recipes_count'] for item in response.data['results']],
+            [3, 2])
+
+    def test_full_save_keeps_counters(self):
+        recipe = Recipe.custom_objects.first()
+        author = User.objects.get(pk=self.authors[2].pk)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Subscription.objects.create(subscriber=self.user, author=author)
+        recipe.name = 'Переименован'
+        recipe.save()
+        author.first_name = 'Петр'
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual((recipe.name, recipe.favorites_count,
+                          recipe.popularity),
+                         ('Переименован', 1, settings.FAVORITE_SCORE))
+        self.assertEqual((author.first_name, author.followers_count),
+                         ('Петр', 1))
+
+    def test_rebuild_counters(self):
+        Recipe.custom_objects.update(favorites_count=5, popularity=7)
+        User.objects.update(recipes_count=0)
+        Cart.objects.create(user=self.user,
+                            recipe=Recipe.custom_objects.first())
+        with self.assertRaises(SystemExit):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+        self.assertEqual(
+            sorted(User.objects.values_list('recipes_count', flat=True)),
+            [0, 2, 3, 3])
+        self.assertFalse(
+            Recipe.custom_objects.exclude(favorites_count=0).exists())
+        self.assertEqual(
+            sorted(Recipe.custom_objects.values_list(
+                'popularity', flat=True))[-2:], [0, 1])
+
+
+class IngredientAutocompleteTest(FoodgramTestCase):
+    URL = '/api/ingredients/'
+
+    def test_prefix_matches_first(self):
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        Ingredient.objects.create(name='Фасоль', measurement_unit='г')
+        Ingredient.objects.create(name='Солод', measurement_unit='г')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Соленья', measurement_unit='г')
+        self.guest_client.get(self.URL, {'name': 'с'})
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(self.URL, {'name': 'СОЛ'})
+        self.assertEqual([item['name'] for item in response.data],
+                         ['Соленья', 'Солод', 'Соль', 'Фасоль'])
+        response = self.guest_client.get(self.URL,
+                                         {'name': 'сол', 'limit': 2})
+        self.assertEqual(len(response.data), 2)
+
+    def test_index_is_rebuilt_on_changes(self):
+        self.guest_client.get(self.URL, {'name': 'продукт'})
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.get(name='Продукт 0')
+            ingredient.name = 'Икра'
+            ingredient.save()
+            Ingredient.objects.get(name='Продукт 1').delete()
+        response = self.guest_client.get(self.URL, {'name': 'продукт'})
+        self.assertEqual(len(response.data), 3)
+
+
+class IngredientRankingTest(FoodgramTestCase):
+    URL = '/api/ingredients/'
+
+    def setUp(self):
+        super().setUp()
+        self.salt, self.malt, self.soda = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Солод', 'Сода'))
+
+    def names(self, **params):
+        response = self.authorized_client.get(
+            self.URL, {'name': 'со', **params})
+        return [item['name'] for item in response.data]
+
+    def test_usage_count_follows_recipe_writes(self):
+        self.assertEqual(self.names(), ['Сода', 'Солод', 'Соль'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_recipe('Суп', [self.salt, self.malt])
+        self.assertEqual(response.status_code, 201)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Каша', [self.salt])
+        self.salt.refresh_from_db()
+        self.assertEqual(self.salt.usage_count, 2)
+        self.assertEqual(self.names(), ['Соль', 'Солод', 'Сода'])
+        self.assertEqual(self.names(ranking='name'),
+                         ['Сода', 'Солод', 'Соль'])
+
+        recipe = Recipe.custom_objects.get(name='Суп')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.patch(
+                f'{RECIPES_URL}{recipe.id}/', {
+                    'tags': [self.tags[0].id],
+                    'ingredients': [{'id': self.soda.id, 'amount': 1}]},
+                format='json')
+        self.assertEqual(
+            list(Ingredient.objects.filter(name__startswith='Со')
+                 .values_list('name', 'usage_count')),
+            [('Сода', 1), ('Солод', 0), ('Соль', 1)])
+
+    def test_usage_changes_are_applied_in_place(self):
+        self.assertEqual(self.names(), ['Сода', 'Солод', 'Соль'])
+        entries = ingredient_index._entries
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Суп', [self.salt, self.malt])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Каша', [self.salt])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(ranking='popular'),
+                             ['Соль', 'Солод', 'Сода'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.custom_objects.get(name='Каша').delete()
+        self.assertEqual(self.names(ranking='popular'),
+                         ['Солод', 'Соль', 'Сода'])
+        self.assertIs(ingredient_index._entries, entries)
+        usage = dict(zip(
+            [item['id'] for item in entries[1]], entries[2]))
+        self.assertEqual((usage[self.salt.id], usage[self.malt.id]), (1, 1))
+
+    def test_rebuilt_when_usage_journal_is_lost(self):
+        self.names()
+        entries = ingredient_index._entries
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Суп', [self.malt])
+        versions_cache.delete(USAGE_SEQUENCE_KEY)
+        self.assertEqual(self.names(ranking='popular'),
+                         ['Солод', 'Сода', 'Соль'])
+        self.assertIsNot(ingredient_index._entries, entries)
+
+    def test_personal_ranking(self):
+        Ingredient.objects.filter(pk=self.malt.pk).update(usage_count=5)
+        self.create_recipe(self.user, 'Мой рецепт')
+        RecipeIngredient.objects.create(
+            recipe=Recipe.custom_objects.get(name='Мой рецепт'),
+            ingredient=self.soda, amount=1)
+        self.assertEqual(self.names(ranking='personal'),
+                         ['Сода', 'Солод', 'Соль'])
+        self.assertEqual(self.names(ranking='popular'),
+                         ['Солод', 'Сода', 'Соль'])
+
+
+class ConditionalGetTest(FoodgramTestCase):
+
+    def test_not_modified(self):
+        for url in (RECIPES_URL, TAGS_URL, '/api/ingredients/',
+                    '/api/ingredients/?name=прод'):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(0):
+                    not_modified = self.authorized_client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+                not_modified = self.guest_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_etag_changes_on_writes(self):
+        recipe = Recipe.custom_objects.first()
+        url = f'{RECIPES_URL}{recipe.id}/'
+        etag = self.authorized_client.get(url)['ETag']
+        guest_etag = self.guest_client.get(url)['ETag']
+        self.assertNotEqual(etag, guest_etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.post(f'{url}favorite/')
+        response = self.authorized_client.get(
+            url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=guest_etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', slug='new')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=guest_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_varies_by_format(self):
+        response = self.guest_client.get(TAGS_URL)
+        self.assertIn('Accept', response['Vary'])
+        self.assertIn('Authorization', response['Vary'])
+        browsable = self.guest_client.get(
+            TAGS_URL, HTTP_ACCEPT='text/html',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(browsable.status_code, 200)
+        self.assertNotEqual(browsable['ETag'], response['ETag'])
+        self.assertTrue(browsable['Content-Type'].startswith('text/html'))
+        indented = self.guest_client.get(
+            TAGS_URL, HTTP_ACCEPT='application/json; indent=4',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(indented.status_code, 200)
+
+
+class DownloadShoppingCartTest(FoodgramTestCase):
+    URL = f'{RECIPES_URL}download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        for recipe in Recipe.custom_objects.all()[:2]:
+            Cart.objects.create(user=self.user, recipe=recipe)
+
+    def download(self, **params):
+        response = self.authorized_client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_txt(self):
+        response = self.download()
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[2:], [f'Продукт {i}, (г) 200'
+                                     for i in range(3)])
+
+    def test_csv(self):
+        response = self.download(format='csv')
+        self.assertIn('foodgram_products.csv',
+                      response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines()[1], 'Продукт 0,г,200')
+
+    def test_pdf(self):
+        response = self.download(format='pdf')
+        self.assertTrue(b''.join(response.streaming_content)
+                        .startswith(b'%PDF'))
+
+    def test_guest(self):
+        response = self.guest_client.get(self.URL)
+        self.assertEqual(response.status_code, 401)
+
+
+class ShoppingListTest(FoodgramTestCase):
+    URL = f'{RECIPES_URL}shopping_list/'
+
+    def amounts(self):
+        response = self.authorized_client.get(self.URL)
+        return {item['name']: item['amount'] for item in response.data}
+
+    def test_shopping_list_follows_cart_and_recipe_changes(self):
+        own = self.create_recipe(self.user, 'Мой рецепт')
+        other = Recipe.custom_objects.exclude(pk=own.pk).first()
+        self.authorized_client.post(f'{RECIPES_URL}{own.id}/shopping_cart/')
+        self.authorized_client.post(
+            f'{RECIPES_URL}{other.id}/shopping_cart/')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.amounts(), {
+                'Продукт 0': 200, 'Продукт 1': 200, 'Продукт 2': 200})
+
+        self.authorized_client.patch(f'{RECIPES_URL}{own.id}/', {
+            'tags': [self.tags[0].id],
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 50},
+                {'id': self.ingredients[4].id, 'amount': 5}]},
+            format='json')
+        self.assertEqual(self.amounts(), {
+            'Продукт 0': 150, 'Продукт 1': 100, 'Продукт 2': 100,
+            'Продукт 4': 5})
+
+        self.authorized_client.delete(
+            f'{RECIPES_URL}{other.id}/shopping_cart/')
+        own.delete()
+        self.assertEqual(self.amounts(), {})
+
+    def admin_form_data(self, url):
+        """Данные формы админки в том виде, в каком их отправит браузер."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        forms = [response.context['adminform'].form]
+        for inline in response.context['inline_admin_formsets']:
+            forms += [inline.formset.management_form, *inline.formset]
+        data = {}
+        for form in forms:
+            for field in form:
+                value = field.value()
+                if value in (None, False, '') or hasattr(value, 'url'):
+                    continue
+                data[field.html_name] = (
+                    [str(item) for item in value]
+                    if isinstance(value, list) else str(value))
+        return data
+
+    def test_admin_recipe_changes(self):
+        admin = User.objects.create(
+            username='admin', email='admin@foodgram.ru',
+            is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Суп', self.ingredients[:3])
+        recipe = Recipe.custom_objects.get(name='Суп')
+        self.authorized_client.post(
+            f'{RECIPES_URL}{recipe.id}/shopping_cart/')
+        self.assertEqual(self.amounts(), {
+            'Продукт 0': 10, 'Продукт 1': 10, 'Продукт 2': 10})
+
+        url = reverse('admin:recipes_recipe_change', args=[recipe.id])
+        data = self.admin_form_data(url)
+        prefix = 'recipeingredients'
+        rows = {data[f'{prefix}-{i}-ingredient']: i for i in range(3)}
+        data[f'{prefix}-{rows[str(self.ingredients[0].id)]}-amount'] = '40'
+        data[f'{prefix}-{rows[str(self.ingredients[1].id)]}-DELETE'] = 'on'
+        data[f'{prefix}-3-ingredient'] = str(self.ingredients[3].id)
+        data[f'{prefix}-3-amount'] = '5'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.amounts(), {
+            'Продукт 0': 40, 'Продукт 2': 10, 'Продукт 3': 5})
+        self.ingredients[3].refresh_from_db()
+        self.assertEqual(self.ingredients[3].usage_count, 1)
+        recipe.refresh_from_db()
+        self.assertIn('Продукт 3', recipe.search_document)
+        self.assertNotIn('Продукт 1', recipe.search_document)
+
+        item = RecipeIngredient.objects.get(
+            recipe=recipe, ingredient=self.ingredients[3])
+        url = reverse('admin:recipes_recipeingredient_change',
+                      args=[item.id])
+        data = self.admin_form_data(url)
+        data['amount'] = '15'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.amounts()['Продукт 3'], 15)
+        url = reverse('admin:recipes_recipeingredient_delete',
+                      args=[item.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('Продукт 3', self.amounts())
+
+    def test_rebuild_shopping_lists(self):
+        Cart.objects.create(user=self.user,
+                            recipe=Recipe.custom_objects.first())
+        ShoppingListItem.objects.update(total=1)
+        with self.assertRaises(SystemExit):
+            call_command('rebuild_shopping_lists', '--check',
+                         stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        call_command('rebuild_shopping_lists', '--check', stdout=StringIO())
+        self.assertEqual(self.amounts(), {
+            'Продукт 0': 100, 'Продукт 1': 100, 'Продукт 2': 100})
+
+
+class BulkFavoriteCartTest(FoodgramTestCase):
+
+    def test_bulk_cart(self):
+        recipes = list(Recipe.custom_objects.values_list('id', flat=True))
+        self.authorized_client.post(
+            f'{RECIPES_URL}{recipes[0]}/shopping_cart/')
+        url = f'{RECIPES_URL}shopping_cart/bulk/'
+        response = self.authorized_client.post(
+            url, {'recipes': [recipes[0], recipes[1], recipes[1], 999,
+                              recipes[2]]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['already_exists', 'added', 'not_found', 'added'])
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.user, ingredient=self.ingredients[0]).total, 300)
+        self.assertEqual(
+            Recipe.custom_objects.get(pk=recipes[1]).carts_count, 1)
+
+        with self.assertNumQueries(9):
+            response = self.authorized_client.delete(
+                url, {'recipes': recipes[:2] + [recipes[5]]},
+                format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['removed', 'removed', 'not_in_list'])
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.user, ingredient=self.ingredients[0]).total, 100)
+        self.assertEqual(
+            Recipe.custom_objects.get(pk=recipes[1]).carts_count, 0)
+
+    def test_only_inserted_rows_are_counted(self):
+        recipes = list(Recipe.custom_objects.values_list('id', flat=True))
+        # Запись параллельного запроса, появившаяся после проверки.
+        Cart.objects.bulk_create([Cart(user=self.user, recipe_id=recipes[0])])
+        with self.assertNumQueries(1):
+            added = insert_user_recipes(Cart, self.user.id, recipes[:3])
+        self.assertEqual(added, recipes[1:3])
+        self.assertEqual(insert_user_recipes(Cart, self.user.id, recipes[:3]),
+                         [])
+        response = self.authorized_client.post(
+            f'{RECIPES_URL}shopping_cart/bulk/', {'recipes': recipes[:4]},
+            format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['already_exists', 'already_exists', 'already_exists', 'added'])
+        self.assertEqual(
+            dict(Recipe.custom_objects.filter(pk__in=recipes[:4]).values_list(
+                'pk', 'carts_count')),
+            {recipes[0]: 0, recipes[1]: 0, recipes[2]: 0, recipes[3]: 1})
+
+    def test_bulk_favorite_validation(self):
+        url = f'{RECIPES_URL}favorite/bulk/'
+        for recipes in ([], ['a'], list(range(1, 200))):
+            with self.subTest(recipes=recipes):
+                response = self.authorized_client.post(
+                    url, {'recipes': recipes}, format='json')
+                self.assertEqual(response.status_code, 400)
+        response = self.guest_client.post(url, {'recipes': [1]},
+                                          format='json')
+        self.assertEqual(response.status_code, 401)
+        response = self.authorized_client.post(
+            url, {'recipes': [1, 2]}, format='json')
+        self.assertEqual(Recipe.custom_objects.get(pk=1).favorites_count, 1)
+
+
+class RecipeImageVariantsTest(FoodgramTestCase):
+
+    def make_image(self, size):
+        buffer = BytesIO()
+        image = Image.new('RGB', size, 'orange')
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        image.save(buffer, 'JPEG', exif=exif)
+        return ('data:image/jpeg;base64,'
+                + b64encode(buffer.getvalue()).decode())
+
+    def test_variants_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_recipe(
+                'С картинкой', self.ingredients[:1],
+                image=self.make_image((1200, 800)))
+        recipe = Recipe.custom_objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.image_variants, {})
+        for callback in callbacks:
+            callback()
+        recipe.refresh_from_db()
+        self.assertEqual(sorted(recipe.image_variants, key=int),
+                         ['160', '480', '960'])
+        with Image.open(f'{TEMP_MEDIA_ROOT}/'
+                        f'{recipe.image_variants["160"]["webp"]}') as image:
+            self.assertEqual(image.size, (160, 107))
+        with Image.open(f'{TEMP_MEDIA_ROOT}/'
+                        f'{recipe.image_variants["480"]["jpeg"]}') as image:
+            self.assertFalse(image.getexif())
+
+        response = self.guest_client.get(f'{RECIPES_URL}{recipe.id}/')
+        self.assertTrue(response.data['image'].endswith(
+            recipe.image_variants['960']['jpeg']))
+        response = self.guest_client.get(RECIPES_URL, {'limit': 100})
+        self.assertTrue(response.data['results'][-1]['image'].endswith(
+            recipe.image_variants['480']['jpeg']))
+        response = self.authorized_client.post(
+            f'{RECIPES_URL}{recipe.id}/favorite/')
+        self.assertTrue(response.data['image'].endswith(
+            recipe.image_variants['160']['jpeg']))
+
+
+class ContentAddressedStorageTest(FoodgramTestCase):
+
+    def get_refcounts(self, recipe):
+        files = {recipe.image.name}
+        for formats in recipe.image_variants.values():
+            files.update(formats.values())
+        return dict(StoredFile.objects.filter(
+            name__in=files).values_list('name', 'refcount'))
+
+    def test_identical_images_are_stored_once(self):
+        first = Recipe.custom_objects.get(
+            pk=self.post_recipe('Первый', self.ingredients[:1]).data['id'])
+        second = Recipe.custom_objects.get(
+            pk=self.post_recipe('Второй', self.ingredients[:1]).data['id'])
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_variants, second.image_variants)
+        self.assertEqual(set(self.get_refcounts(first).values()), {2})
+
+        response = self.authorized_client.patch(
+            f'{RECIPES_URL}{first.id}/', {
+                'name': 'Первый',
+                'text': 'Описание',
+                'cooking_time': 5,
+                'image': SMALL_GIF,
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id,
+                                 'amount': 10}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        variants = first.image_variants
+        first.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_variants, variants)
+        self.assertEqual(set(self.get_refcounts(first).values()), {2})
+
+    def test_orphans_are_collected(self):
+        recipe = Recipe.custom_objects.get(
+            pk=self.post_recipe('Временный', self.ingredients[:1]).data['id'])
+        files = set(self.get_refcounts(recipe))
+        stray = default_storage.save('recipes/images/stray.txt',
+                                     ContentFile(b'stray'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.delete(f'{RECIPES_URL}{recipe.id}/')
+        self.assertEqual(
+            set(StoredFile.objects.filter(name__in=files).values_list(
+                'refcount', flat=True)), {0})
+
+        call_command('collect_orphan_images', grace=0, stdout=StringIO())
+        self.assertFalse(StoredFile.objects.filter(name__in=files).exists())
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+        self.assertTrue(default_storage.exists(stray))
+
+        call_command('collect_orphan_images', grace=0, scan=True,
+                     stdout=StringIO())
+        self.assertFalse(default_storage.exists(stray))
+
+
+class LoadFoodgramDataTest(FoodgramTestCase):
+
+    def load(self, *args):
+        stdout = StringIO()
+        call_command('load_foodgram_data', *args, stdout=stdout,
+                     stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_reload_is_idempotent(self):
+        self.load('--dry-run')
+        self.assertEqual(Ingredient.objects.count(), 5)
+        self.load()
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 2000)
+        self.assertEqual(Tag.objects.filter(slug='breakfast').count(), 1)
+        with self.assertNumQueries(10):
+            output = self.load()
+        self.assertIn('новых 0', output)
+        self.assertEqual(Ingredient.objects.count(), count)
+
+    def test_load_refreshes_cached_catalogue(self):
+        url = '/api/ingredients/'
+        response = self.guest_client.get(url, {'name': 'абрикос'})
+        self.assertEqual(response.data, [])
+        self.assertEqual(len(self.guest_client.get(TAGS_URL).data), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.load()
+        response = self.guest_client.get(url, {'name': 'абрикос'})
+        self.assertTrue(response.data)
+        self.assertGreater(len(self.guest_client.get(TAGS_URL).data), 3)
+
+    def test_diff(self):
+        self.load()
+        Tag.objects.filter(slug='breakfast').update(color='#000009')
+        Ingredient.objects.filter(name='абрикосовое варенье').delete()
+        output = self.load('--diff')
+        self.assertIn("+ {'name': 'абрикосовое варенье'", output)
+        self.assertIn("~ {'name': 'завтрак', 'color': '#000009'", output)
+        self.assertFalse(Ingredient.objects.filter(
+            name='абрикосовое варенье').exists())
+
+
+class RecipeTransferTest(FoodgramTestCase):
+
+    def snapshot(self):
+        return sorted(
+            (serialize_recipe(recipe) for recipe in
+             Recipe.custom_objects.add_related()),
+            key=lambda recipe: recipe['name'])
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_export_import_round_trip(self):
+        path = f'{self.directory}/recipes.ndjson'
+        expected = self.snapshot()
+        call_command('export_recipes', output=path, batch_size=3,
+                     stderr=StringIO())
+        Recipe.custom_objects.all().delete()
+        self.authors[2].delete()
+
+        stdout = StringIO()
+        call_command('import_recipes', path, batch_size=3, stdout=stdout,
+                     stderr=StringIO())
+        self.assertIn('Загружено рецептов: 8', stdout.getvalue())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.user).values_list(
+                'recipe__name', flat=True)),
+            {'Рецепт 0', 'Рецепт 3', 'Рецепт 6'})
+        self.assertEqual(
+            SimilarRecipe.objects.values('recipe').distinct().count(), 8)
+        for counter in COUNTERS:
+            with self.subTest(counter=counter[1]):
+                self.assertFalse(find_mismatches(*counter).exists())
+
+        stdout = StringIO()
+        call_command('import_recipes', path, stdout=stdout,
+                     stderr=StringIO())
+        self.assertIn('Загружено рецептов: 0', stdout.getvalue())
+        self.assertEqual(Recipe.custom_objects.count(), 8)
+
+
+class FeedTest(FoodgramTestCase):
+    URL = f'{RECIPES_URL}feed/'
+
+    def feed_names(self, **params):
+        response = self.authorized_client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def subscribe(self, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.post(f'/api/users/{author.id}/subscribe/')
+
+    def test_new_recipes_fan_out_to_followers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(self.authors[0], 'Свежий')
+            self.create_recipe(self.authors[1], 'Чужой')
+        self.assertEqual(self.feed_names(), ['Свежий'])
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.authors[1]).count(), 0)
+
+        self.subscribe(self.authors[1])
+        names = self.feed_names(limit=100)
+        self.assertEqual(names, ['Чужой', 'Свежий', 'Рецепт 7', 'Рецепт 4',
+                                 'Рецепт 1'])
+
+        response = self.authorized_client.get(self.URL, {'limit': 3})
+        response = self.authorized_client.get(response.data['next'])
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['Рецепт 4', 'Рецепт 1'])
+        self.assertIsNone(response.data['next'])
+
+        self.authorized_client.delete(
+            f'/api/users/{self.authors[1].id}/subscribe/')
+        self.assertEqual(self.feed_names(), ['Свежий'])
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_timeline_is_trimmed(self):
+        self.subscribe(self.authors[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(self.authors[1], 'Новый')
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.feed_names(), ['Новый', 'Рецепт 7'])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_timeline_and_popular_authors_are_merged(self):
+        User.objects.filter(pk=self.authors[1].pk).update(followers_count=5)
+        self.subscribe(self.authors[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(self.authors[0], 'Свежий')
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.user).values_list(
+                'recipe__name', flat=True)), ['Свежий'])
+        pages = []
+        response = self.authorized_client.get(self.URL, {'limit': 2})
+        while True:
+            pages.append([recipe['name']
+                          for recipe in response.data['results']])
+            if response.data['next'] is None:
+                break
+            response = self.authorized_client.get(response.data['next'])
+        self.assertEqual(pages, [['Свежий', 'Рецепт 7'],
+                                 ['Рецепт 4', 'Рецепт 1']])
+
+    def test_timeline_is_read_by_index_range(self):
+        self.subscribe(self.authors[1])
+        entry = TimelineEntry.objects.filter(user=self.user).first()
+        with CaptureQueriesContext(connection) as queries:
+            get_feed_ids(self.user, (entry.pub_date, entry.recipe_id), 2)
+        timeline = [query['sql'] for query in queries.captured_queries
+                    if 'recipes_timelineentry' in query['sql']]
+        self.assertEqual(len(timeline), 1)
+        self.assertIn('LIMIT 2', timeline[0])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {timeline[0]}')
+                plan = ' '.join(str(row) for row in cursor.fetchall())
+            self.assertIn('timeline_user_pub_date', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_authors_are_read_on_request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(self.authors[0], 'Популярный')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_names(),
+                         ['Популярный', 'Рецепт 6', 'Рецепт 3', 'Рецепт 0'])
+
+
+class RecipeSearchTest(FoodgramTestCase):
+
+    def search(self, client=None, **params):
+        response = (client or self.guest_client).get(RECIPES_URL, params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def setUp(self):
+        super().setUp()
+        update_all_search_documents(Recipe.custom_objects.all(), 100)
+
+    def test_ranked_search_over_name_text_and_ingredients(self):
+        beet = Ingredient.objects.create(name='Свекла',
+                                         measurement_unit='г')
+        self.post_recipe('Борщ украинский с пампушками', [beet])
+        self.post_recipe('Борщ', [beet])
+        self.post_recipe('Винегрет', [beet], tags=[self.tags[1].id])
+        self.assertEqual(self.search(search='борщ'),
+                         ['Борщ', 'Борщ украинский с пампушками'])
+        self.assertEqual(self.search(search='свекл борщ'),
+                         ['Борщ', 'Борщ украинский с пампушками'])
+        self.assertEqual(self.search(search='СВЕКЛА', tags='tag1'),
+                         ['Винегрет'])
+        self.assertEqual(
+            self.search(search='свекла', author=self.user.id,
+                        is_favorited=1, client=self.authorized_client),
+            [])
+        self.assertEqual(len(self.search(search='описание', limit=100)),
+                         11)
+        self.assertEqual(self.search(search='!!!'), [])
+
+    def test_index_follows_writes(self):
+        recipe = Recipe.custom_objects.get(pk=self.post_recipe(
+            'Солянка', self.ingredients[:1]).data['id'])
+        self.authorized_client.patch(f'{RECIPES_URL}{recipe.id}/', {
+            'name': 'Окрошка',
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[4].id, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(self.search(search='солянка'), [])
+        self.assertEqual(self.search(search='окрошка'), ['Окрошка'])
+        ingredient = Ingredient.objects.get(pk=self.ingredients[4].pk)
+        ingredient.name = 'Квас'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(self.search(search='квас'), ['Окрошка'])
+        recipe.delete()
+        self.assertEqual(self.search(search='окрошка'), [])
+
+
+class CookableTest(FoodgramTestCase):
+    URL = f'{RECIPES_URL}cookable/'
+
+    def cookable(self, *ingredients, **params):
+        response = self.guest_client.get(self.URL, {
+            'ingredients': ','.join(
+                str(ingredient.id) for ingredient in ingredients),
+            **params})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['name'], recipe['missing'])
+                for recipe in response.data['results']]
+
+    def test_ranked_by_missing_ingredients(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Омлет', self.ingredients[:2])
+            self.post_recipe('Салат', self.ingredients[3:])
+        results = self.cookable(*self.ingredients[:2], limit=3)
+        self.assertEqual(results, [('Омлет', 0), ('Рецепт 0', 1),
+                                   ('Рецепт 1', 1)])
+        self.assertEqual(
+            self.cookable(*self.ingredients[:2], missing=0, limit=100),
+            [('Омлет', 0)])
+        self.assertEqual(self.cookable(self.ingredients[4], missing=0), [])
+        self.assertEqual(self.cookable(self.ingredients[4]),
+                         [('Салат', 1)])
+        response = self.guest_client.get(self.URL, {
+            'ingredients': [self.ingredients[3].id, self.ingredients[4].id]})
+        self.assertEqual(response.data['results'][0]['name'], 'Салат')
+
+    def test_index_is_updated_incrementally(self):
+        self.cookable(self.ingredients[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.post_recipe(
+                'Омлет', self.ingredients[:1]).data['id']
+        with self.assertNumQueries(1):
+            results = cookable_index.search({self.ingredients[0].id}, 0)
+        self.assertEqual(results[:], [(recipe_id, 0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.patch(f'{RECIPES_URL}{recipe_id}/', {
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[4].id,
+                                 'amount': 1}],
+            }, format='json')
+        self.assertEqual(self.cookable(self.ingredients[0], missing=0), [])
+        self.assertEqual(self.cookable(self.ingredients[4]),
+                         [('Омлет', 0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.custom_objects.get(pk=recipe_id).delete()
+        self.assertEqual(self.cookable(self.ingredients[4]), [])
+
+    @override_settings(COOKABLE_BITSET_DENSITY=0)
+    def test_sparse_postings_ranking(self):
+        self.test_ranked_by_missing_ingredients()
+
+    @override_settings(COOKABLE_BITSET_DENSITY=0)
+    def test_sparse_postings_updates(self):
+        self.test_index_is_updated_incrementally()
+
+    def test_ranked_list_is_reused_between_pages(self):
+        ingredient_ids = {ingredient.id for ingredient in self.ingredients}
+        ranked = cookable_index.search(ingredient_ids, 2)
+        self.assertIs(cookable_index.search(ingredient_ids, 2), ranked)
+        response = self.guest_client.get(self.URL, {
+            'ingredients': ','.join(map(str, ingredient_ids)),
+            'limit': 3, 'page': 2})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipe_id for recipe_id, _ in ranked[3:6]])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Омлет', self.ingredients[:1])
+        self.assertIsNot(cookable_index.search(ingredient_ids, 2), ranked)
+
+    def test_rebuilt_when_journal_is_lost(self):
+        self.cookable(self.ingredients[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_recipe('Омлет', self.ingredients[:1])
+        versions_cache.clear()
+        self.assertEqual(
+            self.cookable(self.ingredients[0], missing=0), [('Омлет', 0)])
+
+    def test_invalid_params(self):
+        for params in ({}, {'ingredients': 'a'},
+                       {'ingredients': '1', 'missing': 9},
+                       {'ingredients': '1', 'missing': 'x'}):
+            with self.subTest(params=params):
+                response = self.guest_client.get(self.URL, params)
+                self.assertEqual(response.status_code, 400)
+
+
+class SimilarRecipesTest(FoodgramTestCase):
+
+    def similar(self, recipe_id):
+        response = self.guest_client.get(f'{RECIPES_URL}{recipe_id}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data]
+
+    def test_batch_build(self):
+        salad = self.post_recipe('Салат', self.ingredients[3:]).data['id']
+        soup = self.post_recipe('Окрошка', self.ingredients[2:]).data['id']
+        self.assertFalse(SimilarRecipe.objects.exists())
+        call_command('build_similar_recipes', batch_size=3,
+                     stdout=StringIO(), stderr=StringIO())
+        with self.assertNumQueries(2):
+            self.assertEqual(self.similar(salad), ['Окрошка'])
+        similar = self.similar(soup)
+        self.assertEqual(similar[0], 'Салат')
+        self.assertEqual(len(similar), 9)
+        recipe = Recipe.custom_objects.get(name='Рецепт 0')
+        similar = self.similar(recipe.id)
+        self.assertEqual(similar[-1], 'Окрошка')
+        self.assertNotIn('Салат', similar)
+        self.assertNotIn('Рецепт 0', similar)
+
+    @override_settings(SIMILAR_TOP_K=2)
+    def test_incremental_updates(self):
+        call_command('build_similar_recipes', stdout=StringIO(),
+                     stderr=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            salad = self.post_recipe('Салат', self.ingredients[3:]).data['id']
+        self.assertEqual(self.similar(salad), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            soup = self.post_recipe(
+                'Окрошка', self.ingredients[2:]).data['id']
+        self.assertEqual(self.similar(salad), ['Окрошка'])
+        self.assertEqual(self.similar(soup)[0], 'Салат')
+        self.assertEqual(len(self.similar(soup)), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.patch(f'{RECIPES_URL}{salad}/', {
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id,
+                                 'amount': 1}],
+            }, format='json')
+        self.assertEqual(self.similar(soup), ['Рецепт 0', 'Рецепт 1'])
+        self.assertEqual(self.similar(salad)[0], 'Рецепт 0')
+        Recipe.custom_objects.get(pk=soup).delete()
+        self.assertFalse(SimilarRecipe.objects.filter(
+            similar_id=soup).exists())
+
+    def test_missing_recipe(self):
+        for pk in (0, 999, 'abc'):
+            with self.subTest(pk=pk):
+                response = self.guest_client.get(
+                    f'{RECIPES_URL}{pk}/similar/')
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeRankingTest(FoodgramTestCase):
+
+    def names(self, client=None, **params):
+        response = (client or self.guest_client).get(RECIPES_URL, params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = {recipe.name: recipe
+                        for recipe in Recipe.custom_objects.all()}
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('Рецепт 3', 'Рецепт 5'):
+                self.authorized_client.post(
+                    f'{RECIPES_URL}{self.recipes[name].id}/favorite/')
+            self.authorized_client.post(
+                f'{RECIPES_URL}shopping_cart/bulk/',
+                {'recipes': [self.recipes['Рецепт 5'].id,
+                             self.recipes['Рецепт 6'].id]},
+                format='json')
+
+    def test_scores_follow_favorites_and_carts(self):
+        self.assertEqual(
+            {name: (recipe.popularity, recipe.trending)
+             for name, recipe in Recipe.custom_objects.in_bulk(
+                 field_name='name').items()
+             if recipe.popularity},
+            {'Рецепт 3': (2, 2.0), 'Рецепт 5': (3, 3.0),
+             'Рецепт 6': (1, 1.0)})
+        self.authorized_client.delete(
+            f'{RECIPES_URL}{self.recipes["Рецепт 5"].id}/favorite/')
+        recipe = Recipe.custom_objects.get(name='Рецепт 5')
+        self.assertEqual((recipe.popularity, recipe.trending), (1, 1.0))
+
+    def test_ordering_with_filters_and_cursor(self):
+        self.assertEqual(self.names(ordering='popular', limit=3),
+                         ['Рецепт 5', 'Рецепт 3', 'Рецепт 6'])
+        self.assertEqual(
+            self.names(ordering='popular', limit=2,
+                       author=self.authors[0].id),
+            ['Рецепт 3', 'Рецепт 6'])
+        expected = self.names(ordering='popular', limit=100)
+        seen = []
+        url = f'{RECIPES_URL}?ordering=popular&cursor=&limit=3'
+        while url:
+            response = self.guest_client.get(url)
+            seen += [recipe['name'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 8)
+
+    def test_trending_decays(self):
+        Recipe.custom_objects.filter(name='Рецепт 3').update(trending=10)
+        self.assertEqual(self.names(ordering='trending', limit=2),
+                         ['Рецепт 3', 'Рецепт 5'])
+        call_command('decay_trending', hours=24, stdout=StringIO())
+        self.assertEqual(
+            dict(Recipe.custom_objects.filter(trending__gt=0).values_list(
+                'name', 'trending')),
+            {'Рецепт 3': 5.0, 'Рецепт 5': 1.5, 'Рецепт 6': 0.5})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authorized_client.post(
+                f'{RECIPES_URL}{self.recipes["Рецепт 6"].id}/favorite/')
+        self.assertEqual(self.names(ordering='trending', limit=3),
+                         ['Рецепт 3', 'Рецепт 6', 'Рецепт 5'])
+        self.assertEqual(self.names(ordering='popular', limit=3),
+                         ['Рецепт 6', 'Рецепт 5', 'Рецепт 3'])
+        with override_settings(TRENDING_MIN_SCORE=1):
+            call_command('decay_trending', hours=24, stdout=StringIO())
+        self.assertEqual(
+            dict(Recipe.custom_objects.filter(trending__gt=0).values_list(
+                'name', 'trending')),
+            {'Рецепт 3': 2.5, 'Рецепт 6': 1.25})
+
+
+class GenerateDatasetTest(FoodgramTestCase):
+
+    def generate(self, prefix, **options):
+        call_command('generate_dataset', prefix=prefix, stdout=StringIO(),
+                     stderr=StringIO(), **options)
+        users = User.objects.filter(username__startswith=prefix)
+        first_user = min(users.values_list('pk', flat=True))
+        recipes = Recipe.custom_objects.filter(author__in=users)
+        first_recipe = min(recipes.values_list('pk', flat=True))
+        return {
+            'recipes': [
+                (recipe.author_id - first_user, recipe.cooking_time,
+                 sorted(item.ingredient_id
+                        for item in recipe.recipeingredients.all()),
+                 sorted(tag.id for tag in recipe.tags.all()))
+                for recipe in recipes.add_related().order_by('pk')],
+            'favorites': sorted(
+                (user - first_user, recipe - first_recipe)
+                for user, recipe in Favorite.objects.filter(
+                    user__in=users).values_list('user_id', 'recipe_id')),
+            'subscriptions': sorted(
+                (subscriber - first_user, author - first_user)
+                for subscriber, author in Subscription.objects.filter(
+                    subscriber__in=users).values_list(
+                    'subscriber_id', 'author_id')),
+        }
+
+    def test_same_seed_gives_same_data(self):
+        first = self.generate('gena', recipes=60, users=12, seed=7,
+                              batch_size=5)
+        self.assertEqual(len(first['recipes']), 60)
+        self.assertTrue(first['favorites'])
+        self.assertTrue(first['subscriptions'])
+        self.assertEqual(
+            first, self.generate('genb', recipes=60, users=12, seed=7,
+                                 batch_size=5))
+        self.assertNotEqual(
+            first, self.generate('genc', recipes=60, users=12, seed=8,
+                                 batch_size=5))
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_shopping_lists', '--check', stdout=StringIO())
+        dates = list(Recipe.custom_objects.filter(
+            author__username__startswith='gena').order_by('pk').values_list(
+            'pub_date', flat=True))
+        self.assertEqual(dates, sorted(dates))
+        self.assertLess(dates[-1], dates[0] + timedelta(days=3 * 365))
+
+    def test_authorship_is_skewed(self):
+        data = self.generate('gena', recipes=400, users=40, seed=1)
+        authors = Counter(author for author, *_ in data['recipes'])
+        self.assertGreater(authors[0], 400 / 40 * 3)
+        response = self.guest_client.get(RECIPES_URL, {'search': 'рецепт'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(FEED_BATCH_SIZE=7, FEED_MAX_LENGTH=5)
+    def test_timelines_and_trending_are_built(self):
+        self.generate('gena', recipes=300, users=30, seed=2, batch_size=40)
+        users = User.objects.filter(username__startswith='gena')
+        recipes = Recipe.custom_objects.filter(author__in=users)
+        expected = {}
+        for subscriber, author in Subscription.objects.filter(
+                subscriber__in=users).values_list(
+                'subscriber_id', 'author_id'):
+            expected.setdefault(subscriber, set()).update(
+                recipes.filter(author_id=author).values_list(
+                    'pub_date', 'pk'))
+        self.assertTrue(expected)
+        timelines = {}
+        for user_id, pub_date, recipe_id in TimelineEntry.objects.filter(
+                user__in=users).values_list('user_id', 'pub_date',
+                                            'recipe_id'):
+            timelines.setdefault(user_id, set()).add((pub_date, recipe_id))
+        self.assertEqual(timelines, {
+            user_id: set(sorted(keys, reverse=True)[:5])
+            for user_id, keys in expected.items()})
+        trending = dict(recipes.values_list('pk', 'trending'))
+        self.assertTrue(any(trending.values()))
+        self.assertFalse(any(
+            score for score in recipes.filter(
+                popularity=0).values_list('trending', flat=True)))
+        newest = recipes.filter(popularity__gt=0).latest('pub_date')
+        oldest = recipes.filter(
+            popularity=newest.popularity).earliest('pub_date')
+        self.assertGreater(trending[newest.pk], trending[oldest.pk])
+
+    def test_prefix_must_be_new(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', prefix='author',
+                         recipes=10, stdout=StringIO(), stderr=StringIO())
+
+
+class BenchmarkApiTest(FoodgramTestCase):
+
+    def benchmark(self, *scenarios, **options):
+        stdout = StringIO()
+        call_command('benchmark_api', iterations=2, warmup=0,
+                     scenarios=list(scenarios), stdout=stdout,
+                     user=self.user.email, **options)
+        return stdout.getvalue()
+
+    def test_report_and_baseline(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = f'{directory}/baseline.json'
+        output = self.benchmark(
+            'recipes_list:tags+author', 'recipe_detail',
+            'favorite_toggle', 'recipe_create_update',
+            'download_shopping_cart', output=path)
+        self.assertIn('recipe_create_update', output)
+        with open(path, encoding='utf-8') as file:
+            results = json.load(file)['results']
+        self.assertEqual(set(results), {
+            'recipes_list:tags+author', 'recipe_detail', 'favorite_toggle',
+            'recipe_create_update', 'download_shopping_cart'})
+        self.assertEqual(results['favorite_toggle']['requests'], 4)
+        self.assertEqual(
+            sum(result['errors'] for result in results.values()), 0)
+        self.assertGreater(results['recipe_detail']['queries'], 0)
+        self.assertFalse(User.objects.filter(
+            username__startswith='benchmark_').exists())
+        self.assertEqual(Token.objects.count(), 0)
+        self.assertEqual(Recipe.custom_objects.count(), 8)
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+
+        self.benchmark('recipe_detail', baseline=path, threshold=100)
+        results['recipe_detail']['queries'] -= 1
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'results': results}, file)
+        with self.assertRaisesMessage(CommandError, 'recipe_detail: SQL'):
+            self.benchmark('recipe_detail', baseline=path, threshold=100)
+
+    @override_settings(ALLOWED_HOSTS=['.example.com'], DEBUG=False)
+    def test_requests_use_allowed_host(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = f'{directory}/results.json'
+        self.benchmark('recipe_detail', output=path)
+        with open(path, encoding='utf-8') as file:
+            result = json.load(file)['results']['recipe_detail']
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['queries'], 0)
+
+    @override_settings(RECIPES_MAX_LIMIT=None)
+    def test_errors_fail_the_command(self):
+        with self.assertLogs('django.request', 'ERROR'):
+            with self.assertRaisesMessage(CommandError, 'subscriptions'):
+                self.benchmark('subscriptions', 'recipe_detail')
+        self.assertFalse(User.objects.filter(
+            username__startswith='benchmark_').exists())
+
+    def test_live_database_needs_flag(self):
+        name = connection.settings_dict['NAME']
+        self.addCleanup(connection.settings_dict.__setitem__, 'NAME', name)
+        connection.settings_dict['NAME'] = 'foodgram'
+        with self.assertRaisesMessage(CommandError, '--allow-live-db'):
+            self.benchmark('recipe_detail')
+        self.benchmark('recipe_detail', allow_live_db=True)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([7.0], 95), 7.0)
+        self.assertEqual(percentile([1.0, 2.0, 3.0, 4.0], 50), 2.5)
+        self.assertAlmostEqual(
+            percentile([float(i) for i in range(1, 101)], 95), 95.05)
+        self.assertEqual(percentile([1.0, 2.0, 3.0, 4.0], 100), 4.0)
+
+    def test_all_scenarios_succeed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = f'{directory}/results.json'
+        self.benchmark('*', output=path)
+        with open(path, encoding='utf-8') as file:
+            results = json.load(file)['results']
+        self.assertEqual(len(results), 46)
+        self.assertEqual(
+            [name for name, result in results.items() if result['errors']],
+            [])
+
+
+@override_settings(REQUEST_TIMING=True, REQUEST_TIMING_SLOW=10000)
+class RequestTimingTest(FoodgramTestCase):
+
+    def get_timing(self, response):
+        timing = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timing[name] = dict(param.split('=', 1) for param in params)
+        return timing
+
+    def test_server_timing_header(self):
+        with self.assertLogs('api.middleware', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.authorized_client.get(RECIPES_URL)
+        self.assertEqual(response.status_code, 200)
+        timing = self.get_timing(response)
+        self.assertEqual(timing['db']['desc'], f'"{len(queries)} queries"')
+        self.assertEqual(set(timing), {'db', 'db-slowest', 'db-duplicates',
+                                       'view', 'render', 'total'})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertEqual(record['queries'], len(queries))
+        self.assertEqual(record['path'], RECIPES_URL)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertLessEqual(record['view_ms'] + record['render_ms'],
+                             record['total_ms'])
+        self.assertNotIn('slowest_sql', record)
+
+    @override_settings(REQUEST_TIMING_SLOW=0, REQUEST_TIMING_SLOW_QUERIES=2)
+    def test_slow_request_logs_sql(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.authorized_client.get(RECIPES_URL)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(len(record['slowest_sql']), 2)
+        self.assertIn('SELECT', record['slowest_sql'][0]['sql'])
+        self.assertGreaterEqual(record['slowest_sql'][0]['ms'],
+                                record['slowest_sql'][1]['ms'])
+
+    def test_duplicate_queries(self):
+        stats = QueryStats(keep_slowest=2)
+        for pk in (1, 2, 3):
+            stats(lambda *args: None, 'SELECT %s', [pk], False, {})
+        stats(lambda *args: None, 'SELECT 1', [], False, {})
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(len(stats.slowest), 2)
+        self.assertEqual(stats.get_duplicates(3), {'SELECT %s': 3})
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_disabled(self):
+        response = self.guest_client.get(RECIPES_URL)
+        self.assertNotIn('Server-Timing', response)
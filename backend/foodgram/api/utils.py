@@ -1,9 +1,33 @@
-from django.http import HttpResponse
+import csv
+from collections import defaultdict
+from io import BytesIO
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from api.cache import USER_SCOPE, invalidate
 from recipes.models import Recipe
+from recipes.signals import change_user_recipes, user_recipes_in_bulk
+
+ADDED = 'added'
+ALREADY_EXISTS = 'already_exists'
+REMOVED = 'removed'
+NOT_IN_LIST = 'not_in_list'
+NOT_FOUND = 'not_found'
+CART_CSV_HEADER = ('Продукт', 'Единица измерения', 'Количество')
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 16
+PDF_FONT_SIZE = 12
+PDF_TITLE_SIZE = 16
 
 
 def create_favorite_cart(serial, request, pk=None):
@@ -22,17 +46,198 @@ def delete_favorite_cart(model, request, pk=None):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def get_bulk_recipe_ids(serial, request):
+    serializer = serial(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+    found = set(Recipe.custom_objects.filter(
+        pk__in=recipe_ids).order_by().values_list('pk', flat=True))
+    return recipe_ids, found
+
+
+def bulk_response(recipe_ids, statuses):
+    return Response({'results': [
+        {'id': recipe_id, 'status': statuses.get(recipe_id, NOT_FOUND)}
+        for recipe_id in recipe_ids]})
+
+
+def insert_user_recipes(model, user_id, recipe_ids):
+    """Вставляет недостающие записи, возвращает id вставленных рецептов.
+
+    ON CONFLICT DO NOTHING RETURNING возвращает только строки этого
+    запроса: запись, вставленную параллельным запросом, не посчитать
+    дважды. Поддерживается PostgreSQL и SQLite 3.35+.
+    """
+    if not recipe_ids:
+        return []
+    meta = model._meta
+    quote = connection.ops.quote_name
+    recipe_column = quote(meta.get_field('recipe').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(meta.db_table)} '
+            f'({quote(meta.get_field("user").column)}, {recipe_column}) '
+            f'VALUES {", ".join(["(%s, %s)"] * len(recipe_ids))} '
+            f'ON CONFLICT DO NOTHING RETURNING {recipe_column}',
+            [value for recipe_id in recipe_ids
+             for value in (user_id, recipe_id)])
+        inserted = {row[0] for row in cursor.fetchall()}
+    return [recipe_id for recipe_id in recipe_ids if recipe_id in inserted]
+
+
+@transaction.atomic
+def bulk_create_favorite_cart(model, serial, request):
+    recipe_ids, found = get_bulk_recipe_ids(serial, request)
+    added = insert_user_recipes(
+        model, request.user.id,
+        [recipe_id for recipe_id in recipe_ids if recipe_id in found])
+    change_user_recipes(model, request.user.id, added, 1)
+    invalidate(USER_SCOPE.format(user=request.user.id), 'recipe_scores')
+    statuses = dict.fromkeys(found, ALREADY_EXISTS)
+    statuses.update(dict.fromkeys(added, ADDED))
+    return bulk_response(recipe_ids, statuses)
+
+
+@transaction.atomic
+def bulk_delete_favorite_cart(model, serial, request):
+    recipe_ids, found = get_bulk_recipe_ids(serial, request)
+    with user_recipes_in_bulk() as removed:
+        model.objects.filter(user=request.user,
+                             recipe_id__in=found).delete()
+    change_user_recipes(model, request.user.id, removed, -1)
+    invalidate(USER_SCOPE.format(user=request.user.id), 'recipe_scores')
+    statuses = dict.fromkeys(found, NOT_IN_LIST)
+    statuses.update(dict.fromkeys(removed, REMOVED))
+    return bulk_response(recipe_ids, statuses)
+
+
 def get_author(request):
     return request.parser_context.get('kwargs').get('pk')
 
 
-def generate_cart(queryset):
-    msg = ''
-    for item in queryset:
-        msg += (f'{item["ingredient__name"]}, '
-                f'({item["ingredient__measurement_unit"]}) '
-                f'{item["total"]}') + '\n'
-    response = HttpResponse(msg, content_type='text/plain')
+def get_recipes_limit(request):
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None:
+        return None
+    try:
+        recipes_limit = int(recipes_limit)
+    except ValueError:
+        raise ValidationError(
+            {'recipes_limit': settings.NOT_POSITIVE_INTEGER_LIMIT})
+    if recipes_limit < 1:
+        raise ValidationError(
+            {'recipes_limit': settings.NOT_POSITIVE_INTEGER_LIMIT})
+    return min(recipes_limit, settings.RECIPES_MAX_LIMIT)
+
+
+def attach_limited_recipes(authors, recipes_limit):
+    """Рецепты всех авторов страницы одним запросом."""
+    recipes = Recipe.custom_objects.filter(author__in=authors).only(
+        'id', 'author_id', 'name', 'image', 'image_variants', 'cooking_time')
+    if recipes_limit:
+        recipes = recipes.limit_per_author(recipes_limit)
+    recipes_by_author = defaultdict(list)
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    for author in authors:
+        author.limited_recipes = recipes_by_author[author.id]
+
+
+def get_autocomplete_limit(request):
+    try:
+        limit = int(request.query_params.get(
+            'limit', settings.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return settings.AUTOCOMPLETE_LIMIT
+    return min(max(limit, 1), settings.AUTOCOMPLETE_MAX_LIMIT)
+
+
+def get_cookable_params(request):
+    """Ингредиенты пользователя и сколько их может не хватать."""
+    ingredient_ids = set()
+    for value in request.query_params.getlist('ingredients'):
+        for item in value.split(','):
+            try:
+                ingredient_ids.add(int(item))
+            except ValueError:
+                raise ValidationError({'ingredients': (
+                    settings.NOT_POSITIVE_INTEGER_INGREDIENT.format(
+                        ingredient=item))})
+    if not ingredient_ids:
+        raise ValidationError({'ingredients': settings.MUST_HAVE_FIELD})
+    try:
+        max_missing = int(request.query_params.get(
+            'missing', settings.COOKABLE_MISSING))
+    except ValueError:
+        max_missing = -1
+    if not 0 <= max_missing <= settings.COOKABLE_MAX_MISSING:
+        raise ValidationError({'missing': settings.WRONG_MISSING.format(
+            max=settings.COOKABLE_MAX_MISSING)})
+    return ingredient_ids, max_missing
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def cart_items(queryset):
+    return queryset.iterator(chunk_size=settings.CART_CHUNK_SIZE)
+
+
+def generate_cart_txt(queryset):
+    yield f'{settings.CART_TITLE}\n\n'
+    for item in cart_items(queryset):
+        yield (f'{item["ingredient__name"]}, '
+               f'({item["ingredient__measurement_unit"]}) '
+               f'{item["total"]}\n')
+
+
+def generate_cart_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CART_CSV_HEADER)
+    for item in cart_items(queryset):
+        yield writer.writerow((item['ingredient__name'],
+                               item['ingredient__measurement_unit'],
+                               item['total']))
+
+
+def generate_cart_pdf(queryset):
+    if 'foodgram' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('foodgram', settings.PDF_FONT_PATH))
+    buffer = BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    page.setFont('foodgram', PDF_TITLE_SIZE)
+    page.drawString(PDF_MARGIN, y, settings.CART_TITLE)
+    y -= 2 * PDF_LINE_HEIGHT
+    page.setFont('foodgram', PDF_FONT_SIZE)
+    for item in cart_items(queryset):
+        if y < PDF_MARGIN:
+            page.showPage()
+            page.setFont('foodgram', PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        page.drawString(PDF_MARGIN, y, (
+            f'{item["ingredient__name"]}, '
+            f'({item["ingredient__measurement_unit"]}) {item["total"]}'))
+        y -= PDF_LINE_HEIGHT
+    page.save()
+    yield buffer.getvalue()
+
+
+CART_GENERATORS = {
+    'txt': generate_cart_txt,
+    'csv': generate_cart_csv,
+    'pdf': generate_cart_pdf,
+}
+
+
+def generate_cart(queryset, renderer):
+    response = StreamingHttpResponse(
+        CART_GENERATORS[renderer.format](queryset),
+        content_type=(f'{renderer.media_type}; charset={renderer.charset}'
+                      if renderer.charset else renderer.media_type))
     response['Content-Disposition'] = (
-        'attachment; filename=foodgram_products.txt')
+        f'attachment; filename=foodgram_products.{renderer.format}')
     return response
@@ -1,4 +1,5 @@
-from django.db.models import Count, Q, Sum
+from django.conf import settings
+from django.db.models import BooleanField, Value
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status, viewsets
@@ -7,48 +8,108 @@ from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
+from api.autocomplete import (RANKING_PERSONAL, RANKINGS, get_user_history,
+                              ingredient_index)
+from api.cache import AnonymousCacheMixin, ConditionalGetMixin
+from api.cookable import cookable_index
 from api.filters import RecipeFilter
+from api.pagination import (KeysetPagination, PageLimitPagination,
+                            RecipePagination)
 from api.permissions import IsAuthorOrReadOnly
-from api.serializers import (CartSerializer, FavoriteSerializer,
+from api.renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from api.serializers import (BulkRecipesSerializer, CartSerializer,
+                             CookableRecipeSerializer, FavoriteSerializer,
                              IngredientSerializer, RecipeSerializerRead,
-                             RecipeSerializerWrite, SubscribeSerializer,
+                             RecipeSerializerWrite, ShoppingListItemSerializer,
+                             ShortRecipe, SubscribeSerializer,
                              SubscriptionSerializer, TagSerializer)
-from api.utils import (create_favorite_cart, delete_favorite_cart,
-                       generate_cart, get_author)
+from api.utils import (attach_limited_recipes, bulk_create_favorite_cart,
+                       bulk_delete_favorite_cart, create_favorite_cart,
+                       delete_favorite_cart, generate_cart, get_author,
+                       get_autocomplete_limit, get_cookable_params,
+                       get_recipes_limit)
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipeIngredient, Subscription, Tag, User)
+                            ShoppingListItem, Subscription, Tag, User)
+from recipes.timeline import get_feed_ids
 
+CART_RENDERERS = [PlainTextRenderer, CSVRenderer, PDFRenderer]
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_scopes = ('tags',)
+    cache_timeout = settings.CATALOGUE_CACHE_TIMEOUT
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     pagination_class = None
+    cache_scopes = ('ingredients',)
+    conditional_scopes = ('ingredients', 'ingredient_usage')
+    cache_timeout = settings.CATALOGUE_CACHE_TIMEOUT
+    queryset = Ingredient.objects.all()
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        ingredient_name = self.request.query_params.get('name')
-        if ingredient_name:
-            queryset = queryset.filter(
-                Q(name__istartswith=ingredient_name) | Q(
-                    name__icontains=ingredient_name))
-        return queryset
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('name'):
+            return super().list(request, *args, **kwargs)
+        return self.get_conditional_response(
+            self.autocomplete, request, *args, **kwargs)
 
+    def autocomplete(self, request, *args, **kwargs):
+        ingredient_name = request.query_params['name']
+        ranking = request.query_params.get(
+            'ranking', settings.INGREDIENT_RANKING)
+        if ranking not in RANKINGS:
+            ranking = settings.INGREDIENT_RANKING
+        history = None
+        if ranking == RANKING_PERSONAL and request.user.is_authenticated:
+            history = get_user_history(request.user)
+        return Response(ingredient_index.search(
+            ingredient_name, get_autocomplete_limit(request),
+            ranking, history))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     permission_classes = [IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly]
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+    cursor_ordering = ('pub_date', 'id')
+    feed_ordering = ('-pub_date', '-id')
+    # Сортировки по хранимым оценкам, в том числе для курсора.
+    orderings = {
+        'popular': ('-popularity', '-id'),
+        'trending': ('-trending', '-id'),
+    }
+    cache_scopes = ('recipes', 'tags', 'ingredients', 'users')
+    cache_timeout = settings.RECIPES_CACHE_TIMEOUT
 
     def get_queryset(self):
+        queryset = Recipe.custom_objects.add_related()
         if self.request.user.is_authenticated:
-            return Recipe.custom_objects.add_user_annotations(
-                self.request.user.id).all()
-        return Recipe.custom_objects.all()
+            return queryset.add_user_annotations(self.request.user.id)
+        return queryset
+
+    def get_ordering(self):
+        return self.orderings.get(self.request.query_params.get('ordering'))
+
+    def get_cache_scopes(self, request):
+        if self.get_ordering() is None:
+            return self.cache_scopes
+        return (*self.cache_scopes, 'recipe_scores')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        ordering = self.get_ordering()
+        if ordering is None:
+            return queryset
+        self.cursor_ordering = ordering
+        return queryset.order_by(*ordering)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -73,25 +134,111 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def delete_shopping_cart(self, request, pk):
         return delete_favorite_cart(Cart, request, pk)
 
-    @action(detail=False, methods=['GET'],
+    @action(detail=False, methods=['POST'], url_path='favorite/bulk',
+            permission_classes=[IsAuthenticated])
+    def favorite_bulk(self, request):
+        return bulk_create_favorite_cart(Favorite, BulkRecipesSerializer,
+                                         request)
+
+    @favorite_bulk.mapping.delete
+    def delete_favorite_bulk(self, request):
+        return bulk_delete_favorite_cart(Favorite, BulkRecipesSerializer,
+                                         request)
+
+    @action(detail=False, methods=['POST'], url_path='shopping_cart/bulk',
             permission_classes=[IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        return bulk_create_favorite_cart(Cart, BulkRecipesSerializer,
+                                         request)
+
+    @shopping_cart_bulk.mapping.delete
+    def delete_shopping_cart_bulk(self, request):
+        return bulk_delete_favorite_cart(Cart, BulkRecipesSerializer,
+                                         request)
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=[IsAuthenticated],
+            renderer_classes=CART_RENDERERS)
     def download_shopping_cart(self, request):
-        queryset_ingredients = RecipeIngredient.objects.filter(
-            recipe__carts__user=request.user).values(
+        queryset_ingredients = ShoppingListItem.objects.filter(
+            user=request.user).values(
             'ingredient__name',
-            'ingredient__measurement_unit', ).order_by(
-            'ingredient__name').annotate(total=Sum('amount'))
+            'ingredient__measurement_unit',
+            'total').order_by('ingredient__name')
+
+        return generate_cart(queryset_ingredients,
+                             request.accepted_renderer)
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=[IsAuthenticated])
+    def shopping_list(self, request):
+        queryset = ShoppingListItem.objects.filter(
+            user=request.user).select_related('ingredient').order_by(
+            'ingredient__name')
+        return Response(
+            ShoppingListItemSerializer(queryset, many=True).data)
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        self.cursor_ordering = self.feed_ordering
+        paginator = KeysetPagination()
+        page = paginator.paginate_ids(
+            lambda cursor, size: get_feed_ids(request.user, cursor, size),
+            self.get_queryset(), request, view=self)
+        serializer = RecipeSerializerRead(
+            page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['GET'])
+    def cookable(self, request):
+        """Рецепты из имеющихся ингредиентов: сначала готовые целиком."""
+        ingredient_ids, max_missing = get_cookable_params(request)
+        paginator = PageLimitPagination()
+        page = paginator.paginate_queryset(
+            cookable_index.search(ingredient_ids, max_missing), request,
+            view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page])
+        results = []
+        for recipe_id, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.missing = missing
+                results.append(recipe)
+        serializer = CookableRecipeSerializer(
+            results, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
-        return generate_cart(queryset_ingredients)
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk):
+        """Похожие рецепты из таблицы, собранной build_similar_recipes."""
+        recipe = generics.get_object_or_404(
+            Recipe.custom_objects.only('id'), pk=pk)
+        recipes = Recipe.custom_objects.filter(
+            similar_to__recipe_id=recipe.pk,
+        ).order_by('-similar_to__score', 'similar_to__similar_id').only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time')
+        return Response(ShortRecipe(
+            recipes, many=True, context=self.get_serializer_context()).data)
 
 
 class SubscriptionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = SubscriptionSerializer
     permission_classes = [IsAuthorOrReadOnly, IsAuthenticated]
+    pagination_class = RecipePagination
+    cursor_ordering = ('username', 'id')
 
     def get_queryset(self):
-        return User.objects.annotate(recipes_count=Count('recipes')).filter(
-            following__subscriber=self.request.user.id)
+        return User.objects.filter(
+            following__subscriber=self.request.user.id
+        ).annotate(is_subscribed=Value(True, output_field=BooleanField()))
+
+    def paginate_queryset(self, queryset):
+        authors = super().paginate_queryset(queryset)
+        if authors is not None:
+            attach_limited_recipes(authors, get_recipes_limit(self.request))
+        return authors
 
 
 class APISubscribtionCreateDelete(generics.CreateAPIView,
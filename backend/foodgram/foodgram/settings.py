@@ -1,7 +1,9 @@
 import os
+import tempfile
 from pathlib import Path
 
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 environ.Env.read_env()
@@ -32,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -83,6 +86,40 @@ else:
         }
     }
 
+# Версии ключей кэша должны быть видны всем процессам: воркерам gunicorn
+# и командам manage.py. Поэтому по умолчанию кэш файловый, а LocMemCache
+# годится только для отладки.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_cache')),
+    },
+    # Версии областей кэша и журналы индексов: их нельзя вытеснять
+    # вместе с закэшированными ответами.
+    'versions': {
+        'BACKEND': os.getenv(
+            'VERSION_CACHE_BACKEND',
+            default='api.cache_backends.VersionFileCache'),
+        'LOCATION': os.getenv(
+            'VERSION_CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_versions')),
+        'TIMEOUT': None,
+    },
+}
+if CACHES['versions']['BACKEND'].endswith(
+        ('FileCache', 'FileBasedCache', 'LocMemCache')):
+    # Истекшие записи журналов чистятся, когда записей больше MAX_ENTRIES.
+    CACHES['versions']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+for alias, params in CACHES.items():
+    if not DEBUG and params['BACKEND'].endswith('LocMemCache'):
+        raise ImproperlyConfigured(
+            f'LocMemCache не общий для процессов: задайте бэкенд кэша '
+            f'{alias}.')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -107,7 +144,7 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
 
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageLimitPagination',
     'PAGE_SIZE': 6,
 
 }
@@ -126,6 +163,7 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
 
 AUTH_USER_MODEL = 'users.User'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -142,9 +180,80 @@ DJOSER = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['Server-Timing']
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_TIMING_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
 DATA_DIR = (BASE_DIR / 'static/data/')
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
 
 MODEL_STR_LIMIT = 30
+MAX_PAGE_LIMIT = 100
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_MAX_LIMIT = 100
+RECIPES_MAX_LIMIT = 100
+INGREDIENT_RANKING = 'popular'
+INGREDIENT_HISTORY_BOOST = 10
+CART_CHUNK_SIZE = 2000
+BULK_RECIPES_LIMIT = 100
+LOAD_BATCH_SIZE = 500
+TRANSFER_BATCH_SIZE = 500
+FEED_MAX_LENGTH = 500
+FEED_FANOUT_LIMIT = 10000
+FEED_BATCH_SIZE = 1000
+COOKABLE_MISSING = 2
+COOKABLE_MAX_MISSING = 5
+COOKABLE_BATCH_SIZE = 5000
+COOKABLE_JOURNAL_LIMIT = 1000
+COOKABLE_JOURNAL_TIMEOUT = 60 * 60
+COOKABLE_RANKED_CACHE = 128
+# Ингредиент хранится битовым множеством, если оно не больше массива
+# array('I'): в рецептах не меньше 1/32 от максимального id.
+COOKABLE_BITSET_DENSITY = 32
+SIMILAR_TOP_K = 10
+SIMILAR_CANDIDATES = 500
+SIMILAR_COMMON_SHARE = 0.05
+SIMILAR_COMMON_MIN = 100
+SIMILAR_BATCH_SIZE = 1000
+FAVORITE_SCORE = 2
+CART_SCORE = 1
+TRENDING_HALF_LIFE = 24
+TRENDING_DECAY_INTERVAL = 1
+TRENDING_MIN_SCORE = 0.01
+SCORE_BATCH_SIZE = 5000
+DATASET_BATCH_SIZE = 2000
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', default=2))
+TASK_ALWAYS_EAGER = False
+REQUEST_TIMING = (os.getenv('REQUEST_TIMING', default='False') == 'True')
+REQUEST_TIMING_SLOW = int(os.getenv('REQUEST_TIMING_SLOW', default=500))
+REQUEST_TIMING_DUPLICATES = 3
+REQUEST_TIMING_SLOW_QUERIES = 5
+RECIPE_IMAGE_WIDTHS = (160, 480, 960)
+RECIPE_VARIANTS_DIR = 'recipes/variants/'
+RECIPE_IMAGES_DIR = 'recipes/images/'
+STORED_FILE_GRACE_PERIOD = 60 * 60
+THUMBNAIL_WIDTH = 160
+CARD_IMAGE_WIDTH = 480
+DETAIL_IMAGE_WIDTH = 960
+CART_TITLE = 'Список покупок Foodgram'
+RECIPES_CACHE_TIMEOUT = 60
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+API_CACHE_LOCK_TIMEOUT = 10
+API_CACHE_LOCK_POLL = 0.05
+LENGTH255 = 255
 LENGTH254 = 254
 LENGTH150 = 150
 LENGTH200 = 200
@@ -159,8 +268,13 @@ MUST_HAVE_FIELD_ID = 'id обязательное поле для ингреди
 NOT_POSITIVE_INTEGER = ('Значение amount для ингредиента {ingredient} '
                         'должно быть целым и больше нуля!')
 DUPLICATE_INGREDIENTS = 'Дублирование ингредиента {ingredient} в запросе!'
+NOT_POSITIVE_INTEGER_LIMIT = 'Значение должно быть целым и больше нуля!'
+NOT_POSITIVE_INTEGER_INGREDIENT = ('Id ингредиента {ingredient} должен быть '
+                                   'целым числом!')
+WRONG_MISSING = 'Значение должно быть целым от 0 до {max}!'
 DUPLICATE_TAGS = 'Дублирование тега {tag} в запросе!'
 NO_INGREDIENT = 'Такого ингредиента {ingredient} не существует!'
+NO_TAG = 'Такого тега {tag} не существует!'
 DUPLICATE_FAVORITES = 'Дублирование рецепта {recipe} в избранном!'
 DUPLICATE_SUBSCRIPTION = 'Дублирование подписки на автора {author}!'
 NO_SUBSCRIPTION = ('У пользователя {subscriber} нет подписки '
@@ -1,8 +1,32 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
 from django.utils.safestring import mark_safe
 
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipeIngredient, Subscription, Tag)
+                            RecipeIngredient, ShoppingListItem, StoredFile,
+                            Subscription, Tag)
+from recipes.search import search_recipes, update_search_documents
+from recipes.shopping_list import change_recipe_amounts, get_recipes_amounts
+from recipes.similarity import update_similar_recipes
+from recipes.tasks import enqueue
+
+
+@contextmanager
+def track_recipe_changes(recipe_ids):
+    """Переносит правку состава рецептов в списки покупок и поиск.
+
+    Счетчики использования ингредиентов обновляют сигналы.
+    """
+    recipe_ids = list(recipe_ids)
+    old_amounts = {recipe_id: get_recipes_amounts([recipe_id])
+                   for recipe_id in recipe_ids}
+    yield
+    for recipe_id in recipe_ids:
+        change_recipe_amounts(recipe_id, old_amounts[recipe_id],
+                              get_recipes_amounts([recipe_id]))
+    update_search_documents(recipe_ids)
+    enqueue(update_similar_recipes, recipe_ids)
 
 
 @admin.register(Tag)
@@ -50,13 +74,18 @@ class RecipeAdmin(admin.ModelAdmin):
         'pub_date',
         'image_screen',
     )
-    search_fields = ('name', 'author',)
+    search_fields = ('name',)
     list_filter = ('name', 'author', 'tags')
-    readonly_fields = ('favorites_count',)
+    readonly_fields = ('favorites_count', 'carts_count')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_recipes(queryset, search_term), False
 
-    @admin.display(description='Счетчик избранных')
-    def favorites_count(self, obj):
-        return obj.favorites.all().count()
+    def save_related(self, request, form, formsets, change):
+        with track_recipe_changes([form.instance.id]):
+            super().save_related(request, form, formsets, change)
 
     @admin.display(description='Превью рецепта')
     def image_screen(self, obj):
@@ -95,6 +124,22 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     search_fields = ('recipe', 'ingredient',)
     list_filter = ('recipe', 'ingredient',)
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        with track_recipe_changes(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with track_recipe_changes([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with track_recipe_changes(set(queryset.values_list(
+                'recipe_id', flat=True))):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
@@ -116,3 +161,27 @@ class FavoriteAdmin(admin.ModelAdmin):
     )
     search_fields = ('user',)
     list_filter = ('user',)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'user',
+        'ingredient',
+        'total',
+    )
+    search_fields = ('user__username', 'ingredient__name',)
+    list_filter = ('user',)
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'name',
+        'refcount',
+        'updated',
+    )
+    search_fields = ('name',)
+    readonly_fields = ('name', 'refcount', 'updated')
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, Subscription)
+from recipes.ranking import get_score_updates
+from users.models import User
+
+# (модель со счетчиком, поле счетчика, считаемая модель, внешний ключ)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'carts_count', Cart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+    (User, 'following_count', Subscription, 'subscriber'),
+    (Ingredient, 'usage_count', RecipeIngredient, 'ingredient'),
+)
+
+
+def change_counter(model, field, pks, delta, **updates):
+    if pks:
+        model._default_manager.filter(pk__in=pks).update(
+            **{field: F(field) + delta}, **updates)
+
+
+def change_counter_by(model, field, deltas):
+    """deltas {pk: приращение}: один UPDATE на каждое приращение."""
+    pks_by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            pks_by_delta[delta].append(pk)
+    for delta, pks in pks_by_delta.items():
+        change_counter(model, field, pks, delta)
+
+
+def change_counters(instance, delta):
+    for model, field, counted_model, key in COUNTERS:
+        if isinstance(instance, counted_model):
+            change_counter(model, field,
+                           [getattr(instance, f'{key}_id')], delta,
+                           **get_score_updates(counted_model, delta))
+
+
+def change_counters_bulk(counted_model, pks_by_key, delta):
+    """Для записей, созданных или удаленных без сигналов."""
+    for model, field, counted, key in COUNTERS:
+        if counted is counted_model and key in pks_by_key:
+            change_counter(model, field, pks_by_key[key], delta,
+                           **get_score_updates(counted_model, delta))
+
+
+def get_actual_count(counted_model, key):
+    return Coalesce(
+        Subquery(
+            counted_model._default_manager.filter(**{key: OuterRef('pk')})
+            .order_by().values(key).annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def find_mismatches(model, field, counted_model, key):
+    return model._default_manager.annotate(
+        actual=get_actual_count(counted_model, key)
+    ).exclude(**{field: F('actual')})
+
+
+def rebuild_counter(model, field, counted_model, key):
+    return model._default_manager.update(
+        **{field: get_actual_count(counted_model, key)})
@@ -0,0 +1,49 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+VARIANT_FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+
+
+def build_variants(image_name):
+    with default_storage.open(image_name) as file:
+        source = ImageOps.exif_transpose(Image.open(file))
+        # Пересохранение без exif/icc/xmp удаляет метаданные.
+        source = source.convert('RGB')
+    variants = {}
+    for width in settings.RECIPE_IMAGE_WIDTHS:
+        image = source
+        if source.width > width:
+            image = source.resize(
+                (width, round(source.height * width / source.width)),
+                Image.LANCZOS)
+        variants[str(width)] = {}
+        for extension, options in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, **options)
+            variants[str(width)][extension] = default_storage.save(
+                f'{settings.RECIPE_VARIANTS_DIR}{width}.{extension}',
+                ContentFile(buffer.getvalue()))
+    return variants
+
+
+def process_recipe_image(recipe_id):
+    recipe = Recipe.custom_objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+    image_name = recipe.image.name
+    variants = build_variants(image_name)
+    recipe.refresh_from_db(fields=('image',))
+    if recipe.image.name != image_name:
+        return
+    recipe.image_variants = variants
+    recipe.save(update_fields=('image_variants',))
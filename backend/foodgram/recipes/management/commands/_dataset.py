@@ -0,0 +1,181 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from recipes.models import (Cart, Favorite, Recipe, RecipeIngredient,
+                            Subscription)
+from users.models import User
+
+USERS = 'users'
+RECIPES = 'recipes'
+RELATIONS = 'relations'
+# Параметры распределений: показатели Ципфа и Парето, пределы на
+# пользователя и рецепт.
+AUTHOR_EXPONENT = 1.1
+FOLLOW_EXPONENT = 1.2
+INGREDIENT_EXPONENT = 1.0
+RECIPE_EXPONENT = 1.0
+FOLLOWS_ALPHA = 1.3
+FAVORITES_ALPHA = 1.1
+CARTS_ALPHA = 2.0
+MAX_FOLLOWS = 200
+MAX_FAVORITES = 500
+MAX_CARTS = 30
+INGREDIENTS_PER_RECIPE = (3, 12)
+TAGS_PER_RECIPE = (1, 3)
+COOKING_TIME = (5, 180)
+PUB_DATE_SPAN = timedelta(days=3 * 365)
+TEXT_WORDS = ('Нарезать', 'смешать', 'обжарить', 'запечь', 'посолить',
+              'потушить', 'подавать', 'остудить', 'взбить', 'отварить')
+
+
+def zipf_index(rng, size, exponent):
+    """Номер от 0 до size - 1, малые номера встречаются чаще.
+
+    Обратная функция распределения непрерывного степенного закона:
+    не нужно хранить веса для миллионов элементов.
+    """
+    uniform = rng.random()
+    if exponent == 1:
+        rank = size ** uniform
+    else:
+        power = 1 - exponent
+        rank = ((size ** power - 1) * uniform + 1) ** (1 / power)
+    return min(int(rank), size) - 1
+
+
+def zipf_sample(rng, size, exponent, count, exclude=None):
+    """count разных номеров; при малом size может вернуть меньше."""
+    chosen = set()
+    for _ in range(count * 4):
+        if len(chosen) >= count:
+            break
+        index = zipf_index(rng, size, exponent)
+        if index != exclude:
+            chosen.add(index)
+    return sorted(chosen)
+
+
+def pareto_count(rng, alpha, limit):
+    return min(int(rng.paretovariate(alpha)) - 1, limit)
+
+
+def get_rng(params, kind, chunk):
+    # Строковое зерно: результат не зависит от числа процессов.
+    return random.Random(f'{params["seed"]}:{kind}:{chunk}')
+
+
+def get_chunk(params, total, chunk):
+    start = chunk * params['batch_size']
+    return range(start, min(start + params['batch_size'], total))
+
+
+def user_id(params, index):
+    return params['first_user'] + index
+
+
+def recipe_id(params, index):
+    return params['first_recipe'] + index
+
+
+def generate_users(params, chunk):
+    prefix = params['prefix']
+    User.objects.bulk_create([
+        User(id=user_id(params, index), username=f'{prefix}{index}',
+             email=f'{prefix}{index}@example.com', first_name='Пользователь',
+             last_name=str(index), password=UNUSABLE_PASSWORD_PREFIX)
+        for index in get_chunk(params, params['users'], chunk)])
+
+
+def generate_recipes(params, chunk):
+    rng = get_rng(params, RECIPES, chunk)
+    ingredients = params['ingredients']
+    tags = params['tags']
+    recipes = []
+    recipe_ingredients = []
+    recipe_tags = []
+    indexes = get_chunk(params, params['recipes'], chunk)
+    for index in indexes:
+        pk = recipe_id(params, index)
+        chosen = [ingredients[position] for position in zipf_sample(
+            rng, len(ingredients), INGREDIENT_EXPONENT,
+            rng.randint(*INGREDIENTS_PER_RECIPE))]
+        recipes.append(Recipe(
+            id=pk, name=f'{params["prefix"]} рецепт {index}',
+            text=' '.join(rng.choices(TEXT_WORDS, k=rng.randint(5, 30))),
+            cooking_time=rng.randint(*COOKING_TIME),
+            author_id=user_id(params, zipf_index(
+                rng, params['users'], AUTHOR_EXPONENT))))
+        recipe_ingredients.extend(
+            RecipeIngredient(recipe_id=pk, ingredient_id=ingredient,
+                             amount=rng.randint(1, 1000))
+            for ingredient in chosen)
+        recipe_tags.extend(
+            Recipe.tags.through(recipe_id=pk, tag_id=tag)
+            for tag in rng.sample(tags, min(
+                rng.randint(*TAGS_PER_RECIPE), len(tags))))
+    Recipe.custom_objects.bulk_create(recipes)
+    # auto_now_add перезаписывает дату при вставке: даты равномерно
+    # растягиваются по номеру рецепта одним UPDATE.
+    step = PUB_DATE_SPAN / params['recipes']
+    first_date = params['started'] - PUB_DATE_SPAN
+    Recipe.custom_objects.filter(pk__in=[
+        recipe.pk for recipe in recipes]).update(pub_date=Case(
+            *[When(pk=recipe_id(params, index),
+                   then=Value(first_date + step * index))
+              for index in indexes],
+            output_field=DateTimeField()))
+    RecipeIngredient.objects.bulk_create(recipe_ingredients)
+    Recipe.tags.through.objects.bulk_create(recipe_tags)
+
+
+def generate_relations(params, chunk):
+    """Подписки, избранное и корзины пользователей пачки."""
+    rng = get_rng(params, RELATIONS, chunk)
+    subscriptions = []
+    favorites = []
+    carts = []
+    for index in get_chunk(params, params['users'], chunk):
+        user = user_id(params, index)
+        subscriptions.extend(
+            Subscription(subscriber_id=user,
+                         author_id=user_id(params, author))
+            for author in zipf_sample(
+                rng, params['users'], FOLLOW_EXPONENT,
+                pareto_count(rng, FOLLOWS_ALPHA, MAX_FOLLOWS),
+                exclude=index))
+        favorites.extend(
+            Favorite(user_id=user, recipe_id=recipe_id(params, recipe))
+            for recipe in zipf_sample(
+                rng, params['recipes'], RECIPE_EXPONENT,
+                pareto_count(rng, FAVORITES_ALPHA, MAX_FAVORITES)))
+        carts.extend(
+            Cart(user_id=user, recipe_id=recipe_id(params, recipe))
+            for recipe in zipf_sample(
+                rng, params['recipes'], RECIPE_EXPONENT,
+                pareto_count(rng, CARTS_ALPHA, MAX_CARTS)))
+    Subscription.objects.bulk_create(subscriptions)
+    Favorite.objects.bulk_create(favorites)
+    Cart.objects.bulk_create(carts)
+
+
+GENERATORS = {
+    USERS: generate_users,
+    RECIPES: generate_recipes,
+    RELATIONS: generate_relations,
+}
+
+
+def run_chunk(params, kind, chunk):
+    """Пачка в отдельной транзакции; вызывается и в дочерних процессах."""
+    with transaction.atomic():
+        GENERATORS[kind](params, chunk)
+    return kind, chunk
+
+
+def get_started():
+    return timezone.now().replace(microsecond=0)
@@ -1,26 +1,165 @@
-from csv import reader
-
-from django.db import transaction
-
-
-@transaction.atomic
-def data_creator(filename, model):
-    print(f'Открываем {filename}')
-    with open(f'{filename}', encoding='utf-8') as file:
-        cf = reader(file)
-        print(f'Готовим данные для модели {model.__name__}')
-        if filename == 'ingredients.csv':
-            for name, measurement_unit in cf:
-                model.objects.get_or_create(
-                    name=name,
-                    measurement_unit=measurement_unit
-                )
-        if filename == 'tags.csv':
-            for name, color, slug in cf:
-                model.objects.get_or_create(
-                    name=name,
-                    color=color,
-                    slug=slug
-                )
-        print(f'Данные из файла {filename} успешно '
-              f'загружены в модель {model.__name__}')
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.management import CommandError
+from django.db import connection
+
+from recipes.models import Ingredient, Tag
+
+# Поля во входных файлах и поля, по которым строка считается уже
+# загруженной.
+FIELDS = {
+    Ingredient: ('name', 'measurement_unit'),
+    Tag: ('name', 'color', 'slug'),
+}
+KEY_FIELDS = {
+    Ingredient: ('name', 'measurement_unit'),
+    Tag: ('slug',),
+}
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file):
+    """Читает объекты JSON-массива по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise CommandError('Ожидался JSON-массив.')
+            started = True
+            position += 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON.')
+            chunk = file.read(JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+        position = end
+
+
+def read_rows(path, fields):
+    with open(path, encoding='utf-8') as file:
+        if path.suffix == '.json':
+            rows = iter_json_array(file)
+        elif path.suffix in ('.jsonl', '.ndjson'):
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = (dict(zip(fields, row))
+                    for row in csv.reader(file) if row)
+        for number, row in enumerate(rows, 1):
+            if not isinstance(row, dict) or any(
+                    not row.get(field) for field in fields):
+                raise CommandError(
+                    f'{path.name}, запись {number}: нужны поля '
+                    f'{", ".join(fields)}.')
+            yield {field: row[field] for field in fields}
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_key(model, row):
+    return tuple(row[field] for field in KEY_FIELDS[model])
+
+
+def get_existing(model, batch):
+    """Строки пачки, уже лежащие в базе, по ключу."""
+    keys = KEY_FIELDS[model]
+    existing = model.objects.filter(**{
+        f'{keys[0]}__in': {row[keys[0]] for row in batch}})
+    return {tuple(row[field] for field in keys): row
+            for row in existing.values(*FIELDS[model])}
+
+
+def get_diff(model, batch):
+    existing = get_existing(model, batch)
+    added, changed = [], []
+    for row in batch:
+        current = existing.get(get_key(model, row))
+        if current is None:
+            added.append(row)
+        elif current != row:
+            changed.append((current, row))
+    return added, changed
+
+
+def unique_rows(model, batch):
+    rows = {}
+    for row in batch:
+        rows.setdefault(get_key(model, row), row)
+    return list(rows.values())
+
+
+def insert_batch(model, batch):
+    added, _ = get_diff(model, unique_rows(model, batch))
+    model.objects.bulk_create(
+        [model(**row) for row in added], ignore_conflicts=True)
+    return len(added)
+
+
+def get_copy_columns(model):
+    return [field for field in model._meta.concrete_fields
+            if not field.primary_key]
+
+
+def create_copy_table(model):
+    columns = ', '.join(
+        connection.ops.quote_name(field.column)
+        for field in get_copy_columns(model))
+    table = connection.ops.quote_name(f'load_{model._meta.db_table}')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {table} ON COMMIT DROP AS '
+            f'SELECT {columns} FROM '
+            f'{connection.ops.quote_name(model._meta.db_table)} '
+            f'WITH NO DATA')
+    return table
+
+
+def copy_batch(model, batch, table):
+    """COPY пачки во временную таблицу и INSERT ... ON CONFLICT."""
+    fields = get_copy_columns(model)
+    columns = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        instance = model(**row)
+        writer.writerow(
+            field.get_db_prep_save(getattr(instance, field.attname),
+                                   connection)
+            for field in fields)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+            buffer)
+        cursor.execute(
+            f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} '
+            f'({columns}) SELECT {columns} FROM {table} '
+            f'ON CONFLICT DO NOTHING')
+        created = cursor.rowcount
+        cursor.execute(f'TRUNCATE {table}')
+    return created
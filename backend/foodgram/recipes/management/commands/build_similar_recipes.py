@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from recipes.similarity import build_similar_recipes
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты для всех рецептов. Рецепты, '
+            'созданные и измененные через API и админку, пересчитываются '
+            'сами, import_recipes и generate_dataset запускают команду '
+            'после загрузки. Команду стоит запускать периодически, чтобы '
+            'обновить веса ингредиентов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.SIMILAR_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = build_similar_recipes(
+            options['batch_size'],
+            lambda done, total: self.stderr.write(
+                f'Обработано рецептов: {done} из {total}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны для {total} рецептов.'))
@@ -0,0 +1,77 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from recipes.models import StoredFile
+from recipes.storage import walk_files
+
+SCAN_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки рецептов, на которые не осталось ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=settings.STORED_FILE_GRACE_PERIOD,
+            help='Не трогать файлы, измененные за последние N секунд.')
+        parser.add_argument(
+            '--scan', action='store_true',
+            help='Также удалить файлы, которых нет в таблице ссылок.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.')
+
+    def handle(self, *args, **options):
+        self.cutoff = timezone.now() - timedelta(seconds=options['grace'])
+        self.dry_run = options['dry_run']
+        removed = 0
+        orphans = StoredFile.objects.filter(
+            refcount__lte=0, updated__lt=self.cutoff)
+        for file_id, name in orphans.values_list('pk', 'name').iterator():
+            if self.dry_run:
+                self.stdout.write(name)
+                removed += 1
+                continue
+            # Повторная проверка: ссылка могла появиться после выборки.
+            deleted, _ = StoredFile.objects.filter(
+                pk=file_id, refcount__lte=0, updated__lt=self.cutoff
+            ).delete()
+            if deleted and self.delete_file(name):
+                removed += 1
+        if options['scan']:
+            removed += self.scan()
+        self.stdout.write(f'Удалено файлов: {removed}')
+
+    def delete_file(self, name):
+        if not default_storage.exists(name):
+            return False
+        if default_storage.get_modified_time(name) >= self.cutoff:
+            return False
+        if self.dry_run:
+            self.stdout.write(name)
+        else:
+            default_storage.delete(name)
+        return True
+
+    def scan(self):
+        removed = 0
+        for directory in (settings.RECIPE_IMAGES_DIR,
+                          settings.RECIPE_VARIANTS_DIR):
+            if not default_storage.exists(directory):
+                continue
+            files = walk_files(default_storage, directory.rstrip('/'))
+            while True:
+                batch = list(islice(files, SCAN_BATCH_SIZE))
+                if not batch:
+                    break
+                known = set(StoredFile.objects.filter(
+                    name__in=batch).values_list('name', flat=True))
+                for name in batch:
+                    if name not in known and self.delete_file(name):
+                        removed += 1
+        return removed
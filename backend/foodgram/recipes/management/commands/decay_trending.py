@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from api.cache import invalidate
+from recipes.ranking import decay_trending, get_decay_factor
+
+
+class Command(BaseCommand):
+    help = ('Применяет экспоненциальное затухание к трендовости рецептов. '
+            'Запускается периодически, например из cron раз в '
+            'TRENDING_DECAY_INTERVAL часов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=settings.TRENDING_DECAY_INTERVAL,
+            help='Сколько часов прошло с прошлого запуска.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.SCORE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        factor = get_decay_factor(options['hours'])
+        updated = decay_trending(factor, options['batch_size'])
+        invalidate('recipe_scores')
+        self.stdout.write(self.style.SUCCESS(
+            f'Трендовость умножена на {factor:.4f} у {updated} рецептов.'))
@@ -0,0 +1,65 @@
+import json
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from recipes.models import Recipe
+
+
+def serialize_recipe(recipe):
+    author = recipe.author
+    return {
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'pub_date': recipe.pub_date.isoformat(),
+        'image': recipe.image.name or None,
+        'author': {
+            'username': author.username,
+            'email': author.email,
+            'first_name': author.first_name,
+            'last_name': author.last_name,
+        },
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {'name': item.ingredient.name,
+             'measurement_unit': item.ingredient.measurement_unit,
+             'amount': item.amount}
+            for item in recipe.recipeingredients.all()],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в NDJSON: по одному рецепту на строку.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output', default='-',
+            help='Файл для выгрузки; по умолчанию stdout.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            self.export(self.stdout.write, options['batch_size'])
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            self.export(lambda line: output.write(f'{line}\n'),
+                        options['batch_size'])
+
+    def export(self, write, batch_size):
+        # Пачки по первичному ключу: в памяти не больше batch_size
+        # рецептов вместе с тегами и ингредиентами.
+        last_pk = 0
+        exported = 0
+        while True:
+            recipes = list(Recipe.custom_objects.add_related().filter(
+                pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not recipes:
+                break
+            for recipe in recipes:
+                write(json.dumps(serialize_recipe(recipe),
+                                 ensure_ascii=False))
+            exported += len(recipes)
+            last_pk = recipes[-1].pk
+            self.stderr.write(f'Выгружено рецептов: {exported}')
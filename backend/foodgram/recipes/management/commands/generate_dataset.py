@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import random
+import re
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+
+from api.autocomplete import reset_usage_journal
+from api.cache import invalidate
+from api.cookable import reset_journal
+from recipes.models import Ingredient, Recipe, Subscription, Tag
+from recipes.ranking import rebuild_trending
+from recipes.shopping_list import build_shopping_lists
+from recipes.timeline import build_timelines
+from users.models import User
+
+from ._dataset import RECIPES, RELATIONS, USERS, get_started, run_chunk
+
+
+class Command(BaseCommand):
+    help = ('Создает воспроизводимый синтетический набор данных для '
+            'нагрузочного тестирования: пользователей, рецепты, подписки, '
+            'избранное и корзины со степенными распределениями. При тех '
+            'же --seed и --batch-size данные одинаковы при любом числе '
+            'процессов. Затем пересчитываются счетчики и популярность, '
+            'строятся списки покупок, поисковые документы, похожие '
+            'рецепты, ленты подписок и трендовость новых пользователей '
+            'и рецептов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--users', type=int,
+            help='По умолчанию десятая часть числа рецептов.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Префикс имен пользователей и названий рецептов.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.DATASET_BATCH_SIZE)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; на SQLite всегда один.')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересчитывать счетчики, списки покупок, поиск, '
+                 'похожие рецепты, ленты и трендовость.')
+
+    def handle(self, *args, **options):
+        recipes = options['recipes']
+        users = options['users'] or max(recipes // 10, 2)
+        if recipes < 1 or users < 2 or options['batch_size'] < 1:
+            raise CommandError('Нужны хотя бы 1 рецепт и 2 пользователя.')
+        if User.objects.filter(username__regex=(
+                rf'^{re.escape(options["prefix"])}[0-9]+$')).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {options["prefix"]} уже есть, '
+                f'укажите другой --prefix.')
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            call_command('load_foodgram_data', stdout=self.stdout,
+                         stderr=self.stderr)
+        ingredients = list(Ingredient.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        # Порядок популярности ингредиентов зависит только от зерна.
+        random.Random(options['seed']).shuffle(ingredients)
+        params = {
+            'seed': options['seed'],
+            'prefix': options['prefix'],
+            'batch_size': options['batch_size'],
+            'users': users,
+            'recipes': recipes,
+            'first_user': (User.objects.aggregate(
+                pk=Max('pk'))['pk'] or 0) + 1,
+            'first_recipe': (Recipe.custom_objects.aggregate(
+                pk=Max('pk'))['pk'] or 0) + 1,
+            'ingredients': ingredients,
+            'tags': list(Tag.objects.order_by('pk').values_list(
+                'pk', flat=True)),
+            'started': get_started(),
+        }
+        workers = options['workers']
+        if connection.vendor == 'sqlite' or 'fork' not in (
+                multiprocessing.get_all_start_methods()):
+            workers = 1
+        started = time.monotonic()
+        for kind, total in ((USERS, users), (RECIPES, recipes),
+                            (RELATIONS, users)):
+            self.run(kind, params, -(-total // options['batch_size']),
+                     workers, started)
+        self.reset_sequences()
+        if not options['skip_derived']:
+            self.build_derived(params, options['batch_size'], started)
+        reset_journal()
+        reset_usage_journal()
+        invalidate('recipes', 'users', 'ingredient_usage', 'recipe_scores')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {users}, рецептов: {recipes} за '
+            f'{time.monotonic() - started:.1f} с'))
+
+    def build_derived(self, params, batch_size, started):
+        # Счетчики подписчиков и популярность нужны лентам и трендовости.
+        call_command('rebuild_counters', stdout=self.stdout,
+                     stderr=self.stderr)
+        users = User.objects.filter(pk__range=(
+            params['first_user'],
+            params['first_user'] + params['users'] - 1))
+        build_shopping_lists(users, batch_size)
+        self.stderr.write(
+            f'Списки покупок: {time.monotonic() - started:.1f} с')
+        for command in ('rebuild_search_index', 'build_similar_recipes'):
+            call_command(command, stdout=self.stdout, stderr=self.stderr)
+        build_timelines(Subscription.objects.filter(subscriber__in=users))
+        self.stderr.write(
+            f'Ленты подписок: {time.monotonic() - started:.1f} с')
+        rebuild_trending(
+            Recipe.custom_objects.filter(pk__range=(
+                params['first_recipe'],
+                params['first_recipe'] + params['recipes'] - 1)),
+            params['started'], batch_size)
+        self.stderr.write(
+            f'Трендовость: {time.monotonic() - started:.1f} с')
+
+    def run(self, kind, params, chunks, workers, started):
+        job = partial(run_chunk, params, kind)
+        if workers == 1:
+            results = map(job, range(chunks))
+            self.report(kind, results, chunks, started)
+            return
+        # Дочерние процессы открывают свои соединения с базой.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            self.report(kind, pool.imap_unordered(job, range(chunks)),
+                        chunks, started)
+
+    def report(self, kind, results, chunks, started):
+        for done, _ in enumerate(results, 1):
+            self.stderr.write(
+                f'{kind}: {done}/{chunks} пачек, '
+                f'{time.monotonic() - started:.1f} с')
+
+    def reset_sequences(self):
+        # Первичные ключи заданы явно, последовательности PostgreSQL
+        # нужно сдвинуть за них.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
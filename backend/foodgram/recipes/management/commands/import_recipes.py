@@ -0,0 +1,179 @@
+import json
+import sys
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils.dateparse import parse_datetime
+
+from api.autocomplete import record_usage
+from api.cache import invalidate
+from api.cookable import record_changes
+from recipes.counters import change_counter_by
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.search import update_search_documents
+from recipes.storage import change_refcounts
+from recipes.timeline import fan_out_recipes
+from users.models import User
+
+AUTHOR_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из NDJSON, выгруженного export_recipes. '
+            'Уже существующие рецепты пропускаются, поэтому прерванный '
+            'импорт можно просто запустить заново.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл NDJSON; по умолчанию stdin.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TRANSFER_BATCH_SIZE)
+        parser.add_argument(
+            '--skip-similar', action='store_true',
+            help='Не пересчитывать похожие рецепты после загрузки.')
+
+    def handle(self, *args, **options):
+        # Справочники небольшие и целиком держатся в памяти.
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.values_list('pk', 'name', 'measurement_unit')}
+        if options['path'] == '-':
+            imported = self.import_file(sys.stdin, options['batch_size'])
+        else:
+            try:
+                with open(options['path'], encoding='utf-8') as file:
+                    imported = self.import_file(file, options['batch_size'])
+            except FileNotFoundError:
+                raise CommandError(f'Файл {options["path"]} не найден.')
+        # Один полный пересчет вместо попарного сравнения каждой пачки
+        # со всей таблицей.
+        if imported and not options['skip_similar']:
+            call_command('build_similar_recipes', stdout=self.stdout,
+                         stderr=self.stderr)
+
+    def import_file(self, file, batch_size):
+        records = (
+            (number, line) for number, line in enumerate(file, 1)
+            if line.strip())
+        read = imported = 0
+        while True:
+            batch = [self.parse(number, line)
+                     for number, line in islice(records, batch_size)]
+            if not batch:
+                break
+            read += len(batch)
+            with transaction.atomic():
+                imported += self.import_batch(batch)
+            self.stderr.write(f'Прочитано {read}, загружено {imported}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {imported}, пропущено: '
+            f'{read - imported}'))
+        return imported
+
+    def parse(self, number, line):
+        try:
+            record = json.loads(line)
+            recipe = {
+                'name': record['name'],
+                'text': record['text'],
+                'cooking_time': int(record['cooking_time']),
+                'pub_date': parse_datetime(record['pub_date']),
+                'image': record.get('image') or None,
+                'author': {field: record['author'][field]
+                           for field in AUTHOR_FIELDS},
+                'tags': [self.tags[slug] for slug in record['tags']],
+                'ingredients': {
+                    self.ingredients[(item['name'],
+                                      item['measurement_unit'])]:
+                    int(item['amount'])
+                    for item in record['ingredients']},
+            }
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Строка {number}: {error!r}')
+        if recipe['pub_date'] is None or recipe['cooking_time'] < 1:
+            raise CommandError(f'Строка {number}: неверные данные рецепта.')
+        return recipe
+
+    def get_authors(self, authors):
+        existing = dict(User.objects.filter(
+            username__in=authors).values_list('username', 'pk'))
+        missing = [
+            User(**author, password=make_password(None))
+            for username, author in authors.items()
+            if username not in existing]
+        if missing:
+            User.objects.bulk_create(missing, ignore_conflicts=True)
+            existing.update(User.objects.filter(
+                username__in=[user.username for user in missing]
+            ).values_list('username', 'pk'))
+        for username in authors:
+            if username not in existing:
+                raise CommandError(
+                    f'Не удалось создать автора {username}.')
+        return existing
+
+    def import_batch(self, batch):
+        existing = set(Recipe.custom_objects.filter(
+            name__in=[recipe['name'] for recipe in batch]
+        ).values_list('name', flat=True))
+        recipes = {}
+        for recipe in batch:
+            if recipe['name'] not in existing:
+                recipes.setdefault(recipe['name'], recipe)
+        if not recipes:
+            return 0
+        authors = self.get_authors({
+            recipe['author']['username']: recipe['author']
+            for recipe in recipes.values()})
+        Recipe.custom_objects.bulk_create([
+            Recipe(name=recipe['name'], text=recipe['text'],
+                   cooking_time=recipe['cooking_time'],
+                   image=recipe['image'],
+                   author_id=authors[recipe['author']['username']])
+            for recipe in recipes.values()])
+        ids = dict(Recipe.custom_objects.filter(
+            name__in=recipes).values_list('name', 'pk'))
+        # auto_now_add перезаписывает дату при вставке, возвращаем
+        # исходную одним UPDATE.
+        Recipe.custom_objects.filter(pk__in=ids.values()).update(
+            pub_date=Case(
+                *[When(pk=ids[name], then=Value(recipe['pub_date']))
+                  for name, recipe in recipes.items()],
+                output_field=DateTimeField()))
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=ids[name], tag_id=tag)
+            for name, recipe in recipes.items()
+            for tag in set(recipe['tags'])])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe_id=ids[name], ingredient_id=ingredient,
+                             amount=amount)
+            for name, recipe in recipes.items()
+            for ingredient, amount in recipe['ingredients'].items()])
+
+        # Вставка без сигналов: счетчики и ссылки на файлы пачкой.
+        change_counter_by(User, 'recipes_count', Counter(
+            authors[recipe['author']['username']]
+            for recipe in recipes.values()))
+        usage = Counter(ingredient for recipe in recipes.values()
+                        for ingredient in recipe['ingredients'])
+        change_counter_by(Ingredient, 'usage_count', usage)
+        record_usage(usage)
+        images_by_count = defaultdict(list)
+        for image, count in Counter(
+                recipe['image'] for recipe in recipes.values()
+                if recipe['image']).items():
+            images_by_count[count].append(image)
+        for count, images in images_by_count.items():
+            change_refcounts(images, count)
+        update_search_documents(ids.values())
+        record_changes(ids.values())
+        fan_out_recipes(ids.values())
+        invalidate('recipes', 'users', 'ingredient_usage')
+        return len(recipes)
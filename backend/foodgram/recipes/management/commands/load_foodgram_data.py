@@ -1,23 +1,100 @@
-import os
+import time
+from pathlib import Path
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.cache import invalidate
+from api.signals import CACHE_SCOPES
 from recipes.models import Ingredient, Tag
 
-from ._db_load import data_creator
+from ._db_load import (FIELDS, batches, copy_batch, create_copy_table,
+                       get_diff, insert_batch, read_rows)
 
-DATA_TO_MODEL_MAPPING = (
-    ('ingredients.csv', Ingredient,),
-    ('tags.csv', Tag,),
-)
+MODELS = {
+    'ingredients': Ingredient,
+    'tags': Tag,
+}
+DEFAULT_FILES = ('ingredients.json', 'tags.csv')
 
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты и теги из CSV или JSON. '
+            'Повторная загрузка не создает дублей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Файлы для загрузки; по умолчанию '
+                 f'{", ".join(DEFAULT_FILES)} из DATA_DIR.')
+        parser.add_argument(
+            '--model', choices=MODELS,
+            help='Модель для всех файлов; по умолчанию по имени файла.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.LOAD_BATCH_SIZE)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только прочитать и проверить файлы.')
+        parser.add_argument(
+            '--diff', action='store_true',
+            help='Показать новые и отличающиеся строки, ничего не меняя.')
+
+    def get_model(self, path, name):
+        if name is None:
+            name = next((prefix for prefix in MODELS
+                         if path.stem.startswith(prefix)), None)
+        if name is None:
+            raise CommandError(
+                f'Не удалось определить модель для {path.name}, '
+                f'укажите --model.')
+        return MODELS[name]
+
     def handle(self, *args, **options):
-        try:
-            os.chdir(settings.DATA_DIR)
-            for filename, model in DATA_TO_MODEL_MAPPING:
-                data_creator(filename, model)
-        except Exception as error:
-            print(error)
+        paths = [Path(path) for path in options['paths']] or [
+            Path(settings.DATA_DIR) / name for name in DEFAULT_FILES]
+        for path in paths:
+            if not path.is_file():
+                raise CommandError(f'Файл {path} не найден.')
+            self.load(path, self.get_model(path, options['model']),
+                      options)
+
+    def load(self, path, model, options):
+        started = time.monotonic()
+        processed = created = changed = 0
+        rows = read_rows(path, FIELDS[model])
+        with transaction.atomic():
+            copy_table = None
+            if (connection.vendor == 'postgresql'
+                    and not options['dry_run'] and not options['diff']):
+                copy_table = create_copy_table(model)
+            for batch in batches(rows, options['batch_size']):
+                processed += len(batch)
+                if options['diff']:
+                    added, updated = get_diff(model, batch)
+                    created += len(added)
+                    changed += len(updated)
+                    for row in added:
+                        self.stdout.write(f'+ {row}')
+                    for old, new in updated:
+                        self.stdout.write(f'~ {old} -> {new}')
+                elif copy_table is not None:
+                    created += copy_batch(model, batch, copy_table)
+                elif not options['dry_run']:
+                    created += insert_batch(model, batch)
+                self.report(model, processed, started)
+            if created:
+                invalidate(*CACHE_SCOPES[model])
+        elapsed = time.monotonic() - started
+        summary = (f'{path.name} -> {model.__name__}: прочитано {processed}, '
+                   f'новых {created}')
+        if options['diff']:
+            summary += f', отличается {changed}'
+        self.stdout.write(self.style.SUCCESS(
+            f'{summary} за {elapsed:.2f} с'))
+
+    def report(self, model, processed, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stderr.write(
+            f'{model.__name__}: {processed} строк, '
+            f'{processed / elapsed:.0f} строк/с')
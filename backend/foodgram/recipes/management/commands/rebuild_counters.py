@@ -0,0 +1,40 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from api.autocomplete import reset_usage_journal
+from api.cache import invalidate
+from recipes.counters import COUNTERS, find_mismatches, rebuild_counter
+from recipes.models import Ingredient
+from recipes.ranking import find_popularity_mismatches, rebuild_popularity
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики рецептов и авторов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счетчики, ничего не изменяя.')
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for counter in COUNTERS:
+            model, field = counter[:2]
+            broken = find_mismatches(*counter).count()
+            mismatches += broken
+            self.stdout.write(
+                f'{model.__name__}.{field}: расхождений {broken}')
+            if broken and not options['check']:
+                with transaction.atomic():
+                    rebuild_counter(*counter)
+                if model is Ingredient:
+                    reset_usage_journal()
+                    invalidate('ingredient_usage')
+        # Популярность считается из счетчиков, поэтому проверяется после них.
+        broken = find_popularity_mismatches().count()
+        mismatches += broken
+        self.stdout.write(f'Recipe.popularity: расхождений {broken}')
+        if broken and not options['check']:
+            rebuild_popularity()
+        if options['check'] and mismatches:
+            raise SystemExit(1)
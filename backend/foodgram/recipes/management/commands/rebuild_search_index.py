@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from recipes.models import Recipe
+from recipes.search import FTS_TABLE, update_all_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковые документы рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            updated = update_all_search_documents(
+                Recipe.custom_objects.all(), options['batch_size'])
+        self.stdout.write(f'Обновлено рецептов: {updated}')
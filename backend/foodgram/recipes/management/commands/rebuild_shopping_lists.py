@@ -0,0 +1,40 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import get_actual_totals
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Проверяет и пересобирает материализованные списки покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить списки покупок, ничего не изменяя.')
+
+    def handle(self, *args, **options):
+        actual = {
+            (row['recipe__carts__user'], row['ingredient']): row['actual']
+            for row in get_actual_totals().iterator()}
+        stored = {
+            (user, ingredient): total
+            for user, ingredient, total in ShoppingListItem.objects
+            .values_list('user_id', 'ingredient_id', 'total').iterator()}
+        mismatches = len(actual.keys() ^ stored.keys()) + sum(
+            actual[key] != stored[key]
+            for key in actual.keys() & stored.keys())
+        self.stdout.write(f'Расхождений в списках покупок: {mismatches}')
+        if options['check']:
+            if mismatches:
+                raise SystemExit(1)
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                                  total=total)
+                 for (user, ingredient), total in actual.items()),
+                batch_size=BATCH_SIZE)
@@ -1,6 +1,6 @@
 # Generated by Django 3.2 on 2023-04-22 08:28
 
-from django.db import migrations, models
+from django.db import migrations
 
 
 class Migration(migrations.Migration):
@@ -9,10 +9,7 @@ class Migration(migrations.Migration):
         ('recipes', '0001_initial'),
     ]
 
+    # Схема из этой миграции вошла в 0001_initial и 0002_initial. Файл
+    # оставлен, чтобы не расходиться с django_migrations развернутых баз.
     operations = [
-        migrations.AlterField(
-            model_name='recipe',
-            name='tags',
-            field=models.ManyToManyField(to='recipes.Tag', verbose_name='Теги'),
-        ),
     ]
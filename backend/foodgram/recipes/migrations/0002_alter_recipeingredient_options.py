@@ -9,9 +9,7 @@ class Migration(migrations.Migration):
         ('recipes', '0001_initial'),
     ]
 
+    # Схема из этой миграции вошла в 0001_initial и 0002_initial. Файл
+    # оставлен, чтобы не расходиться с django_migrations развернутых баз.
     operations = [
-        migrations.AlterModelOptions(
-            name='recipeingredient',
-            options={'verbose_name': 'Ингредиент рецепта', 'verbose_name_plural': 'Ингредиенты рецептов'},
-        ),
     ]
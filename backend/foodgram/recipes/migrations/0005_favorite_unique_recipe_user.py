@@ -1,6 +1,6 @@
 # Generated by Django 3.2 on 2023-04-26 20:10
 
-from django.db import migrations, models
+from django.db import migrations
 
 
 class Migration(migrations.Migration):
@@ -9,9 +9,7 @@ class Migration(migrations.Migration):
         ('recipes', '0004_merge_20230426_2306'),
     ]
 
+    # Схема из этой миграции вошла в 0001_initial и 0002_initial. Файл
+    # оставлен, чтобы не расходиться с django_migrations развернутых баз.
     operations = [
-        migrations.AddConstraint(
-            model_name='favorite',
-            constraint=models.UniqueConstraint(fields=('recipe', 'user'), name='unique_recipe_user'),
-        ),
     ]
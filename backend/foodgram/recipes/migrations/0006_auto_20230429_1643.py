@@ -1,7 +1,6 @@
 # Generated by Django 3.2 on 2023-04-29 13:43
 
-from django.db import migrations, models
-import django.utils.timezone
+from django.db import migrations
 
 
 class Migration(migrations.Migration):
@@ -10,19 +9,7 @@ class Migration(migrations.Migration):
         ('recipes', '0005_favorite_unique_recipe_user'),
     ]
 
+    # Схема из этой миграции вошла в 0001_initial и 0002_initial. Файл
+    # оставлен, чтобы не расходиться с django_migrations развернутых баз.
     operations = [
-        migrations.AlterModelOptions(
-            name='recipe',
-            options={'ordering': ('pub_date', 'name', 'author', 'cooking_time'), 'verbose_name': 'Рецепт', 'verbose_name_plural': 'Рецепты'},
-        ),
-        migrations.AddField(
-            model_name='recipe',
-            name='pub_date',
-            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата публикации'),
-            preserve_default=False,
-        ),
-        migrations.AddConstraint(
-            model_name='cart',
-            constraint=models.UniqueConstraint(fields=('recipe', 'user'), name='unique_recipe_user_in_cart'),
-        ),
     ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 02:05
+
+from django.db import migrations
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+        ('recipes', '0006_auto_20230429_1643'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='recipe',
+            managers=[
+                ('custom_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
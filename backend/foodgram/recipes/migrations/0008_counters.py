@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-18 02:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'favorites_count', 'Favorite', 'recipe'),
+    ('recipes', 'Recipe', 'carts_count', 'Cart', 'recipe'),
+    ('users', 'User', 'recipes_count', 'Recipe', 'author'),
+    ('users', 'User', 'followers_count', 'Subscription', 'author'),
+    ('users', 'User', 'following_count', 'Subscription', 'subscriber'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app_label, model_name, field, counted_name, key in COUNTERS:
+        counted_model = apps.get_model('recipes', counted_name)
+        apps.get_model(app_label, model_name)._default_manager.update(**{
+            field: Coalesce(
+                Subquery(
+                    counted_model._default_manager.filter(**{key: OuterRef('pk')})
+                    .order_by().values(key).annotate(total=Count('pk'))
+                    .values('total')
+                ),
+                Value(0),
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_alter_recipe_managers'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Счетчик корзин'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Счетчик избранных'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2 on 2026-10-18 02:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_usage_count(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    apps.get_model('recipes', 'Ingredient').objects.update(
+        usage_count=Coalesce(
+            Subquery(
+                RecipeIngredient.objects.filter(ingredient=OuterRef('pk'))
+                .order_by().values('ingredient')
+                .annotate(total=Count('pk')).values('total')
+            ),
+            Value(0),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число рецептов с продуктом'),
+        ),
+        migrations.RunPython(fill_usage_count, migrations.RunPython.noop),
+    ]
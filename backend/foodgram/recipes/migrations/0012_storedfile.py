@@ -0,0 +1,47 @@
+# Generated by Django 3.2 on 2026-10-18 02:18
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_stored_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    refcounts = Counter()
+    for image, variants in Recipe._default_manager.values_list(
+            'image', 'image_variants').iterator():
+        names = {name for formats in variants.values()
+                 for name in formats.values()}
+        if image:
+            names.add(image)
+        refcounts.update(names)
+    StoredFile.objects.bulk_create(
+        (StoredFile(name=name, refcount=refcount)
+         for name, refcount in refcounts.items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('refcount', models.IntegerField(default=0, verbose_name='Число ссылок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.RunPython(fill_stored_files, migrations.RunPython.noop),
+    ]
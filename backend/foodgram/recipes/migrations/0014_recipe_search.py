@@ -0,0 +1,69 @@
+# Generated by Django 3.2 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+POSTGRESQL_CREATE = (
+    "ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('russian', search_document)) STORED",
+    'CREATE INDEX recipes_recipe_search_vector ON recipes_recipe '
+    'USING GIN (search_vector)',
+)
+POSTGRESQL_DROP = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5("
+    "search_document, tokenize='unicode61 remove_diacritics 2')",
+    'INSERT INTO recipes_recipe_fts (rowid, search_document) '
+    'SELECT id, search_document FROM recipes_recipe',
+)
+SQLITE_DROP = ('DROP TABLE IF EXISTS recipes_recipe_fts',)
+
+
+def fill_search_documents(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    names = {}
+    for recipe_id, name in RecipeIngredient.objects.order_by(
+            'id').values_list('recipe_id', 'ingredient__name').iterator():
+        names.setdefault(recipe_id, []).append(name)
+    Recipe._default_manager.bulk_update(
+        [Recipe(id=recipe_id,
+                search_document='\n'.join(
+                    (name, text, *names.get(recipe_id, ()))))
+         for recipe_id, name, text in Recipe._default_manager.values_list(
+             'id', 'name', 'text').iterator()],
+        ('search_document',),
+        batch_size=1000,
+    )
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(default='', editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_documents,
+                             migrations.RunPython.noop),
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_CREATE,
+                            'sqlite': SQLITE_CREATE}),
+            run_statements({'postgresql': POSTGRESQL_DROP,
+                            'sqlite': SQLITE_DROP}),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2 on 2026-10-18 02:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_popularity(apps, schema_editor):
+    apps.get_model('recipes', 'Recipe')._default_manager.update(
+        popularity=(F('favorites_count') * settings.FAVORITE_SCORE
+                    + F('carts_count') * settings.CART_SCORE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность с затуханием'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['popularity', 'id'], name='recipe_popularity'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['trending', 'id'], name='recipe_trending'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,16 @@
 from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Exists, OuterRef, UniqueConstraint
+from django.db import connection, models
+from django.db.models import (Exists, F, OuterRef, Prefetch, UniqueConstraint,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
+from api.mixins import CounterFieldsMixin
 from users.models import User
 
 
-class Ingredient(models.Model):
+class Ingredient(CounterFieldsMixin, models.Model):
     name = models.CharField(
         max_length=settings.LENGTH200,
         verbose_name='Название продукта',
@@ -16,6 +20,13 @@ class Ingredient(models.Model):
         max_length=settings.LENGTH200,
         verbose_name='Еденица измерения',
     )
+    usage_count = models.PositiveIntegerField(
+        verbose_name='Число рецептов с продуктом',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('usage_count',)
 
     class Meta:
         constraints = [
@@ -59,6 +70,24 @@ class Tag(models.Model):
         return self.name[:settings.MODEL_STR_LIMIT]
 
 
+def filter_by_row_number(queryset, partition_by, order_by, operator,
+                         value):
+    """Отбор по ROW_NUMBER() в окне partition_by.
+
+    В Django 3.2 нельзя фильтровать по оконной функции, поэтому номер
+    строки проверяется во внешнем подзапросе.
+    """
+    ranked = queryset.order_by().annotate(row_number=Window(
+        RowNumber(), partition_by=F(partition_by), order_by=order_by,
+    )).values('pk', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    quote = connection.ops.quote_name
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT {quote("id")} FROM ({sql}) ranked '
+        f'WHERE {quote("row_number")} {operator} %s',
+        (*params, value)))
+
+
 class RecipeQuerySet(models.QuerySet):
 
     def add_user_annotations(self, user_id):
@@ -73,10 +102,32 @@ class RecipeQuerySet(models.QuerySet):
                     user_id=user_id, recipe__pk=OuterRef('pk')
                 )
             ),
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    subscriber_id=user_id, author_id=OuterRef('author_id')
+                )
+            ),
+        )
+
+    def limit_per_author(self, limit):
+        """Первые limit рецептов каждого автора одним запросом."""
+        return filter_by_row_number(
+            self, 'author_id',
+            [F(field).asc() for field in self.model._meta.ordering],
+            '<=', limit)
+
+    def add_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')
+            ),
         )
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Теги',
@@ -95,10 +146,16 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         verbose_name='Картинка рецепта',
-        upload_to='recipes/images/',
+        upload_to=settings.RECIPE_IMAGES_DIR,
         null=True,
         default=None
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
     )
@@ -114,17 +171,62 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации', auto_now_add=True, db_index=True)
+    search_document = models.TextField(
+        verbose_name='Текст для поиска',
+        default='',
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Счетчик избранных',
+        default=0,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='Счетчик корзин',
+        default=0,
+        editable=False,
+    )
+    popularity = models.PositiveIntegerField(
+        verbose_name='Популярность',
+        default=0,
+        editable=False,
+    )
+    trending = models.FloatField(
+        verbose_name='Популярность с затуханием',
+        default=0,
+        editable=False,
+    )
 
     custom_objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'carts_count', 'popularity',
+                      'trending')
 
     class Meta:
         ordering = ('pub_date', 'name', 'author', 'cooking_time')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['popularity', 'id'],
+                         name='recipe_popularity'),
+            models.Index(fields=['trending', 'id'],
+                         name='recipe_trending'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date'),
+        ]
 
     def __str__(self):
         return f'{self.name}'
 
+    def get_image_variant(self, width, extension='jpeg'):
+        """Имя файла наименьшей копии не уже width или оригинала."""
+        widths = sorted(int(key) for key in self.image_variants)
+        for variant_width in widths:
+            if variant_width >= width:
+                return self.image_variants[str(variant_width)][extension]
+        if self.image:
+            return self.image.name
+        return None
+
 
 class Subscription(models.Model):
     subscriber = models.ForeignKey(
@@ -231,3 +333,128 @@ class Favorite(BaseUserRecipe):
 
     def __str__(self):
         return f'Любимый рецепт {self.recipe} пользователя {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Продукт',
+    )
+    total = models.IntegerField(
+        verbose_name='Общее количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Продукт списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='shopping_list_unique_user_ingredient',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} ({self.total}) у {self.user}'
+
+
+class StoredFile(models.Model):
+    name = models.CharField(
+        max_length=settings.LENGTH255,
+        verbose_name='Имя файла',
+        unique=True,
+    )
+    refcount = models.IntegerField(
+        verbose_name='Число ссылок',
+        default=0,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Изменен',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='timeline_unique_user_recipe',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_pub_date'),
+        ]
+
+    def __str__(self):
+        return f'Рецепт {self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='similar_unique_recipe_similar',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='similar_recipe_score'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}'
@@ -0,0 +1,98 @@
+import math
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from recipes.models import Cart, Favorite, Recipe
+
+
+def get_score_weights():
+    return {Favorite: settings.FAVORITE_SCORE, Cart: settings.CART_SCORE}
+
+
+def get_score_updates(counted_model, delta):
+    """Изменение оценок рецепта вместе со счетчиком избранного или корзин."""
+    weight = get_score_weights().get(counted_model)
+    if not weight:
+        return {}
+    return {
+        'popularity': F('popularity') + weight * delta,
+        'trending': Greatest(F('trending') + weight * delta, Value(0.0)),
+    }
+
+
+def get_popularity():
+    weights = get_score_weights()
+    return (F('favorites_count') * weights[Favorite]
+            + F('carts_count') * weights[Cart])
+
+
+def find_popularity_mismatches():
+    return Recipe.custom_objects.exclude(popularity=get_popularity())
+
+
+def rebuild_popularity():
+    return Recipe.custom_objects.update(popularity=get_popularity())
+
+
+def get_decay_factor(hours):
+    return 0.5 ** (hours / settings.TRENDING_HALF_LIFE)
+
+
+def decay_trending(factor, batch_size):
+    """Умножает трендовость на factor пачками по первичному ключу.
+
+    Совсем малые значения обнуляются, чтобы старые рецепты не
+    попадали в пачки при каждом запуске.
+    """
+    recipes = Recipe.custom_objects.filter(trending__gt=0).order_by('pk')
+    last_pk = 0
+    updated = 0
+    while True:
+        pks = list(recipes.filter(pk__gt=last_pk).values_list(
+            'pk', flat=True)[:batch_size])
+        if not pks:
+            return updated
+        batch = Recipe.custom_objects.filter(pk__in=pks)
+        batch.filter(trending__lt=settings.TRENDING_MIN_SCORE / factor).update(
+            trending=0)
+        updated += batch.filter(trending__gt=0).update(
+            trending=F('trending') * factor)
+        last_pk = pks[-1]
+
+
+def get_accrued_trending(popularity, hours):
+    """Трендовость, набранная за hours часов при равномерном наборе
+    популярности: интеграл затухания, деленный на возраст."""
+    half_life = settings.TRENDING_HALF_LIFE
+    if hours <= 0:
+        return float(popularity)
+    return (popularity * half_life / (hours * math.log(2))
+            * (1 - get_decay_factor(hours)))
+
+
+def rebuild_trending(recipes, now, batch_size):
+    """Пересчитывает трендовость recipes из популярности.
+
+    Время добавления в избранное и корзины не хранится, поэтому
+    считается, что популярность набиралась равномерно от pub_date до
+    now. Рецепты читаются iterator() и сохраняются bulk_update пачками.
+    """
+    recipes.filter(popularity=0).exclude(trending=0).update(trending=0)
+    rows = recipes.filter(popularity__gt=0).order_by('pk').values_list(
+        'pk', 'popularity', 'pub_date').iterator(chunk_size=batch_size)
+    updated = 0
+    while True:
+        batch = []
+        for pk, popularity, pub_date in islice(rows, batch_size):
+            trending = get_accrued_trending(
+                popularity, (now - pub_date).total_seconds() / 3600)
+            if trending < settings.TRENDING_MIN_SCORE:
+                trending = 0
+            batch.append(Recipe(pk=pk, trending=trending))
+        if not batch:
+            return updated
+        Recipe.custom_objects.bulk_update(batch, ['trending'])
+        updated += len(batch)
@@ -0,0 +1,119 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeIngredient
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def build_document(name, text, ingredient_names):
+    return '\n'.join((name, text, *sorted(ingredient_names)))
+
+
+def build_documents(recipes, ingredients):
+    """recipes [(id, name, text)], ingredients [(recipe_id, name)]."""
+    names = {}
+    for recipe_id, name in ingredients:
+        names.setdefault(recipe_id, []).append(name)
+    return {recipe_id: build_document(name, text, names.get(recipe_id, ()))
+            for recipe_id, name, text in recipes}
+
+
+def delete_fts_rows(cursor, recipe_ids):
+    cursor.execute(
+        f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+        f'({", ".join(["%s"] * len(recipe_ids))})', list(recipe_ids))
+
+
+def sync_fts(documents):
+    """На SQLite переносит документы в таблицу FTS5."""
+    if connection.vendor != 'sqlite' or not documents:
+        return
+    with connection.cursor() as cursor:
+        delete_fts_rows(cursor, documents)
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, search_document) '
+            f'VALUES (%s, %s)', list(documents.items()))
+
+
+def delete_fts(recipe_ids):
+    if connection.vendor != 'sqlite' or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        delete_fts_rows(cursor, recipe_ids)
+
+
+def update_search_documents(recipe_ids):
+    """Пересобирает поисковый текст рецептов после записи."""
+    recipe_ids = list(recipe_ids)
+    documents = build_documents(
+        Recipe.custom_objects.filter(pk__in=recipe_ids).values_list(
+            'id', 'name', 'text'),
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).values_list(
+            'recipe_id', 'ingredient__name'))
+    Recipe.custom_objects.bulk_update(
+        [Recipe(id=recipe_id, search_document=document)
+         for recipe_id, document in documents.items()],
+        ('search_document',))
+    sync_fts(documents)
+
+
+def update_all_search_documents(recipes, batch_size):
+    """Пересобирает документы пачками по первичному ключу."""
+    last_pk = 0
+    updated = 0
+    while True:
+        recipe_ids = list(recipes.filter(pk__gt=last_pk).order_by(
+            'pk').values_list('pk', flat=True)[:batch_size])
+        if not recipe_ids:
+            return updated
+        update_search_documents(recipe_ids)
+        updated += len(recipe_ids)
+        last_pk = recipe_ids[-1]
+
+
+def reindex_ingredient(ingredient_id):
+    update_all_search_documents(
+        Recipe.custom_objects.filter(ingredients__id=ingredient_id),
+        settings.TRANSFER_BATCH_SIZE)
+
+
+def get_fts_query(query):
+    """Каждое слово запроса как префикс: 'борщ' найдет и 'борща'."""
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def search_recipes(queryset, query):
+    """Фильтрует рецепты по запросу и сортирует по релевантности."""
+    if not TOKEN_RE.search(query):
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT id FROM recipes_recipe '
+            f'WHERE search_vector @@ {tsquery}', (query,),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank(recipes_recipe.search_vector, {tsquery})', (query,),
+            output_field=FloatField(),
+        )).order_by('-search_rank', 'pk')
+    if connection.vendor == 'sqlite':
+        match = get_fts_query(query)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = recipes_recipe.id', (match,),
+            output_field=FloatField(),
+        )).order_by('-search_rank', 'pk')
+    for token in TOKEN_RE.findall(query):
+        queryset = queryset.filter(search_document__icontains=token)
+    return queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,83 @@
+from collections import Counter
+from itertools import islice
+
+from django.db.models import Case, F, Sum, Value, When
+
+from recipes.models import Cart, RecipeIngredient, ShoppingListItem
+
+
+def change_totals(user_ids, amounts):
+    """Прибавляет amounts {ingredient_id: delta} к спискам покупок."""
+    amounts = {ingredient: delta
+               for ingredient, delta in amounts.items() if delta}
+    if not user_ids or not amounts:
+        return
+    ShoppingListItem.objects.bulk_create(
+        [ShoppingListItem(user_id=user_id, ingredient_id=ingredient)
+         for user_id in user_ids
+         for ingredient, delta in amounts.items() if delta > 0],
+        ignore_conflicts=True,
+    )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=amounts)
+    items.update(total=F('total') + Case(
+        *[When(ingredient_id=ingredient, then=Value(delta))
+          for ingredient, delta in amounts.items()],
+        default=Value(0),
+    ))
+    items.filter(total__lte=0).delete()
+
+
+def get_recipes_amounts(recipe_ids):
+    amounts = Counter()
+    for ingredient, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount'):
+        amounts[ingredient] += amount
+    return amounts
+
+
+def add_recipes(user_id, recipe_ids):
+    change_totals([user_id], get_recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    amounts = get_recipes_amounts(recipe_ids)
+    change_totals([user_id], {ingredient: -amount
+                              for ingredient, amount in amounts.items()})
+
+
+def change_recipe_amounts(recipe, old_amounts, new_amounts):
+    """Переносит правку ингредиентов рецепта в списки покупок."""
+    amounts = {
+        ingredient: new_amounts.get(ingredient, 0)
+        - old_amounts.get(ingredient, 0)
+        for ingredient in {*old_amounts, *new_amounts}}
+    if not any(amounts.values()):
+        return
+    user_ids = list(Cart.objects.filter(recipe=recipe).values_list(
+        'user_id', flat=True))
+    change_totals(user_ids, amounts)
+
+
+def get_actual_totals(**filters):
+    return RecipeIngredient.objects.filter(
+        recipe__carts__isnull=False, **filters,
+    ).values('recipe__carts__user', 'ingredient').annotate(
+        actual=Sum('amount')).order_by()
+
+
+def build_shopping_lists(users, batch_size):
+    """Списки покупок пользователей users, у которых их еще нет.
+
+    Суммы читаются iterator() и вставляются пачками по batch_size.
+    """
+    rows = get_actual_totals(recipe__carts__user__in=users).values_list(
+        'recipe__carts__user', 'ingredient', 'actual').iterator(
+        chunk_size=batch_size)
+    while True:
+        batch = [ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                                  total=total)
+                 for user, ingredient, total in islice(rows, batch_size)]
+        if not batch:
+            return
+        ShoppingListItem.objects.bulk_create(batch)
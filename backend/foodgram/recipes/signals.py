@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from recipes.counters import change_counters, change_counters_bulk
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, Subscription)
+from recipes.search import delete_fts, reindex_ingredient
+from recipes.shopping_list import add_recipes, remove_recipes
+from recipes.storage import change_refcounts, get_recipe_files
+from recipes.tasks import enqueue
+from recipes.timeline import backfill_timeline, fan_out_recipes, remove_author
+
+FILE_FIELDS = ('image', 'image_variants')
+COUNTED_MODELS = (Recipe, RecipeIngredient, Subscription)
+USER_RECIPE_MODELS = (Cart, Favorite)
+_bulk = threading.local()
+
+
+def increment_counters(sender, instance, created, **kwargs):
+    if created:
+        change_counters(instance, 1)
+
+
+def decrement_counters(sender, instance, **kwargs):
+    change_counters(instance, -1)
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(increment_counters, sender=model)
+    post_delete.connect(decrement_counters, sender=model)
+
+
+def change_user_recipes(model, user_id, recipe_ids, delta):
+    """Счетчики рецептов и список покупок при правке избранного/корзины.
+
+    Общий код сигналов и пакетных операций.
+    """
+    change_counters_bulk(model, {'recipe': recipe_ids}, delta)
+    if model is Cart:
+        if delta > 0:
+            add_recipes(user_id, recipe_ids)
+        else:
+            remove_recipes(user_id, recipe_ids)
+
+
+@contextmanager
+def user_recipes_in_bulk():
+    """Собирает id рецептов вместо обработки каждой записи в сигналах.
+
+    Вызывающий затем применяет изменения одним вызовом
+    change_user_recipes.
+    """
+    _bulk.recipe_ids = recipe_ids = []
+    try:
+        yield recipe_ids
+    finally:
+        _bulk.recipe_ids = None
+
+
+def handle_user_recipe(sender, instance, delta):
+    recipe_ids = getattr(_bulk, 'recipe_ids', None)
+    if recipe_ids is not None:
+        recipe_ids.append(instance.recipe_id)
+        return
+    change_user_recipes(sender, instance.user_id, [instance.recipe_id],
+                        delta)
+
+
+def add_user_recipe(sender, instance, created, **kwargs):
+    if created:
+        handle_user_recipe(sender, instance, 1)
+
+
+def remove_user_recipe(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты
+    # еще не удалены.
+    handle_user_recipe(sender, instance, -1)
+
+
+for model in USER_RECIPE_MODELS:
+    post_save.connect(add_user_recipe, sender=model)
+    pre_delete.connect(remove_user_recipe, sender=model)
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_files(sender, instance, update_fields=None, **kwargs):
+    instance._old_files = None
+    if instance._state.adding:
+        instance._old_files = set()
+    elif update_fields is None or set(FILE_FIELDS) & set(update_fields):
+        old = sender._default_manager.filter(pk=instance.pk).values_list(
+            *FILE_FIELDS).first()
+        instance._old_files = get_recipe_files(*old) if old else set()
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_files(sender, instance, **kwargs):
+    if instance._old_files is None:
+        return
+    files = get_recipe_files(instance.image.name, instance.image_variants)
+    change_refcounts(files - instance._old_files, 1)
+    change_refcounts(instance._old_files - files, -1)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_files(sender, instance, **kwargs):
+    change_refcounts(
+        get_recipe_files(instance.image.name, instance.image_variants), -1)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        enqueue(fan_out_recipes, [instance.id])
+
+
+@receiver(post_save, sender=Subscription)
+def fill_timeline(sender, instance, created, **kwargs):
+    if created:
+        enqueue(backfill_timeline, instance.subscriber_id,
+                instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_timeline(sender, instance, **kwargs):
+    remove_author(instance.subscriber_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search(sender, instance, **kwargs):
+    delete_fts([instance.id])
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_recipes(sender, instance, created, **kwargs):
+    if not created:
+        enqueue(reindex_ingredient, instance.id)
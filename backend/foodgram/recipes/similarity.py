@@ -0,0 +1,183 @@
+import math
+from collections import Counter, defaultdict
+from heapq import nlargest
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            SimilarRecipe, filter_by_row_number)
+
+RecipeTag = Recipe.tags.through
+
+
+def load_features(recipe_ids=None):
+    """Признаки рецептов: id ингредиентов и минус id тегов."""
+    ingredients = RecipeIngredient.objects.order_by()
+    tags = RecipeTag.objects.order_by()
+    if recipe_ids is not None:
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    features = defaultdict(set)
+    for recipe_id, ingredient_id in ingredients.values_list(
+            'recipe_id', 'ingredient_id').iterator(
+            chunk_size=settings.SIMILAR_BATCH_SIZE):
+        features[recipe_id].add(ingredient_id)
+    for recipe_id, tag_id in tags.values_list('recipe_id', 'tag_id'):
+        features[recipe_id].add(-tag_id)
+    return features
+
+
+class Weights:
+    """Веса признаков по IDF для косинусного сходства.
+
+    Частые признаки (теги, соль) почти не влияют на оценку и не
+    используются для поиска кандидатов, иначе сравнение квадратичное.
+    """
+
+    def __init__(self, frequencies, total):
+        self.frequencies = frequencies
+        self.total = total
+        self.common = max(settings.SIMILAR_COMMON_SHARE * total,
+                          settings.SIMILAR_COMMON_MIN)
+
+    @classmethod
+    def from_database(cls):
+        frequencies = dict(Ingredient.objects.values_list(
+            'id', 'usage_count'))
+        frequencies.update(
+            (-tag_id, count) for tag_id, count in RecipeTag.objects.order_by(
+            ).values('tag_id').annotate(count=Count('id')).values_list(
+                'tag_id', 'count'))
+        return cls(frequencies, Recipe.custom_objects.count())
+
+    def squared(self, feature):
+        frequency = max(self.frequencies.get(feature, 1), 1)
+        return math.log(1 + self.total / frequency) ** 2
+
+    def is_candidate(self, feature):
+        return (feature > 0
+                and self.frequencies.get(feature, 1) <= self.common)
+
+    def norm(self, features):
+        return math.sqrt(sum(self.squared(feature) for feature in features))
+
+    def score(self, first, second):
+        dot = sum(self.squared(feature) for feature in first & second)
+        if not dot:
+            return 0
+        return dot / (self.norm(first) * self.norm(second))
+
+
+def score_candidates(weights, features, candidates):
+    """Пары (оценка, id) для кандидатов с ненулевым сходством."""
+    scored = []
+    for candidate_id, candidate_features in candidates.items():
+        score = weights.score(features, candidate_features)
+        if score > 0:
+            scored.append((score, candidate_id))
+    return scored
+
+
+def get_top(scored):
+    return nlargest(settings.SIMILAR_TOP_K, scored,
+                    key=lambda item: (item[0], -item[1]))
+
+
+def build_similar_recipes(batch_size, report=None):
+    """Пересчитывает похожие рецепты для всех рецептов пачками.
+
+    Признаки всех рецептов держатся в памяти, кандидаты берутся из
+    обратного индекса по редким ингредиентам.
+    """
+    features = load_features()
+    weights = Weights(Counter(chain.from_iterable(features.values())),
+                      len(features))
+    postings = defaultdict(list)
+    for recipe_id, recipe_features in features.items():
+        for feature in recipe_features:
+            if weights.is_candidate(feature):
+                postings[feature].append(recipe_id)
+    recipe_ids = sorted(features)
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        rows = []
+        for recipe_id in batch:
+            candidates = set(chain.from_iterable(
+                postings.get(feature, ()) for feature in features[recipe_id]))
+            candidates.discard(recipe_id)
+            rows.extend(
+                SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                              score=score)
+                for score, similar_id in get_top(score_candidates(
+                    weights, features[recipe_id],
+                    {candidate: features[candidate]
+                     for candidate in candidates})))
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(recipe_id__in=batch).delete()
+            SimilarRecipe.objects.bulk_create(rows)
+        if report is not None:
+            report(start + len(batch), len(recipe_ids))
+    return len(recipe_ids)
+
+
+def find_similar(recipe_id, features, weights):
+    """Кандидаты по редким ингредиентам, точная оценка для лучших."""
+    partial = Counter()
+    for candidate_id, ingredient_id in RecipeIngredient.objects.filter(
+            ingredient_id__in=[feature for feature in features
+                               if weights.is_candidate(feature)],
+    ).exclude(recipe_id=recipe_id).order_by().values_list(
+            'recipe_id', 'ingredient_id'):
+        partial[candidate_id] += weights.squared(ingredient_id)
+    return score_candidates(weights, features, load_features(
+        [candidate_id for candidate_id, _ in partial.most_common(
+            settings.SIMILAR_CANDIDATES)]))
+
+
+def refill_similar(recipe_ids, weights):
+    """Пересчитывает списки рецептов, потерявших соседа."""
+    for recipe_id, features in load_features(recipe_ids).items():
+        SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for score, similar_id in get_top(
+                find_similar(recipe_id, features, weights)))
+
+
+def update_recipe_similarity(recipe_id, weights):
+    """Соседи нового или измененного рецепта и обратные ссылки на него."""
+    affected = set(SimilarRecipe.objects.filter(
+        similar_id=recipe_id).values_list('recipe_id', flat=True))
+    SimilarRecipe.objects.filter(
+        Q(recipe_id=recipe_id) | Q(similar_id=recipe_id)).delete()
+    features = load_features([recipe_id]).get(recipe_id)
+    scored = find_similar(recipe_id, features, weights) if features else []
+    affected.difference_update(similar_id for _, similar_id in scored)
+    if affected:
+        refill_similar(affected, weights)
+    if not scored:
+        return
+    SimilarRecipe.objects.bulk_create(
+        [SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                       score=score)
+         for score, similar_id in get_top(scored)]
+        + [SimilarRecipe(recipe_id=similar_id, similar_id=recipe_id,
+                         score=score)
+           for score, similar_id in scored])
+    filter_by_row_number(
+        SimilarRecipe.objects.filter(
+            recipe_id__in=[similar_id for _, similar_id in scored]),
+        'recipe_id', [F('score').desc(), F('similar_id').asc()],
+        '>', settings.SIMILAR_TOP_K,
+    ).delete()
+
+
+def update_similar_recipes(recipe_ids):
+    weights = Weights.from_database()
+    for recipe_id in recipe_ids:
+        with transaction.atomic():
+            update_recipe_similarity(recipe_id, weights)
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+
+from recipes.models import StoredFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — sha256 его содержимого.
+
+    Одинаковые загрузки сохраняются один раз, а файл с данным именем
+    никогда не перезаписывается, поэтому его можно кэшировать навсегда.
+    """
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        hexdigest = digest.hexdigest()
+        directory, basename = posixpath.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        return posixpath.join(directory, hexdigest[:2],
+                              f'{hexdigest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            # Обновляем mtime, чтобы сборщик мусора не удалил файл,
+            # на который вот-вот появится ссылка.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+
+def get_recipe_files(image, variants):
+    names = {name for formats in variants.values()
+             for name in formats.values()}
+    if image:
+        names.add(str(image))
+    return names
+
+
+def change_refcounts(names, delta):
+    if not names or not delta:
+        return
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name) for name in names], ignore_conflicts=True)
+    StoredFile.objects.filter(name__in=names).update(
+        refcount=F('refcount') + delta, updated=timezone.now())
+
+
+def walk_files(storage, directory):
+    directories, files = storage.listdir(directory)
+    for file in files:
+        yield posixpath.join(directory, file)
+    for subdirectory in directories:
+        yield from walk_files(storage,
+                              posixpath.join(directory, subdirectory))
@@ -0,0 +1,26 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(max_workers=settings.TASK_WORKERS,
+                              thread_name_prefix='foodgram-task')
+
+
+def run_task(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s%s', func.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def enqueue(func, *args):
+    """Запускает задачу в локальном пуле после фиксации транзакции."""
+    if settings.TASK_ALWAYS_EAGER:
+        transaction.on_commit(lambda: func(*args))
+    else:
+        transaction.on_commit(lambda: executor.submit(run_task, func, *args))
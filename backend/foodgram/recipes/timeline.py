@@ -0,0 +1,165 @@
+from collections import defaultdict
+from heapq import nlargest
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from recipes.models import (Recipe, Subscription, TimelineEntry,
+                            filter_by_row_number)
+from users.models import User
+
+
+def is_fan_out_on_read(author):
+    """У популярных авторов ленты собираются при чтении."""
+    return author.followers_count > settings.FEED_FANOUT_LIMIT
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах только FEED_MAX_LENGTH новейших записей."""
+    filter_by_row_number(
+        TimelineEntry.objects.filter(user_id__in=user_ids), 'user_id',
+        [F('pub_date').desc(), F('recipe_id').desc()],
+        '>', settings.FEED_MAX_LENGTH,
+    ).delete()
+
+
+def add_entries(entries):
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        trim_timelines({entry.user_id for entry in entries})
+
+
+def fan_out_recipes(recipe_ids):
+    """Раскладывает новые рецепты по лентам подписчиков пачками."""
+    recipes_by_author = defaultdict(list)
+    for recipe_id, author_id, pub_date in Recipe.custom_objects.filter(
+            pk__in=recipe_ids,
+            author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).values_list('id', 'author_id', 'pub_date'):
+        recipes_by_author[author_id].append((recipe_id, pub_date))
+    if not recipes_by_author:
+        return
+    followers = Subscription.objects.filter(
+        author_id__in=recipes_by_author).order_by('pk').values_list(
+        'pk', 'subscriber_id', 'author_id')
+    last_id = 0
+    while True:
+        rows = list(followers.filter(
+            pk__gt=last_id)[:settings.FEED_BATCH_SIZE])
+        if not rows:
+            return
+        add_entries([
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                          pub_date=pub_date)
+            for _, user_id, author_id in rows
+            for recipe_id, pub_date in recipes_by_author[author_id]])
+        last_id = rows[-1][0]
+
+
+def backfill_timeline(user_id, author_id):
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    author = User.objects.filter(pk=author_id).first()
+    if author is None or is_fan_out_on_read(author):
+        return
+    recipes = Recipe.custom_objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')
+    entries = [
+        TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                      pub_date=pub_date)
+        for recipe_id, pub_date in recipes[:settings.FEED_MAX_LENGTH]]
+    if entries:
+        add_entries(entries)
+
+
+def build_timelines(subscriptions):
+    """Собирает ленты по подпискам из subscriptions, например после
+    массовой загрузки в обход сигналов.
+
+    Подписки читаются iterator() в порядке подписчиков пачками по
+    FEED_BATCH_SIZE. На пачку берутся последние FEED_MAX_LENGTH
+    рецептов ее авторов, и в ленту каждого подписчика попадают
+    FEED_MAX_LENGTH новейших; память ограничена размером пачки.
+    """
+    rows = subscriptions.filter(
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).order_by('subscriber_id').values_list(
+        'subscriber_id', 'author_id').iterator(
+        chunk_size=settings.FEED_BATCH_SIZE)
+    while True:
+        batch = list(islice(rows, settings.FEED_BATCH_SIZE))
+        if not batch:
+            return
+        recipes = defaultdict(list)
+        for recipe_id, author_id, pub_date in filter_by_row_number(
+                Recipe.custom_objects.filter(
+                    author_id__in={author_id for _, author_id in batch}),
+                'author_id', [F('pub_date').desc(), F('id').desc()],
+                '<=', settings.FEED_MAX_LENGTH,
+        ).values_list('id', 'author_id', 'pub_date'):
+            recipes[author_id].append((pub_date, recipe_id))
+        feeds = defaultdict(list)
+        for user_id, author_id in batch:
+            feeds[user_id].extend(recipes[author_id])
+        entries = (
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                          pub_date=pub_date)
+            for user_id, feed in feeds.items()
+            for pub_date, recipe_id in nlargest(
+                settings.FEED_MAX_LENGTH, feed))
+        with transaction.atomic():
+            while True:
+                chunk = list(islice(entries, settings.FEED_BATCH_SIZE))
+                if not chunk:
+                    break
+                TimelineEntry.objects.bulk_create(
+                    chunk, ignore_conflicts=True)
+            # Подписки одного пользователя могут попасть в две пачки.
+            trim_timelines(list(feeds))
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id).delete()
+
+
+def after_key(queryset, recipe_field, cursor):
+    """Строки после ключа (pub_date, id) при сортировке по убыванию.
+
+    Условие pub_date <= задает начало диапазона индекса, остальное
+    отсекает рецепты с той же датой.
+    """
+    if cursor is None:
+        return queryset
+    pub_date, recipe_id = cursor
+    return queryset.filter(
+        Q(pub_date__lt=pub_date)
+        | Q(pub_date=pub_date, **{f'{recipe_field}__lt': recipe_id}),
+        pub_date__lte=pub_date)
+
+
+def get_feed_ids(user, cursor, size):
+    """id рецептов страницы ленты, новые первыми.
+
+    cursor - ключ (pub_date, id) последнего рецепта прошлой страницы.
+    Из TimelineEntry читается диапазон индекса (user, pub_date, recipe)
+    с LIMIT. Рецепты популярных авторов в ленты не раскладываются: они
+    добавляются таким же срезом из Recipe по индексу (author, pub_date).
+    """
+    entries = after_key(
+        TimelineEntry.objects.filter(user=user), 'recipe_id', cursor,
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id')
+    keys = set(entries[:size])
+    popular = list(Subscription.objects.filter(
+        subscriber=user,
+        author__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('author_id', flat=True))
+    if popular:
+        recipes = after_key(
+            Recipe.custom_objects.filter(author_id__in=popular), 'id',
+            cursor,
+        ).order_by('-pub_date', '-id').values_list('pub_date', 'id')
+        keys.update(recipes[:size])
+    return [recipe_id for _, recipe_id in sorted(keys, reverse=True)[:size]]
@@ -14,20 +14,12 @@ class UserAdmin(BaseUserAdmin):
         'first_name',
         'last_name',
         'recipes_count',
-        'subscribers_count',
-
+        'followers_count',
+        'following_count',
     )
     search_fields = ('username', 'email',)
     list_filter = ('username', 'email',)
     list_display_links = ('id', 'username', 'email',)
 
-    @admin.display(description='Счетчик рецептов')
-    def recipes_count(self, obj):
-        return obj.recipes.all().count()
-
-    @admin.display(description='Счетчик подписчиков')
-    def subscribers_count(self, obj):
-        return obj.following.all().count()
-
 
 admin.site.unregister(Group)
@@ -3,10 +3,10 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from api.mixins import validate_username
+from api.mixins import CounterFieldsMixin, validate_username
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username', 'password']
     username = models.CharField(
@@ -34,6 +34,23 @@ class User(AbstractUser):
         _('password'),
         max_length=settings.LENGTH150,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Счетчик рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Счетчик подписчиков',
+        default=0,
+        editable=False,
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Счетчик подписок',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count', 'followers_count', 'following_count')
 
     class Meta:
         verbose_name = 'Пользователь'